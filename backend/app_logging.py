@@ -0,0 +1,272 @@
+# backend/app_logging.py
+# 構造化ログ (JSON Lines) をイベントループを止めずに出力する
+#
+# print は標準出力への書き込みが終わるまで呼び出し元 (イベントループ) を止めてしまいます。
+# ここではログのレコードをバッファに積むだけにして、書式化 (JSON) と書き込みは別スレッドがまとめて行います。
+# バッファがあふれた場合は待たずに捨て、捨てた件数を /metrics の log_records_dropped_total に出します。
+#
+#   log = get_logger("auth")
+#   log.info("auth.login", user_id=user.id)
+#   -> {"ts": "...", "level": "info", "logger": "backend.auth", "event": "auth.login", "user_id": 1}
+#
+# パスワード・トークン・リクエスト本文など (REDACTED_KEYS) の値は、デフォルトで "[REDACTED]" に置き換えます。
+# DEBUG / INFO のログは LOG_SAMPLE_RATE / LOG_SAMPLE_RATES で間引けます (WARNING 以上は間引きません)。
+# 間引いたログには sample_rate を付けるので、集計するときは 1 / sample_rate 倍してください。
+#
+# 環境変数:
+#   LOG_LEVEL          出力するレベル (デフォルト: INFO)
+#   LOG_LEVELS         ロガーごとのレベル (例: backend.sql=DEBUG,backend.chat=WARNING)
+#   LOG_SAMPLE_RATE    DEBUG / INFO のログを残す割合 (0〜1、デフォルト: 1)
+#   LOG_SAMPLE_RATES   イベントごとの割合 (例: chat.stream.first_token=0.1)
+#   LOG_REDACT         false で秘密情報・本文を伏せない (ローカルでの調査用、デフォルト: true)
+#   LOG_QUEUE_SIZE     出力待ちのレコードの上限 (デフォルト: 10000)
+#   LOG_FLUSH_INTERVAL_SECONDS  書き出しの間隔 (デフォルト: 0.2)
+#   LOG_FLUSH_BATCH    これだけたまったら間隔を待たずに書き出す (デフォルト: 500)
+
+import atexit
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, Optional, TextIO
+
+from dotenv import load_dotenv
+
+from . import metrics
+
+load_dotenv()
+
+
+def _parse_pairs(value: str) -> Dict[str, str]:
+    pairs = {}
+    for item in filter(None, (item.strip() for item in value.split(","))):
+        name, _, setting = item.partition("=")
+        pairs[name.strip()] = setting.strip()
+    return pairs
+
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = {name: level.upper() for name, level in _parse_pairs(os.getenv("LOG_LEVELS", "")).items()}
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))
+LOG_SAMPLE_RATES = {event: float(rate) for event, rate in _parse_pairs(os.getenv("LOG_SAMPLE_RATES", "")).items()}
+LOG_REDACT = os.getenv("LOG_REDACT", "true").lower() == "true"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_FLUSH_INTERVAL_SECONDS = float(os.getenv("LOG_FLUSH_INTERVAL_SECONDS", "0.2"))
+LOG_FLUSH_BATCH = int(os.getenv("LOG_FLUSH_BATCH", "500"))
+
+ROOT_LOGGER = "backend"
+REDACTED = "[REDACTED]"
+# 値を伏せるキー (小文字で比較。_token / password で終わるキーも伏せる)
+REDACTED_KEYS = frozenset({
+    "password", "token", "access_token", "refresh_token", "id_token", "reset_token", "secret",
+    "authorization", "cookie", "body", "input",
+})
+
+
+def _is_secret_key(key) -> bool:
+    key = str(key).lower()
+    return key in REDACTED_KEYS or key.endswith(("_token", "password", "_secret"))
+
+
+def redact(value):
+    """dict / list を辿って、秘密情報のキーの値を伏せたコピーを返します。"""
+    if isinstance(value, dict):
+        return {key: REDACTED if _is_secret_key(key) else redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return value
+
+
+def format_entry(entry: tuple, redact_secrets: bool = LOG_REDACT) -> str:
+    """(時刻, レベル, ロガー名, イベント名, フィールド, 例外) を1行の JSON にします (書き出し用のスレッドで呼ばれる)。"""
+    created, level, name, event, fields, exc_info = entry
+    document = {
+        "ts": datetime.fromtimestamp(created, timezone.utc).isoformat(timespec="milliseconds"),
+        "level": logging.getLevelName(level).lower(),
+        "logger": name,
+        "event": event,
+    }
+    if fields:
+        document.update(redact(fields) if redact_secrets else fields)
+    if exc_info:
+        document["exc"] = "".join(traceback.format_exception(*exc_info)).rstrip()
+    return json.dumps(document, ensure_ascii=False, default=str)
+
+
+class _BufferedHandler(logging.Handler):
+    """
+    ログをバッファ (deque) に積むだけのハンドラー。書式化と書き込みは書き出し用のスレッドがまとめて行います。
+    queue.Queue は積むたびに待っているスレッドを起こし、そのスレッドがイベントループと GIL を取り合うので使いません。
+    書き出し用のスレッドは LOG_FLUSH_INTERVAL_SECONDS ごと、またはバッファが LOG_FLUSH_BATCH 件たまったときに起きます。
+    EventLogger は LogRecord を作らずに submit() でタプルを積みます (LogRecord の生成だけで数マイクロ秒かかるため)。
+    """
+
+    def __init__(self, stream: TextIO, max_records: int = LOG_QUEUE_SIZE):
+        super().__init__()
+        self.stream = stream
+        self.max_records = max_records
+        self.dropped = 0
+        self._entries: deque = deque()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def submit(self, entry: tuple) -> None:
+        # deque の append / len はスレッドセーフなので、ロックを取らない (上限を少し超えることはある)
+        if len(self._entries) >= self.max_records:
+            self.dropped += 1
+            return
+        self._entries.append(entry)
+        if len(self._entries) == LOG_FLUSH_BATCH:
+            self._wakeup.set()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """logging.getLogger("backend....") で直接出されたログ。"""
+        self.submit((record.created, record.levelno, record.name, record.getMessage(), getattr(record, "fields", None), record.exc_info))
+
+    def pending(self) -> int:
+        return len(self._entries)
+
+    def _drain(self) -> None:
+        lines = []
+        while self._entries:
+            entry = self._entries.popleft()
+            try:
+                lines.append(format_entry(entry))
+            except Exception as e:
+                lines.append(json.dumps({"level": "error", "logger": ROOT_LOGGER, "event": "log.format_error", "error": str(e)}))
+        if lines:
+            try:
+                self.stream.write("\n".join(lines) + "\n")
+                self.stream.flush()
+            except Exception:
+                pass # 書き込めなくてもアプリは止めない
+
+    def _run(self) -> None:
+        while not self._stopping:
+            self._wakeup.wait(LOG_FLUSH_INTERVAL_SECONDS)
+            self._wakeup.clear()
+            self._drain()
+        self._drain()
+
+    def close(self) -> None:
+        """バッファに残っているレコードを書き出してから、書き出し用のスレッドを止めます。"""
+        if self._thread.is_alive():
+            self._stopping = True
+            self._wakeup.set()
+            self._thread.join()
+        super().close()
+
+
+_handler: Optional[_BufferedHandler] = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging(stream: Optional[TextIO] = None) -> None:
+    """
+    "backend" 以下のロガーの出力先をバッファにして、JSON を stream (デフォルト: 標準出力) に書き出すスレッドを起動します。
+    もう一度呼ぶと、それまでのバッファを書き出してから設定し直します。
+    """
+    global _handler
+    with _setup_lock:
+        _close_handler()
+        _handler = _BufferedHandler(stream or sys.stdout)
+
+        root = logging.getLogger(ROOT_LOGGER)
+        root.handlers = [_handler]
+        root.setLevel(LOG_LEVEL)
+        root.propagate = False
+        for name, level in LOG_LEVELS.items():
+            logging.getLogger(name).setLevel(level)
+        _handler.start()
+
+
+def _close_handler() -> None:
+    global _handler
+    if _handler is not None:
+        _handler.close()
+        logging.getLogger(ROOT_LOGGER).removeHandler(_handler)
+        _handler = None
+
+
+def shutdown_logging() -> None:
+    """出力待ちのログを書き出して、書き出し用のスレッドを止めます。"""
+    with _setup_lock:
+        _close_handler()
+
+
+atexit.register(shutdown_logging)
+
+
+class EventLogger:
+    """
+    イベント名とキーワード引数のフィールドで記録するロガー。
+    レベルで無効なログと間引かれたログは、レコードを作らずにすぐ戻ります。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._logger = logging.getLogger(name) # レベルの設定 (LOG_LEVEL / LOG_LEVELS) にだけ使う
+
+    def _log(self, level: int, event: str, fields: dict, exc_info=None) -> None:
+        if not self._logger.isEnabledFor(level):
+            return
+        if level < logging.WARNING:
+            rate = LOG_SAMPLE_RATES.get(event, LOG_SAMPLE_RATE)
+            if rate < 1:
+                if random.random() >= rate:
+                    return
+                fields["sample_rate"] = rate
+        handler = _handler
+        if handler is not None:
+            handler.submit((time.time(), level, self.name, event, fields, exc_info))
+
+    def debug(self, event: str, **fields) -> None:
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event: str, **fields) -> None:
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event: str, **fields) -> None:
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event: str, **fields) -> None:
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event: str, **fields) -> None:
+        """except ブロックの中で呼び、トレースバックを exc に付けます。"""
+        self._log(logging.ERROR, event, fields, exc_info=sys.exc_info())
+
+
+def get_logger(name: str) -> EventLogger:
+    """backend.<name> のロガーを返します。まだ設定されていなければ setup_logging() を行います。"""
+    if _handler is None:
+        setup_logging()
+    return EventLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def get_stats() -> dict:
+    return {
+        "queued": _handler.pending() if _handler else 0,
+        "dropped": _handler.dropped if _handler else 0,
+    }
+
+
+def _collect():
+    stats = get_stats()
+    return [
+        ("log_records_dropped_total", "counter", "Log records dropped because the log buffer was full.", [({}, stats["dropped"])]),
+        ("log_queue_depth", "gauge", "Log records waiting to be written.", [({}, stats["queued"])]),
+    ]
+
+
+metrics.register_collector(_collect)
@@ -0,0 +1,296 @@
+# backend/async_crud.py
+# crud.py の非同期版 (AsyncSession 用)
+# クエリの組み立てや予測・統計の計算ロジックは crud.py のものを共有し、I/O だけを await します。
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .database import User, Period, PasswordResetToken, ChatMessage, UserCycleStats
+from .schemas import UserCreate, PeriodCreate, PeriodUpdate, ChatMessageCreate, PeriodImportRowError
+from . import bulk_load, password_hashing, period_calendar, period_forecast
+from .prediction_engines import get_prediction_engine
+from .crud import (
+    _new_user,
+    _apply_completed_period,
+    _subtract_completed_period,
+    _completed_start_bounds_query,
+    _completed_periods_query,
+    _completed_history_query,
+    _reset_cycle_stats,
+    _DIALECT_INSERTS,
+    _new_cycle_stats_values,
+    _insert_missing_cycle_stats,
+    _lock_user_query,
+    _locked_cycle_stats_query,
+    average_period_data_from_stats,
+    _new_period,
+    _active_period_query,
+    _periods_query,
+    _apply_period_update,
+    _set_period_predictions,
+    _user_period_ranges_query,
+    _latest_period_start_query,
+    _completed_start_dates_query,
+    _forecast_params,
+    _periods_watermark_query,
+    _plan_period_import,
+    _export_periods_query,
+    _export_chat_messages_query,
+    _new_password_reset_token,
+    _password_reset_token_query,
+    _new_chat_message,
+    _chat_messages_query,
+    _chat_messages_watermark_query,
+)
+from datetime import date, datetime, timezone
+from typing import AsyncIterator, List, Optional, Tuple
+
+# ==== User CRUD ====
+
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[User]:
+    return (await db.scalars(select(User).where(User.email == email))).first()
+
+async def get_user_by_id(db: AsyncSession, user_id: int) -> Optional[User]:
+    return await db.get(User, user_id)
+
+async def get_user_by_google_sub(db: AsyncSession, google_sub: str) -> Optional[User]:
+    return (await db.scalars(select(User).where(User.google_sub == google_sub))).first()
+
+async def create_user(db: AsyncSession, user: UserCreate, auth_provider: str = "local", google_sub: str = None) -> User:
+    """
+    新しいユーザーを作成します。
+    """
+    hashed_password = None
+    if user.password: # パスワードが提供されている場合のみハッシュ化
+        hashed_password = await password_hashing.hash_password(user.password) # ワーカープールで実行
+
+    db_user = _new_user(user, hashed_password, auth_provider, google_sub)
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+# ==== Cycle Stats ====
+
+async def _create_missing_cycle_stats(db: AsyncSession, user_id: int) -> bool:
+    """周期統計の行がなければ空の行を作ります。作った場合は True を返します。"""
+    dialect_insert = _DIALECT_INSERTS.get(db.get_bind().dialect.name)
+    if dialect_insert is not None:
+        return bool((await db.execute(_insert_missing_cycle_stats(dialect_insert, user_id))).rowcount)
+    await db.execute(_lock_user_query(user_id))
+    if (await db.execute(_locked_cycle_stats_query(user_id))).scalar_one_or_none() is not None:
+        return False
+    db.add(UserCycleStats(**_new_cycle_stats_values(user_id)))
+    await db.flush()
+    return True
+
+async def rebuild_user_cycle_stats(db: AsyncSession, user_id: int) -> UserCycleStats:
+    """
+    periodsテーブルからユーザーの周期統計を作り直します（修復用）。
+    コミットは呼び出し側で行います。
+    """
+    await _create_missing_cycle_stats(db, user_id)
+    stats = (await db.execute(_locked_cycle_stats_query(user_id))).scalar_one()
+
+    completed_periods = (await db.execute(_completed_periods_query(user_id))).all()
+    _reset_cycle_stats(stats, completed_periods)
+    return stats
+
+async def get_user_cycle_stats(db: AsyncSession, user_id: int, for_update: bool = False) -> UserCycleStats:
+    """
+    ユーザーの周期統計を取得します。まだ存在しない場合はperiodsから構築します。
+    統計を書き換える場合は for_update=True にして、コミットまで行をロックしてください。
+    """
+    if not for_update:
+        stats = await db.get(UserCycleStats, user_id)
+        if stats is not None:
+            return stats
+    if await _create_missing_cycle_stats(db, user_id):
+        return await rebuild_user_cycle_stats(db, user_id) # 今作った空の行を periods から構築する
+    return (await db.execute(_locked_cycle_stats_query(user_id))).scalar_one()
+
+async def calculate_average_period_data(db: AsyncSession, user_id: int) -> Tuple[int, int]:
+    """
+    ユーザーの平均生理期間と平均生理周期を計算します。
+    mean エンジンは周期統計から、それ以外のエンジンは完了済みの履歴から求めます。
+    """
+    engine = get_prediction_engine()
+    if engine.uses_cycle_stats:
+        return average_period_data_from_stats(await get_user_cycle_stats(db, user_id))
+    return engine.predict((await db.execute(_completed_history_query(user_id))).all())
+
+async def _remove_completed_period(db: AsyncSession, stats: UserCycleStats, period_id: int, start_date: date, end_date: date) -> None:
+    if _subtract_completed_period(stats, start_date, end_date):
+        stats.first_start_date, stats.last_start_date = (
+            await db.execute(_completed_start_bounds_query(stats.user_id, period_id))
+        ).one()
+
+# ==== Period CRUD ====
+
+async def create_period(db: AsyncSession, period: PeriodCreate, user_id: int) -> Period:
+    """
+    新しい生理期間記録を作成します。
+    この関数は、「この生理の予測終了日」を計算し、`prediction_end_date`に保存します。
+    """
+    avg_period_length, _ = await calculate_average_period_data(db, user_id)
+
+    db_period = _new_period(period, user_id, avg_period_length)
+    db.add(db_period)
+    await db.commit()
+    await db.refresh(db_period) # DBが生成したIDなどを取得するためにリフレッシュ
+    return db_period
+
+async def get_active_period(db: AsyncSession, user_id: int) -> Optional[Period]:
+    """
+    ユーザーの進行中（end_date が NULL）の生理期間を取得します。
+    """
+    return (await db.scalars(_active_period_query(user_id))).first()
+
+async def get_periods(
+    db: AsyncSession,
+    user_id: int,
+    skip: int = 0,
+    limit: Optional[int] = 100,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    order_by: str = "start_date",
+    order_direction: str = "desc",
+    cursor: Optional[str] = None,
+) -> List[Period]:
+    """
+    指定されたユーザーの生理記録を全て取得します（フィルタリングオプション付き）。
+    """
+    query = _periods_query(user_id, start_date, end_date, order_by, order_direction, cursor)
+    query = query.offset(skip).limit(limit)
+    return list(await db.scalars(query))
+
+async def get_period_by_id(db: AsyncSession, period_id: int, user_id: int) -> Optional[Period]:
+    """
+    指定されたIDの生理記録を取得します（ユーザーIDでフィルタリング）。
+    """
+    return (await db.scalars(select(Period).where(Period.id == period_id, Period.user_id == user_id))).first()
+
+async def update_period(db: AsyncSession, db_period: Period, period_update: PeriodUpdate) -> Period:
+    """
+    生理期間記録を更新します。
+    start_dateまたはend_dateが変更された場合、関連する予測日と周期統計を同じトランザクションで更新します。
+    """
+    original_start_date = db_period.start_date
+    original_end_date = db_period.end_date
+
+    if _apply_period_update(db_period, period_update):
+        # 予測には今回の書き込み前の統計を使う (autoflush しないので、DBにはまだ変更前の値が入っている)
+        # 統計を先に取得して参照を持っておく (Session の identity map は弱参照なので、
+        # calculate_average_period_data の後に取得すると同じ行をもう一度 SELECT してしまう)
+        # 行はコミットまでロックして、同じユーザーの同時の更新と差分が混ざらないようにする
+        stats = await get_user_cycle_stats(db, db_period.user_id, for_update=True)
+        avg_period_length, avg_cycle_length = await calculate_average_period_data(db, db_period.user_id)
+
+        if original_start_date is not None and original_end_date is not None:
+            await _remove_completed_period(db, stats, db_period.id, original_start_date, original_end_date)
+        if db_period.start_date is not None and db_period.end_date is not None:
+            _apply_completed_period(stats, db_period.start_date, db_period.end_date)
+        stats.updated_at = datetime.now(timezone.utc)
+
+        _set_period_predictions(db_period, avg_period_length, avg_cycle_length)
+
+    db_period.updated_at = datetime.now(timezone.utc)
+
+    db.add(db_period)
+    await db.commit()
+    await db.refresh(db_period)
+    return db_period
+
+async def get_periods_watermark(db: AsyncSession, user_id: int) -> tuple:
+    """ユーザーの生理記録の変更の目印 (最大 updated_at, 件数)。ETag に使います。"""
+    return tuple((await db.execute(_periods_watermark_query(user_id))).one())
+
+async def get_calendar_day_states(db: AsyncSession, user_id: int, range_start: date, range_end: date, today: date) -> dict:
+    """
+    range_start〜range_end の日ごとのカレンダーの状態を計算します (period_calendar.build_day_states)。
+    """
+    periods = await db.scalars(_periods_query(user_id, range_start, range_end, order_direction="asc"))
+    latest_start = await db.scalar(_latest_period_start_query(user_id))
+    avg_period_length, avg_cycle_length = await calculate_average_period_data(db, user_id)
+    return period_calendar.build_day_states(
+        range_start, range_end,
+        [(p.start_date, p.end_date, p.prediction_end_date) for p in periods],
+        latest_start, avg_period_length, avg_cycle_length, today,
+    )
+
+async def get_forecast_params(db: AsyncSession, user_id: int) -> period_forecast.ForecastParams:
+    """
+    複数周期の予測 (period_forecast.build_forecast) の元になる値を求めます。
+    """
+    latest_start = await db.scalar(_latest_period_start_query(user_id))
+    averages = await calculate_average_period_data(db, user_id)
+    start_dates = (await db.scalars(_completed_start_dates_query(user_id))).all()
+    return _forecast_params(latest_start, averages, start_dates)
+
+async def import_periods(db: AsyncSession, user_id: int, raw_rows: list) -> Tuple[int, List[PeriodImportRowError]]:
+    """
+    生理期間をまとめてインポートします。問題のある行はスキップし、(挿入件数, 行ごとのエラー) を返します。
+    全行を executemany (PostgreSQL で行数が多い場合は COPY) で挿入し、周期統計の更新と合わせて1回だけコミットします。
+    """
+    stats = await get_user_cycle_stats(db, user_id, for_update=True)
+    existing = (await db.execute(_user_period_ranges_query(user_id))).all()
+    period_rows, errors = _plan_period_import(stats, raw_rows, existing)
+    if period_rows:
+        # 上の SELECT でトランザクションが始まっているので、COPY も同じトランザクションで実行される
+        columns = list(period_rows[0])
+        await bulk_load.async_copy_rows(await db.connection(), Period.__table__, columns, [tuple(row[name] for name in columns) for row in period_rows])
+    await db.commit()
+    return len(period_rows), errors
+
+# ==== Export ====
+
+async def stream_rows(db: AsyncSession, query, batch_size: int = 500) -> AsyncIterator[dict]:
+    """
+    サーバーサイドカーソル (yield_per) でクエリ結果を batch_size 件ずつ取り出し、1行ずつ返します。
+    結果全体をメモリに載せないので、件数が多くてもメモリ使用量は一定です。
+    """
+    result = await db.stream(query.execution_options(yield_per=batch_size))
+    async for partition in result.mappings().partitions():
+        for row in partition:
+            yield row
+
+def stream_periods_for_export(db: AsyncSession, user_id: int, after_id: int = 0, batch_size: int = 500) -> AsyncIterator[dict]:
+    return stream_rows(db, _export_periods_query(user_id, after_id), batch_size)
+
+def stream_chat_messages_for_export(db: AsyncSession, user_id: int, after_id: int = 0, batch_size: int = 500) -> AsyncIterator[dict]:
+    return stream_rows(db, _export_chat_messages_query(user_id, after_id), batch_size)
+
+# ==== Password Reset Token CRUD ====
+
+async def create_password_reset_token(db: AsyncSession, user_id: int) -> PasswordResetToken:
+    db_token = _new_password_reset_token(user_id)
+    db.add(db_token)
+    await db.commit()
+    await db.refresh(db_token)
+    return db_token
+
+async def get_password_reset_token(db: AsyncSession, token: str) -> Optional[PasswordResetToken]:
+    return (await db.scalars(_password_reset_token_query(token))).first()
+
+async def delete_password_reset_token(db: AsyncSession, token_id: int) -> bool:
+    db_token = await db.get(PasswordResetToken, token_id)
+    if db_token:
+        await db.delete(db_token)
+        await db.commit()
+        return True
+    return False
+
+# ==== ChatMessage CRUD ====
+
+async def create_chat_message(db: AsyncSession, chat_message: ChatMessageCreate, user_id: int, ai_response: str, is_partial: bool = False) -> ChatMessage:
+    db_chat_message = _new_chat_message(chat_message, user_id, ai_response, is_partial=is_partial)
+    db.add(db_chat_message)
+    await db.commit()
+    await db.refresh(db_chat_message)
+    return db_chat_message
+
+async def get_chat_messages_watermark(db: AsyncSession, user_id: int) -> tuple:
+    """ユーザーのチャット履歴の変更の目印 (最大 timestamp, 最大 id, 件数)。ETag に使います。"""
+    return tuple((await db.execute(_chat_messages_watermark_query(user_id))).one())
+
+async def get_chat_messages(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 100, cursor: Optional[str] = None) -> List[ChatMessage]:
+    return list(await db.scalars(_chat_messages_query(user_id, cursor).offset(skip).limit(limit)))
@@ -0,0 +1,89 @@
+# backend/auth_cache.py
+# get_current_user 用のプロセス内キャッシュ
+#
+# 認証が必要なリクエストのたびに JWT のデコードと users テーブルの参照が走らないように、
+# デコード済みトークンと解決済みユーザーを TTL + LRU (件数上限あり) でキャッシュします。
+# パスワードやプロフィールを変更したら invalidate_user() を呼んでください。
+#
+# 環境変数:
+#   AUTH_CACHE_TTL_SECONDS   キャッシュの有効期間 (デフォルト 60秒、0 で無効)
+#   AUTH_CACHE_MAXSIZE       トークン・ユーザーそれぞれの最大件数 (デフォルト 10000)
+
+import os
+import threading
+import time
+from typing import Optional
+
+from cachetools import TTLCache
+from dotenv import load_dotenv
+
+from .database import User
+
+load_dotenv()
+
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", 60))
+AUTH_CACHE_MAXSIZE = int(os.getenv("AUTH_CACHE_MAXSIZE", 10000))
+
+_lock = threading.Lock()
+_token_cache: Optional[TTLCache] = None
+_user_cache: Optional[TTLCache] = None
+if AUTH_CACHE_TTL_SECONDS > 0:
+    _token_cache = TTLCache(maxsize=AUTH_CACHE_MAXSIZE, ttl=AUTH_CACHE_TTL_SECONDS)
+    _user_cache = TTLCache(maxsize=AUTH_CACHE_MAXSIZE, ttl=AUTH_CACHE_TTL_SECONDS)
+
+
+def get_token_payload(token: str) -> Optional[dict]:
+    """キャッシュ済みのデコード結果を返します。トークンの有効期限 (exp) が切れていれば None。"""
+    if _token_cache is None:
+        return None
+    with _lock:
+        payload = _token_cache.get(token)
+    if payload is None:
+        return None
+    exp = payload.get("exp")
+    if exp is not None and exp <= time.time():
+        with _lock:
+            _token_cache.pop(token, None)
+        return None
+    return payload
+
+
+def set_token_payload(token: str, payload: dict) -> None:
+    if _token_cache is None:
+        return
+    with _lock:
+        _token_cache[token] = payload
+
+
+def get_user(user_id: int) -> Optional[User]:
+    if _user_cache is None:
+        return None
+    with _lock:
+        return _user_cache.get(user_id)
+
+
+def set_user(user: User) -> None:
+    """
+    ユーザーをキャッシュします。
+    キャッシュしたオブジェクトは複数のリクエストで共有されるので、セッションから切り離した状態で渡してください。
+    """
+    if _user_cache is None:
+        return
+    with _lock:
+        _user_cache[user.id] = user
+
+
+def invalidate_user(user_id: int) -> None:
+    """パスワードやプロフィールが変更されたときに呼び、次のリクエストでDBから読み直させます。"""
+    if _user_cache is None:
+        return
+    with _lock:
+        _user_cache.pop(user_id, None)
+
+
+def clear() -> None:
+    with _lock:
+        if _token_cache is not None:
+            _token_cache.clear()
+        if _user_cache is not None:
+            _user_cache.clear()
@@ -0,0 +1,2 @@
+# backend/benchmarks
+# 性能計測用のスクリプト群 (python -m backend.benchmarks.<name> で実行)
@@ -0,0 +1,201 @@
+# backend/benchmarks/api_load.py
+# APIの負荷試験
+#
+# 一時データベース (SQLite、BENCH_POSTGRES_URL を設定した場合は PostgreSQL) で backend.main:app を uvicorn で起動し (LLMは fake_llm)、
+# 実際の使われ方に近い組み合わせのリクエストを同時に送って、ルートごとの p50/p95/p99 と req/s を計測します。
+#   login        : POST /auth/login-email
+#   calendar     : GET  /periods/calendar?months=3
+#   periods      : GET  /periods/?limit=50
+#   period_write : POST /periods/ (生理開始) と PATCH /periods/{id}/end (生理終了) を交互に
+#   chat         : POST /chat/
+# 組み合わせの比率は --mix で変えられます (例: --mix calendar=60,chat=10)。
+#
+# 使い方: python -m backend.benchmarks.api_load --requests 3000 --concurrency 20 --output api_load.json
+#         (結果の JSON は python -m backend.benchmarks.compare で別のコミットの結果と比較できます)
+
+import argparse
+import asyncio
+import os
+import random
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+from .common import free_port, latency_summary, serve_in_thread, use_temp_database, write_results
+
+DEFAULT_MIX = {"login": 10, "calendar": 40, "periods": 15, "period_write": 15, "chat": 20}
+PASSWORD = "benchmark-password"
+
+
+def parse_mix(value: str) -> dict:
+    mix = dict(DEFAULT_MIX)
+    for item in filter(None, value.split(",")):
+        name, weight = item.split("=")
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"Unknown action: {name} (choose from {', '.join(DEFAULT_MIX)})")
+        mix[name] = int(weight)
+    return mix
+
+
+class VirtualUser:
+    """1人のユーザーの状態 (トークン、進行中の生理、次に記録する開始日)。"""
+
+    def __init__(self, email: str, token: str, next_start: date):
+        self.email = email
+        self.token = token
+        self.next_start = next_start
+        self.active_period_id = None
+
+    @property
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+def history_rows(periods: int, first_start: date) -> list:
+    rows = []
+    start = first_start
+    for _ in range(periods):
+        rows.append({"start_date": start.isoformat(), "end_date": (start + timedelta(days=random.randint(3, 7) - 1)).isoformat()})
+        start += timedelta(days=random.randint(24, 35))
+    return rows
+
+
+async def setup_users(client, users: int, periods_per_user: int) -> list:
+    virtual_users = []
+    for i in range(users):
+        email = f"load{i}@example.com"
+        response = await client.post("/auth/register", json={"email": email, "password": PASSWORD, "name": f"load{i}"})
+        response.raise_for_status()
+        user = VirtualUser(email, response.json()["access_token"], date(2020, 1, 1))
+        rows = history_rows(periods_per_user, date(2020, 1, 1))
+        if rows:
+            response = await client.post("/periods/import", json=rows, headers=user.headers)
+            response.raise_for_status()
+            user.next_start = date.fromisoformat(rows[-1]["start_date"]) + timedelta(days=30)
+        virtual_users.append(user)
+    return virtual_users
+
+
+async def run_action(client, action: str, user: VirtualUser):
+    """1リクエストを送り、(ルート名, レスポンス) を返します。"""
+    if action == "login":
+        response = await client.post("/auth/login-email", json={"email": user.email, "password": PASSWORD})
+        if response.status_code == 200:
+            user.token = response.json()["access_token"]
+        return "POST /auth/login-email", response
+    if action == "calendar":
+        month = random.choice([user.next_start - timedelta(days=60), user.next_start])
+        return "GET /periods/calendar", await client.get(f"/periods/calendar?from={month:%Y-%m}&months=3", headers=user.headers)
+    if action == "periods":
+        return "GET /periods/", await client.get("/periods/?limit=50", headers=user.headers)
+    if action == "period_write":
+        if user.active_period_id is None:
+            response = await client.post("/periods/", json={"start_date": user.next_start.isoformat()}, headers=user.headers)
+            if response.status_code == 201:
+                user.active_period_id = response.json()["id"]
+            return "POST /periods/", response
+        end_date = user.next_start + timedelta(days=random.randint(3, 7) - 1)
+        response = await client.patch(f"/periods/{user.active_period_id}/end", json={"end_date": end_date.isoformat()}, headers=user.headers)
+        user.active_period_id = None
+        user.next_start += timedelta(days=random.randint(24, 35))
+        return "PATCH /periods/{id}/end", response
+    if action == "chat":
+        body = {"mode": "mother", "messages": [{"role": "user", "content": f"お腹が痛い {random.randint(0, 10 ** 6)}"}]}
+        return "POST /chat/", await client.post("/chat/", json=body, headers=user.headers)
+    raise ValueError(action)
+
+
+async def run_load(base_url: str, args) -> dict:
+    import httpx
+
+    mix = parse_mix(args.mix)
+    actions, weights = zip(*((name, weight) for name, weight in mix.items() if weight > 0))
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        started = time.perf_counter()
+        virtual_users = await setup_users(client, args.users, args.periods_per_user)
+        setup_seconds = time.perf_counter() - started
+
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+        remaining = args.requests
+
+        async def worker(index: int) -> None:
+            nonlocal remaining
+            # ワーカーごとに別のユーザーを受け持つ (同じユーザーの生理記録を同時に書き込まない)
+            own_users = virtual_users[index::args.concurrency]
+            while remaining > 0:
+                remaining -= 1
+                user = random.choice(own_users)
+                request_started = time.perf_counter()
+                route, response = await run_action(client, random.choices(actions, weights)[0], user)
+                latencies[route].append(time.perf_counter() - request_started)
+                if response.status_code >= 400:
+                    errors[route] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(min(args.concurrency, len(virtual_users)))))
+        elapsed = time.perf_counter() - started
+
+    routes = {}
+    for route in sorted(latencies):
+        routes[route] = latency_summary(latencies[route], elapsed)
+        routes[route]["errors"] = errors[route]
+    overall = latency_summary([value for values in latencies.values() for value in values], elapsed)
+    overall["errors"] = sum(errors.values())
+    return {"setup_seconds": setup_seconds, "elapsed_seconds": elapsed, "overall": overall, "routes": routes}
+
+
+def print_results(results: dict) -> None:
+    print(f"{'route':<26} {'count':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    for route, summary in list(results["routes"].items()) + [("(all)", results["overall"])]:
+        print(
+            f"{route:<26} {summary['count']:>6} {summary['requests_per_second']:>8.1f} "
+            f"{summary['p50_ms']:>8.2f} {summary['p95_ms']:>8.2f} {summary['p99_ms']:>8.2f} {summary['errors']:>6}"
+        )
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="API load test against a temporary database and a fake LLM")
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--periods-per-user", type=int, default=24, help="事前にインポートする履歴の件数")
+    parser.add_argument("--mix", default="", help="name=weight のカンマ区切り (デフォルト: " + ",".join(f"{k}={v}" for k, v in DEFAULT_MIX.items()) + ")")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="fake LLM の最初のトークンまでの待ち時間 (秒)")
+    parser.add_argument("--llm-token-delay", type=float, default=0.002)
+    parser.add_argument("--bcrypt-rounds", type=int, default=None, help="BCRYPT_ROUNDS を上書きする (ログインのコストを本番と変える場合)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="結果を書き出す JSON ファイル")
+    args = parser.parse_args(argv)
+
+    # backend をインポートする前に環境変数を設定する
+    database_url = use_temp_database()
+    llm_port, api_port = free_port(), free_port()
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{llm_port}/v1"
+    if args.bcrypt_rounds is not None:
+        os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+
+    from . import fake_llm
+    from ..main import app
+
+    random.seed(args.seed)
+    fake_llm.settings.update(latency=args.llm_latency, token_delay=args.llm_token_delay)
+    llm_server = serve_in_thread(fake_llm.app, llm_port)
+    api_server = serve_in_thread(app, api_port)
+    print(f"database: {database_url}")
+    try:
+        results = asyncio.run(run_load(f"http://127.0.0.1:{api_port}", args))
+    finally:
+        for server in (api_server, llm_server):
+            server.should_exit = True
+            server.thread.join()
+
+    print(f"setup: {args.users} users x {args.periods_per_user} periods in {results['setup_seconds']:.1f}s")
+    print_results(results)
+    if args.output:
+        write_results(args.output, "api_load", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# backend/benchmarks/async_db.py
+# 同期Session (変更前) と AsyncSession (変更後) で、async def のハンドラから
+# 同時にクエリを投げたときのスループットとイベントループの停止時間を比較します。
+#
+# 使い方: python -m backend.benchmarks.async_db --requests 2000 --concurrency 50
+
+import argparse
+import asyncio
+import random
+import time
+from datetime import date, timedelta
+
+from .common import percentile, use_temp_database
+
+
+def seed(users: int, periods_per_user: int) -> None:
+    from ..database import SessionLocal, User, Period, init_db_connection
+
+    init_db_connection()
+    db = SessionLocal()
+    try:
+        for i in range(users):
+            user = User(email=f"bench{i}@example.com", auth_provider="local")
+            db.add(user)
+            db.flush()
+            start = date(2015, 1, 1)
+            for _ in range(periods_per_user):
+                db.add(Period(user_id=user.id, start_date=start, end_date=start + timedelta(days=5)))
+                start += timedelta(days=random.randint(24, 35))
+        db.commit()
+    finally:
+        db.close()
+
+
+async def heartbeat(stop: asyncio.Event, lags: list, interval: float = 0.005) -> None:
+    """一定間隔で起きて、予定時刻からの遅れ (＝イベントループがブロックされた時間) を記録します。"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, loop.time() - expected))
+
+
+async def run(mode: str, requests: int, concurrency: int, users: int) -> dict:
+    from .. import async_crud, crud
+    from ..database import AsyncSessionLocal, SessionLocal, async_engine
+
+    async def sync_request(user_id: int) -> None:
+        # 変更前: async def の中で同期Sessionを使う (クエリ中はイベントループが止まる)
+        db = SessionLocal()
+        try:
+            crud.get_user_by_id(db, user_id=user_id)
+            crud.get_periods(db, user_id=user_id, limit=None)
+        finally:
+            db.close()
+
+    async def async_request(user_id: int) -> None:
+        async with AsyncSessionLocal() as db:
+            await async_crud.get_user_by_id(db, user_id=user_id)
+            await async_crud.get_periods(db, user_id=user_id, limit=None)
+
+    handler = sync_request if mode == "sync" else async_request
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(user_id: int) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await handler(user_id)
+            latencies.append(time.perf_counter() - started)
+
+    stop = asyncio.Event()
+    lags = []
+    beat = asyncio.create_task(heartbeat(stop, lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(one(random.randint(1, users)) for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await beat
+    await async_engine.dispose()
+
+    latencies.sort()
+    lags.sort()
+    return {
+        "mode": mode,
+        "requests_per_second": requests / elapsed,
+        "latency_p50_ms": percentile(latencies, 50) * 1000,
+        "latency_p95_ms": percentile(latencies, 95) * 1000,
+        "loop_lag_max_ms": (lags[-1] if lags else 0.0) * 1000,
+        "loop_lag_p99_ms": percentile(lags, 99) * 1000,
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="sync Session vs AsyncSession throughput benchmark")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--periods-per-user", type=int, default=120)
+    args = parser.parse_args(argv)
+
+    database_url = use_temp_database()
+    random.seed(0)
+    seed(args.users, args.periods_per_user)
+    print(f"database: {database_url}")
+
+    for mode in ("sync", "async"):
+        result = asyncio.run(run(mode, args.requests, args.concurrency, args.users))
+        print(
+            f"{result['mode']:>5}: {result['requests_per_second']:8.1f} req/s  "
+            f"p50={result['latency_p50_ms']:.2f}ms p95={result['latency_p95_ms']:.2f}ms  "
+            f"loop lag max={result['loop_lag_max_ms']:.2f}ms p99={result['loop_lag_p99_ms']:.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
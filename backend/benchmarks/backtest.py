@@ -0,0 +1,132 @@
+# backend/benchmarks/backtest.py
+# 予測エンジン (prediction_engines.py) のバックテスト
+#
+# ユーザーごとの完了済みの生理期間を古い順に再生し、各時点までの履歴だけで次の生理を予測して、実際の記録と比べます。
+#   next start MAE : 予測した次回開始日 (最新の開始日 + 平均周期) と実際の開始日の差 (日)
+#   length MAE     : 予測した生理期間 (平均生理期間) と実際の日数の差 (日)
+#   predictions/s  : 1回の予測 (predict) にかかる時間から求めたスループット
+#
+# 履歴は DB (--source db: DATABASE_URL の periods テーブル) か、合成データ (--source synthetic) から読みます。
+# 合成データはユーザーごとに周期・期間の平均とばらつきを変え、外れ値 (極端に長い/短い周期) と
+# 記録漏れ (1周期分の記録が抜けて周期が2倍に見える) を混ぜています。
+#
+# 使い方: python -m backend.benchmarks.backtest --source synthetic --users 2000
+#         python -m backend.benchmarks.backtest --source db --min-history 3
+
+import argparse
+import random
+import time
+from datetime import date, timedelta
+from typing import Dict, List, Tuple
+
+from .common import use_temp_database
+
+History = List[Tuple[date, date]]
+
+
+def synthetic_histories(users: int, cycles: int, outlier_rate: float, missed_rate: float) -> Dict[int, History]:
+    histories = {}
+    for user_id in range(1, users + 1):
+        cycle_mean = random.gauss(29, 2.5)
+        cycle_sd = random.uniform(1.0, 4.0)
+        length_mean = random.gauss(5, 1)
+        # 周期がゆっくり変わっていくユーザーもいる (直近を重くするエンジンが有利になる状況)
+        drift = random.choice([0.0, 0.0, random.uniform(-0.15, 0.15)])
+        start = date(2015, 1, 1) + timedelta(days=random.randint(0, 60))
+        history = []
+        for i in range(random.randint(cycles // 2, cycles)):
+            length = max(2, min(10, round(random.gauss(length_mean, 1))))
+            history.append((start, start + timedelta(days=length - 1)))
+            cycle = max(18, round(random.gauss(cycle_mean + drift * i, cycle_sd)))
+            if random.random() < outlier_rate:
+                cycle = round(cycle * random.uniform(0.6, 1.8))
+            if random.random() < missed_rate:
+                cycle += max(18, round(random.gauss(cycle_mean, cycle_sd)))
+            start += timedelta(days=max(cycle, length + 1))
+        histories[user_id] = history
+    return histories
+
+
+def db_histories() -> Dict[int, History]:
+    from sqlalchemy import select
+
+    from ..database import Period, SessionLocal
+
+    histories: Dict[int, History] = {}
+    db = SessionLocal()
+    try:
+        query = (
+            select(Period.user_id, Period.start_date, Period.end_date)
+            .where(Period.end_date.isnot(None))
+            .order_by(Period.user_id, Period.start_date)
+        )
+        for user_id, start_date, end_date in db.execute(query):
+            histories.setdefault(user_id, []).append((start_date, end_date))
+    finally:
+        db.close()
+    return histories
+
+
+def backtest(engine, histories: Dict[int, History], min_history: int) -> dict:
+    start_errors = []
+    length_errors = []
+    seconds = 0.0
+    for history in histories.values():
+        for i in range(min_history, len(history)):
+            past = history[:i]
+            started = time.perf_counter()
+            avg_period_length, avg_cycle_length = engine.predict(past)
+            seconds += time.perf_counter() - started
+            actual_start, actual_end = history[i]
+            predicted_start = past[-1][0] + timedelta(days=avg_cycle_length)
+            start_errors.append(abs((predicted_start - actual_start).days))
+            length_errors.append(abs(avg_period_length - ((actual_end - actual_start).days + 1)))
+    predictions = len(start_errors)
+    start_errors.sort()
+    return {
+        "engine": engine.name,
+        "predictions": predictions,
+        "next_start_mae": sum(start_errors) / predictions if predictions else 0.0,
+        "next_start_within_3_days": sum(1 for e in start_errors if e <= 3) / predictions if predictions else 0.0,
+        "length_mae": sum(length_errors) / predictions if predictions else 0.0,
+        "predictions_per_second": predictions / seconds if seconds else 0.0,
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="prediction engine backtest")
+    parser.add_argument("--source", choices=["synthetic", "db"], default="synthetic")
+    parser.add_argument("--users", type=int, default=1000, help="synthetic: ユーザー数")
+    parser.add_argument("--cycles", type=int, default=24, help="synthetic: ユーザーあたりの最大周期数")
+    parser.add_argument("--outlier-rate", type=float, default=0.05, help="synthetic: 外れ値の周期の割合")
+    parser.add_argument("--missed-rate", type=float, default=0.03, help="synthetic: 記録漏れの割合")
+    parser.add_argument("--min-history", type=int, default=1, help="この件数以上の履歴がある時点から予測する")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engines", default=None, help="カンマ区切り (デフォルト: 全エンジン)")
+    args = parser.parse_args(argv)
+
+    if args.source == "synthetic":
+        # 合成データでは DB を使わないが、backend のインポートに DATABASE_URL が必要
+        use_temp_database()
+    from ..prediction_engines import ENGINES, make_prediction_engine
+
+    random.seed(args.seed)
+    if args.source == "synthetic":
+        histories = synthetic_histories(args.users, args.cycles, args.outlier_rate, args.missed_rate)
+    else:
+        histories = db_histories()
+    periods = sum(len(history) for history in histories.values())
+    print(f"source: {args.source}  users: {len(histories)}  completed periods: {periods}")
+
+    names = args.engines.split(",") if args.engines else list(ENGINES)
+    print(f"{'engine':>9}  {'predictions':>11}  {'next start MAE':>14}  {'<=3 days':>8}  {'length MAE':>10}  {'predictions/s':>13}")
+    for name in names:
+        result = backtest(make_prediction_engine(name), histories, args.min_history)
+        print(
+            f"{result['engine']:>9}  {result['predictions']:>11}  {result['next_start_mae']:>12.2f}日  "
+            f"{result['next_start_within_3_days']:>8.1%}  {result['length_mae']:>8.2f}日  {result['predictions_per_second']:>13,.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
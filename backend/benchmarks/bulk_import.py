@@ -0,0 +1,98 @@
+# backend/benchmarks/bulk_import.py
+# 過去の履歴 N 件を登録するのにかかる時間を、
+#   - per-row: これまでの方法 (1件ずつ POST /periods + PATCH /periods/{id}/end 相当、1件ごとにコミット)
+#   - bulk   : POST /periods/import 相当 (async_crud.import_periods、1トランザクション)
+# で比較します。
+#
+# 使い方: python -m backend.benchmarks.bulk_import --periods 10000
+#         (per-row は遅いので --per-row-periods で件数を減らし、1件あたりの時間から換算できます)
+
+import argparse
+import asyncio
+import random
+import time
+from datetime import date, timedelta
+
+from .common import use_temp_database
+
+
+def generate_history(count: int) -> list:
+    rows = []
+    start = date(1990, 1, 1)
+    for _ in range(count):
+        length = random.randint(3, 7)
+        rows.append({"start_date": start.isoformat(), "end_date": (start + timedelta(days=length - 1)).isoformat()})
+        start += timedelta(days=random.randint(24, 35))
+    return rows
+
+
+async def create_user(email: str) -> int:
+    from ..database import AsyncSessionLocal, User
+
+    async with AsyncSessionLocal() as db:
+        user = User(email=email, auth_provider="local")
+        db.add(user)
+        await db.commit()
+        return user.id
+
+
+async def per_row(rows: list) -> float:
+    from .. import async_crud, schemas
+    from ..database import AsyncSessionLocal
+
+    user_id = await create_user("per-row@example.com")
+    started = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        for row in rows:
+            db_period = await async_crud.create_period(db, schemas.PeriodCreate(start_date=row["start_date"]), user_id=user_id)
+            await async_crud.update_period(db, db_period, schemas.PeriodUpdate(end_date=row["end_date"]))
+    return time.perf_counter() - started
+
+
+async def bulk(rows: list) -> float:
+    from .. import async_crud
+    from ..database import AsyncSessionLocal
+
+    user_id = await create_user("bulk@example.com")
+    started = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        imported, errors = await async_crud.import_periods(db, user_id=user_id, raw_rows=rows)
+    elapsed = time.perf_counter() - started
+    assert imported == len(rows) and not errors, (imported, errors[:5])
+    return elapsed
+
+
+async def run(periods: int, per_row_periods: int) -> None:
+    from ..database import async_engine, init_db_connection
+
+    init_db_connection()
+    rows = generate_history(periods)
+
+    per_row_rows = rows[:per_row_periods]
+    per_row_seconds = await per_row(per_row_rows)
+    per_row_each = per_row_seconds / len(per_row_rows)
+    print(
+        f"per-row: {len(per_row_rows):6d} periods in {per_row_seconds:8.2f}s "
+        f"({per_row_each * 1000:.2f}ms/period, ~{per_row_each * periods:.1f}s for {periods})"
+    )
+
+    bulk_seconds = await bulk(rows)
+    print(f"   bulk: {periods:6d} periods in {bulk_seconds:8.2f}s ({bulk_seconds / periods * 1000:.3f}ms/period)")
+    print(f"speedup: x{per_row_each * periods / bulk_seconds:.0f}")
+    await async_engine.dispose()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="per-row vs bulk period import benchmark")
+    parser.add_argument("--periods", type=int, default=10000)
+    parser.add_argument("--per-row-periods", type=int, default=None, help="per-row で実際に登録する件数 (デフォルトは --periods と同じ)")
+    args = parser.parse_args(argv)
+
+    database_url = use_temp_database()
+    random.seed(0)
+    print(f"database: {database_url}")
+    asyncio.run(run(args.periods, args.per_row_periods or args.periods))
+
+
+if __name__ == "__main__":
+    main()
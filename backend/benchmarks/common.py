@@ -0,0 +1,130 @@
+# backend/benchmarks/common.py
+# ベンチマーク共通のヘルパー
+
+import atexit
+import json
+import os
+import platform
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+
+def _create_postgres_database(server_url: str) -> str:
+    """PostgreSQL サーバーに一時データベースを作り、その URL を返します。終了時に削除します。"""
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.engine import make_url
+
+    if server_url.startswith("postgres://"):
+        server_url = "postgresql://" + server_url[len("postgres://"):]
+    name = f"period_tracker_bench_{os.getpid()}_{int(time.time())}"
+
+    def run(statement: str) -> None:
+        admin = create_engine(server_url, isolation_level="AUTOCOMMIT") # CREATE / DROP DATABASE はトランザクションの外で実行する
+        try:
+            with admin.connect() as connection:
+                connection.execute(text(statement))
+        finally:
+            admin.dispose()
+
+    run(f'CREATE DATABASE "{name}"')
+    atexit.register(run, f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+    return make_url(server_url).set(database=name).render_as_string(hide_password=False)
+
+
+def use_temp_database() -> str:
+    """
+    一時ディレクトリのSQLiteファイルを DATABASE_URL に設定します。
+    backend.database はインポート時にエンジンを作るので、backend のモジュールをインポートする前に呼んでください。
+    既に BENCH_DATABASE_URL が設定されている場合はそちらを使います。
+    BENCH_POSTGRES_URL (例: postgresql://postgres@localhost/postgres) が設定されている場合は、
+    そのサーバーに一時データベースを作って使います (終了時に削除)。
+    """
+    database_url = os.getenv("BENCH_DATABASE_URL")
+    if not database_url and os.getenv("BENCH_POSTGRES_URL"):
+        database_url = _create_postgres_database(os.getenv("BENCH_POSTGRES_URL"))
+    if not database_url:
+        path = os.path.join(tempfile.mkdtemp(prefix="period-tracker-bench-"), "bench.db")
+        database_url = f"sqlite:///{path}"
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret-key")
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    return database_url
+
+
+def percentile(sorted_values, p: float) -> float:
+    """ソート済みリストの p パーセンタイル (0-100) を返します。"""
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+def latency_summary(latencies, elapsed: float) -> dict:
+    """レイテンシ (秒) のリストから p50/p95/p99 (ミリ秒) とスループットをまとめます。"""
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "requests_per_second": len(values) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": (values[-1] if values else 0.0) * 1000,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path: str, benchmark: str, config: dict, results: dict) -> None:
+    """
+    結果を JSON ファイルに書き出します。コミットごとに保存しておき、
+    python -m backend.benchmarks.compare old.json new.json で比較できます。
+    """
+    document = {
+        "benchmark": benchmark,
+        "commit": _git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(document, f, ensure_ascii=False, indent=2)
+    print(f"results written to {path}")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_in_thread(app, port: int):
+    """uvicorn でアプリを別スレッドで起動し、起動が終わるまで待ちます。戻り値の server.should_exit = True で停止します。"""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError(f"server on port {port} failed to start")
+        time.sleep(0.01)
+    server.thread = thread
+    return server
@@ -0,0 +1,74 @@
+# backend/benchmarks/compare.py
+# api_load / micro の結果 JSON (--output) を2つ比べて、指標ごとの変化率を表示します。
+# レイテンシ (*_ms / *_us / *_seconds) は小さいほど、スループット (*_per_second) は大きいほど良いとして、
+# --threshold (%) を超えて悪くなった指標を REGRESSION と表示します。
+#
+# 使い方: python -m backend.benchmarks.compare before.json after.json [--threshold 10] [--fail-on-regression]
+
+import argparse
+import json
+import sys
+from typing import Dict, Optional
+
+
+def flatten(results: dict, prefix: str = "") -> Dict[str, float]:
+    """ネストした結果を "routes.GET /periods/.p95_ms" のようなキーの数値に平らにします。"""
+    values = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[name] = float(value)
+    return values
+
+
+def direction(metric: str) -> Optional[int]:
+    """1: 大きいほど良い / -1: 小さいほど良い / None: 比較しない (件数など)。"""
+    if metric.endswith("_per_second"):
+        return 1
+    if metric.endswith(("_ms", "_us", "_seconds")) or metric == "errors":
+        return -1
+    return None
+
+
+def load(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="compare two benchmark result files")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0, help="これ以上悪化したら REGRESSION とする (%%)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="REGRESSION があれば終了コード 1 を返す")
+    args = parser.parse_args(argv)
+
+    before, after = load(args.before), load(args.after)
+    if before.get("benchmark") != after.get("benchmark"):
+        print(f"warning: comparing different benchmarks ({before.get('benchmark')} vs {after.get('benchmark')})")
+    print(f"before: {before.get('commit')} ({before.get('created_at')})")
+    print(f"after : {after.get('commit')} ({after.get('created_at')})")
+
+    old_values, new_values = flatten(before["results"]), flatten(after["results"])
+    regressions = 0
+    print(f"{'metric':<60} {'before':>12} {'after':>12} {'change':>8}")
+    for metric in sorted(old_values.keys() & new_values.keys()):
+        sign = direction(metric.rsplit(".", 1)[-1])
+        if sign is None:
+            continue
+        old, new = old_values[metric], new_values[metric]
+        change = (new - old) / old * 100 if old else 0.0
+        regressed = sign * change < -args.threshold
+        regressions += regressed
+        print(f"{metric:<60} {old:>12.2f} {new:>12.2f} {change:>+7.1f}%" + ("  REGRESSION" if regressed else ""))
+    for metric in sorted(old_values.keys() ^ new_values.keys()):
+        print(f"{metric:<60} (only in {'before' if metric in old_values else 'after'})")
+
+    print(f"{regressions} regression(s) over {args.threshold:.0f}%")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+# backend/benchmarks/fake_llm.py
+# OpenAI の Chat Completions API を真似たローカルのフェイクサーバー
+# LLMクライアントの動作確認やベンチマークで、本物のAPIを呼ばずに済ませるために使います。
+#
+# 使い方:
+#   python -m backend.benchmarks.fake_llm --port 9000 --latency 0.2 --token-delay 0.02
+#   OPENAI_BASE_URL=http://127.0.0.1:9000/v1 OPENAI_API_KEY=sk-fake uvicorn backend.main:app
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="Fake LLM")
+
+# 起動オプションで上書きされる設定
+settings = {
+    "latency": 0.2, # 最初のトークンまでの待ち時間 (秒)
+    "token_delay": 0.02, # トークン間の待ち時間 (秒)
+    "tokens": 20, # 1回の回答のトークン数
+    "failure_rate": 0.0, # 503 を返す確率 (リトライの確認用)
+}
+
+
+def _reply_tokens(messages: list) -> list:
+    last = messages[-1]["content"] if messages else ""
+    return [f"「{last[:10]}」"] + [f"トークン{i} " for i in range(settings["tokens"] - 1)]
+
+
+def _chunk(completion_id: str, model: str, content: str = None, finish_reason: str = None) -> str:
+    delta = {"content": content} if content is not None else {}
+    data = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    if random.random() < settings["failure_rate"]:
+        return JSONResponse({"error": {"message": "fake overload", "type": "server_error"}}, status_code=503)
+
+    model = body.get("model", "gpt-4o")
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    tokens = _reply_tokens(body.get("messages", []))
+    usage = {"prompt_tokens": 10, "completion_tokens": len(tokens), "total_tokens": 10 + len(tokens)}
+
+    if body.get("stream"):
+        async def stream():
+            await asyncio.sleep(settings["latency"])
+            for token in tokens:
+                yield _chunk(completion_id, model, token)
+                await asyncio.sleep(settings["token_delay"])
+            yield _chunk(completion_id, model, finish_reason="stop")
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    await asyncio.sleep(settings["latency"] + settings["token_delay"] * len(tokens))
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+        "usage": usage,
+    }
+
+
+def main(argv=None) -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake OpenAI Chat Completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=settings["latency"])
+    parser.add_argument("--token-delay", type=float, default=settings["token_delay"])
+    parser.add_argument("--tokens", type=int, default=settings["tokens"])
+    parser.add_argument("--failure-rate", type=float, default=settings["failure_rate"])
+    args = parser.parse_args(argv)
+    settings.update(latency=args.latency, token_delay=args.token_delay, tokens=args.tokens, failure_rate=args.failure_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
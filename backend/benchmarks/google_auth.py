@@ -0,0 +1,208 @@
+# backend/benchmarks/google_auth.py
+# Google の ID トークン検証: 公開鍵を毎回取得する方法 (以前の verify_oauth2_token) とキャッシュする方法の比較
+#
+# ローカルで作った RSA の鍵で公開鍵 (JWKS) とトークンを作るので、Google には接続しません。
+# 公開鍵の取得には --fetch-latency 秒の遅延を入れて、ネットワーク越しの取得を真似します。
+#   fixtures : 正しいトークン・期限切れ・aud 違い・iss 違い・署名違い・知らない kid・壊れたトークンが
+#              それぞれ期待どおりに受け付け / 拒否されるかを確認する (1つでも違えば終了コード 1)
+#   per-fetch: id_token.verify_oauth2_token をイベントループ上で呼ぶ (ログインごとに取得 + 同期の検証)
+#   cached   : google_id_token.GoogleTokenVerifier (キャッシュした鍵 + スレッドでの検証)
+#
+# 使い方: python -m backend.benchmarks.google_auth --logins 500 --concurrency 20 --fetch-latency 0.05 --output google_auth.json
+
+import argparse
+import asyncio
+import base64
+import json
+import sys
+import time
+
+import httpx
+import rsa
+from jose import jwt
+
+from .common import latency_summary, write_results
+
+CLIENT_ID = "local-client.apps.googleusercontent.com"
+CERTS_URL = "https://certs.local.test/oauth2/v3/certs"
+ISSUER = "https://accounts.google.com"
+
+
+def _b64(number: int) -> str:
+    data = number.to_bytes((number.bit_length() + 7) // 8, "big")
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+class LocalKeySet:
+    """ローカルの RSA の鍵。Google と同じ形式の JWKS (v3) と証明書の辞書 (v1) を返し、トークンに署名します。"""
+
+    def __init__(self, kids=("local-key-1", "local-key-2"), bits: int = 2048):
+        self.keys = {kid: rsa.newkeys(bits) for kid in kids}
+
+    def jwks(self) -> dict:
+        return {"keys": [
+            {"kty": "RSA", "alg": "RS256", "use": "sig", "kid": kid, "n": _b64(public.n), "e": _b64(public.e)}
+            for kid, (public, _) in self.keys.items()
+        ]}
+
+    def pem_certs(self) -> dict:
+        # google-auth は証明書の代わりに PKCS#1 の公開鍵も受け付ける
+        return {kid: public.save_pkcs1().decode() for kid, (public, _) in self.keys.items()}
+
+    def sign(self, claims: dict, kid: str = "local-key-1", signing_kid: str = None) -> str:
+        private = self.keys[signing_kid or kid][1]
+        return jwt.encode(claims, private.save_pkcs1().decode(), algorithm="RS256", headers={"kid": kid})
+
+
+def claims(**overrides) -> dict:
+    now = int(time.time())
+    values = {
+        "iss": ISSUER, "aud": CLIENT_ID, "sub": "1234567890", "email": "fixture@example.com",
+        "email_verified": True, "name": "Fixture User", "iat": now, "exp": now + 3600, "at_hash": "fixture",
+    }
+    values.update(overrides)
+    return values
+
+
+def fixture_tokens(key_set: LocalKeySet) -> list:
+    """(名前, トークン, 受け付けるべきか)"""
+    now = int(time.time())
+    return [
+        ("valid", key_set.sign(claims()), True),
+        ("valid-second-key", key_set.sign(claims(), kid="local-key-2"), True),
+        ("issuer-without-scheme", key_set.sign(claims(iss="accounts.google.com")), True),
+        ("expired", key_set.sign(claims(iat=now - 7200, exp=now - 3600)), False),
+        ("wrong-audience", key_set.sign(claims(aud="someone-else")), False),
+        ("wrong-issuer", key_set.sign(claims(iss="https://evil.example.com")), False),
+        ("bad-signature", key_set.sign(claims(), kid="local-key-1", signing_kid="local-key-2"), False),
+        ("unknown-kid", key_set.sign(claims(), kid="rotated-away", signing_kid="local-key-1"), False),
+        ("malformed", "not-a-jwt", False),
+    ]
+
+
+def make_transport(key_set: LocalKeySet, fetch_latency: float, max_age: int, counter: dict) -> httpx.MockTransport:
+    async def handler(request: httpx.Request) -> httpx.Response:
+        counter["fetches"] += 1
+        await asyncio.sleep(fetch_latency)
+        return httpx.Response(200, json=key_set.jwks(), headers={"Cache-Control": f"public, max-age={max_age}, must-revalidate"})
+
+    return httpx.MockTransport(handler)
+
+
+class _LocalCertsRequest:
+    """google.auth.transport.Request の代わり。ネットワークの代わりに time.sleep してローカルの証明書を返す。"""
+
+    def __init__(self, key_set: LocalKeySet, fetch_latency: float, counter: dict):
+        self.key_set, self.fetch_latency, self.counter = key_set, fetch_latency, counter
+
+    def __call__(self, url, method="GET", body=None, headers=None, timeout=None, **kwargs):
+        self.counter["fetches"] += 1
+        time.sleep(self.fetch_latency)
+        response = type("Response", (), {})()
+        response.status, response.headers, response.data = 200, {}, json.dumps(self.key_set.pem_certs()).encode()
+        return response
+
+
+async def check_fixtures(verifier, key_set: LocalKeySet) -> list:
+    from ..google_id_token import InvalidGoogleToken
+
+    results = []
+    for name, token, accept in fixture_tokens(key_set):
+        try:
+            await verifier.verify(token)
+            outcome = "accepted"
+        except InvalidGoogleToken as e:
+            outcome = f"rejected ({str(e)[:50]})"
+        results.append({"fixture": name, "expected": "accepted" if accept else "rejected", "outcome": outcome, "ok": outcome.startswith("accepted") == accept})
+    return results
+
+
+async def run_logins(verify, tokens: list, concurrency: int) -> dict:
+    """concurrency 個のコルーチンで tokens を検証し、1件ずつの所要時間とイベントループの最大の遅れを返します。"""
+    latencies, queue = [], list(tokens)
+    max_lag = 0.0
+    stop = asyncio.Event()
+
+    async def watchdog(): # イベントループが止まっていた時間を測る
+        nonlocal max_lag
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            max_lag = max(max_lag, time.perf_counter() - started - 0.001)
+
+    async def worker():
+        while queue:
+            token = queue.pop()
+            started = time.perf_counter()
+            await verify(token)
+            latencies.append(time.perf_counter() - started)
+
+    lag_task = asyncio.create_task(watchdog())
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await lag_task
+    summary = latency_summary(latencies, elapsed)
+    summary["max_event_loop_lag_ms"] = round(max_lag * 1000, 2)
+    return summary
+
+
+async def bench(args) -> dict:
+    from google.oauth2 import id_token
+
+    from ..google_id_token import GoogleTokenVerifier
+
+    key_set = LocalKeySet()
+    cached_fetches, per_fetch_fetches = {"fetches": 0}, {"fetches": 0}
+    verifier = GoogleTokenVerifier(CLIENT_ID, CERTS_URL, transport=make_transport(key_set, args.fetch_latency, args.max_age, cached_fetches))
+
+    fixtures = await check_fixtures(verifier, key_set)
+    tokens = [key_set.sign(claims(sub=str(i))) for i in range(args.logins)]
+
+    request = _LocalCertsRequest(key_set, args.fetch_latency, per_fetch_fetches)
+
+    async def verify_per_fetch(token):
+        # 以前の google_auth と同じく、async def の中で同期的に呼ぶ
+        return id_token.verify_oauth2_token(token, request, CLIENT_ID)
+
+    fetches_before = cached_fetches["fetches"]
+    results = {
+        "per-fetch": await run_logins(verify_per_fetch, tokens, args.concurrency),
+        "cached": await run_logins(verifier.verify, tokens, args.concurrency),
+    }
+    results["per-fetch"]["fetches"] = per_fetch_fetches["fetches"]
+    results["cached"]["fetches"] = cached_fetches["fetches"] - fetches_before
+    await verifier.aclose()
+    return {"fixtures": fixtures, "logins": results}
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Google ID token verification: per-login cert fetch vs cached keys")
+    parser.add_argument("--logins", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--fetch-latency", type=float, default=0.05, help="公開鍵の取得にかかる秒数 (ネットワークの代わり)")
+    parser.add_argument("--max-age", type=int, default=21600, help="JWKS の Cache-Control の max-age")
+    parser.add_argument("--output", default=None, help="結果を書き出す JSON ファイル")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(bench(args))
+
+    print(f"{'fixture':<22} {'expected':<9} outcome")
+    for fixture in results["fixtures"]:
+        print(f"{fixture['fixture']:<22} {fixture['expected']:<9} {fixture['outcome']}{'' if fixture['ok'] else '  <-- MISMATCH'}")
+    print()
+    print(f"{'mode':<10} {'logins/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'loop lag ms':>11} {'fetches':>7}")
+    for mode, summary in results["logins"].items():
+        print(
+            f"{mode:<10} {summary['requests_per_second']:>9.0f} {summary['p50_ms']:>8.2f} {summary['p95_ms']:>8.2f} "
+            f"{summary['p99_ms']:>8.2f} {summary['max_event_loop_lag_ms']:>11.2f} {summary['fetches']:>7}"
+        )
+    if args.output:
+        write_results(args.output, "google_auth", vars(args), results)
+    if not all(fixture["ok"] for fixture in results["fixtures"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# backend/benchmarks/logging_overhead.py
+# ログ出力のオーバーヘッド
+#   calls    : 1回の呼び出しで呼び出し元 (イベントループ) が止まる時間
+#              print (行ごとに flush) / app_logging の info (キューに積むだけ) / 無効なレベル / 10% に間引いたログ
+#   requests : 422 になるリクエスト (validation_exception_handler がログを出す) の1件あたりの時間を、
+#              ログを出す場合と出さない場合 (LOG_LEVEL=ERROR 相当) で比べる
+# ログの書き出し先は一時ファイルです (--sink stdout で標準出力)。
+#
+# 使い方: python -m backend.benchmarks.logging_overhead --iterations 20000 --requests 2000 --output logging.json
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from .common import use_temp_database, write_results
+from .micro import summarize
+
+FIELDS = {"user_id": 123, "path": "/periods/", "method": "POST", "errors": [{"loc": ["body", "start_date"], "msg": "Input should be a valid date", "input": "2025-13-01"}]}
+
+
+def wait_for_queue() -> None:
+    """書き出し待ちのログがなくなるまで待ちます (前の計測のログの書き出しが次の計測に重ならないように)。"""
+    from .. import app_logging
+
+    while app_logging.get_stats()["queued"]:
+        time.sleep(0.01)
+
+
+def measure_calls(call, iterations: int) -> dict:
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - started)
+    wait_for_queue()
+    return summarize(latencies)
+
+
+def bench_calls(sink, iterations: int) -> dict:
+    from .. import app_logging
+
+    log = app_logging.get_logger("benchmark")
+    app_logging.LOG_SAMPLE_RATES["bench.sampled"] = 0.1
+
+    results = {}
+    results["print"] = measure_calls(lambda: print(f"[BENCH] request failed: {FIELDS}", file=sink, flush=True), iterations)
+    results["log.info"] = measure_calls(lambda: log.info("bench.event", **FIELDS), iterations)
+    results["log.info[sampled 10%]"] = measure_calls(lambda: log.info("bench.sampled", **FIELDS), iterations)
+    results["log.debug[disabled]"] = measure_calls(lambda: log.debug("bench.event", **FIELDS), iterations)
+    return results
+
+
+async def bench_requests(requests: int, rounds: int = 10) -> dict:
+    import httpx
+
+    from ..main import app
+
+    body = {"email": "bench@example.com", "password": 123}
+    results = {}
+    latencies = {"logging_on": [], "logging_off": []}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        # 最初の1ラウンドはウォームアップ。その後は交互に計測して、順番の影響をならす
+        for round_index in range(rounds + 1):
+            for name, level in (("logging_on", logging.INFO), ("logging_off", logging.ERROR)):
+                logging.getLogger("backend").setLevel(level)
+                for _ in range(requests // rounds):
+                    started = time.perf_counter()
+                    response = await client.post("/auth/login-email", json=body)
+                    if round_index:
+                        latencies[name].append(time.perf_counter() - started)
+                    assert response.status_code == 422, response.status_code
+                wait_for_queue()
+    logging.getLogger("backend").setLevel(logging.INFO)
+    for name, values in latencies.items():
+        results[name] = summarize(values)
+    # 1リクエストは約1ms で外れ値の影響が大きいので、p50 の差で比べる
+    results["overhead_per_request_us"] = results["logging_on"]["p50_us"] - results["logging_off"]["p50_us"]
+    return results
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="logging overhead per call and per request")
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--sink", choices=["file", "stdout"], default="file")
+    parser.add_argument("--output", default=None, help="結果を書き出す JSON ファイル")
+    args = parser.parse_args(argv)
+
+    use_temp_database()
+    if args.sink == "file":
+        sink = open(os.path.join(tempfile.mkdtemp(prefix="period-tracker-log-"), "bench.log"), "w", encoding="utf-8")
+    else:
+        sink = sys.stdout
+
+    from .. import app_logging
+
+    app_logging.setup_logging(stream=sink) # app_logging のログも同じ書き出し先にする
+    results = {"calls": bench_calls(sink, args.iterations), "requests": asyncio.run(bench_requests(args.requests))}
+    app_logging.shutdown_logging()
+
+    print(f"{'benchmark':<32} {'ops/s':>10} {'mean us':>9} {'p50 us':>9} {'p95 us':>9} {'p99 us':>9}")
+    for group in ("calls", "requests"):
+        for name, summary in results[group].items():
+            if isinstance(summary, dict):
+                print(
+                    f"{group + '.' + name:<32} {summary['ops_per_second']:>10,.0f} {summary['mean_us']:>9.1f} "
+                    f"{summary['p50_us']:>9.1f} {summary['p95_us']:>9.1f} {summary['p99_us']:>9.1f}"
+                )
+    print(f"logging overhead per request: {results['requests']['overhead_per_request_us']:.1f} us")
+    if args.output:
+        write_results(args.output, "logging_overhead", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# backend/benchmarks/micro.py
+# よく呼ばれる関数単体のマイクロベンチマーク
+#   calculate_average_period_data : 予測に使う平均値 (mean エンジンは周期統計、それ以外は履歴を読む)
+#   get_periods                   : 生理記録の一覧 (1ページ分)
+#   get_current_user              : 認証の依存関係 (キャッシュなし / キャッシュあり)
+#
+# 使い方: python -m backend.benchmarks.micro --iterations 2000 --output micro.json
+
+import argparse
+import asyncio
+import random
+import time
+from datetime import date, timedelta
+
+from .common import percentile, use_temp_database, write_results
+
+
+def seed(users: int, periods_per_user: int) -> None:
+    from sqlalchemy import insert
+
+    from ..crud import rebuild_all_cycle_stats
+    from ..database import Period, SessionLocal, User, init_db_connection
+
+    init_db_connection()
+    db = SessionLocal()
+    try:
+        db.execute(insert(User), [{"email": f"micro{i}@example.com", "auth_provider": "local"} for i in range(users)])
+        rows = []
+        for user_id in range(1, users + 1):
+            start = date(2015, 1, 1)
+            for _ in range(periods_per_user):
+                rows.append({"user_id": user_id, "start_date": start, "end_date": start + timedelta(days=random.randint(3, 7) - 1)})
+                start += timedelta(days=random.randint(24, 35))
+        db.execute(insert(Period), rows)
+        db.commit()
+        rebuild_all_cycle_stats(db) # 一括挿入では周期統計が作られないので作っておく
+    finally:
+        db.close()
+
+
+def summarize(latencies: list) -> dict:
+    values = sorted(latencies)
+    total = sum(values)
+    return {
+        "iterations": len(values),
+        "ops_per_second": len(values) / total if total else 0.0,
+        "mean_us": total / len(values) * 1e6 if values else 0.0,
+        "p50_us": percentile(values, 50) * 1e6,
+        "p95_us": percentile(values, 95) * 1e6,
+        "p99_us": percentile(values, 99) * 1e6,
+    }
+
+
+async def measure(call, iterations: int, warmup: int) -> dict:
+    """call (引数なしのコルーチン関数) を繰り返し呼び、1回ごとの時間を集計します。"""
+    for _ in range(warmup):
+        await call()
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - started)
+    return summarize(latencies)
+
+
+async def run(args) -> dict:
+    from .. import async_crud, auth_cache, prediction_engines
+    from ..database import AsyncSessionLocal, async_engine
+    from ..routers.auth import create_access_token, get_current_user
+
+    results = {}
+    user_ids = list(range(1, args.users + 1))
+    tokens = {
+        user_id: create_access_token({"user_id": user_id, "email": f"micro{user_id - 1}@example.com", "auth_provider": "local"})
+        for user_id in user_ids
+    }
+
+    async with AsyncSessionLocal() as db:
+        for name in ("mean", "median"):
+            # エンジンを切り替えて、周期統計を使う場合と履歴を読む場合を比べる
+            prediction_engines._engine = prediction_engines.make_prediction_engine(name)
+
+            async def average():
+                await async_crud.calculate_average_period_data(db, random.choice(user_ids))
+                db.expire_all()
+
+            results[f"calculate_average_period_data[{name}]"] = await measure(average, args.iterations, args.warmup)
+        prediction_engines._engine = None
+
+        async def periods():
+            await async_crud.get_periods(db, user_id=random.choice(user_ids), limit=args.page_size)
+            db.expunge_all()
+
+        results[f"get_periods[limit={args.page_size}]"] = await measure(periods, args.iterations, args.warmup)
+
+        async def current_user_cold():
+            auth_cache.clear() # JWTのデコードとユーザーの取得を毎回行う
+            await get_current_user(token=tokens[random.choice(user_ids)], db=db)
+
+        async def current_user_warm():
+            await get_current_user(token=tokens[random.choice(user_ids)], db=db)
+
+        results["get_current_user[cold]"] = await measure(current_user_cold, args.iterations, args.warmup)
+        for user_id in user_ids:
+            await get_current_user(token=tokens[user_id], db=db) # 全ユーザーをキャッシュに載せておく
+        results["get_current_user[cached]"] = await measure(current_user_warm, args.iterations, args.warmup)
+
+    await async_engine.dispose()
+    return results
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="micro benchmarks for hot backend functions")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--periods-per-user", type=int, default=120)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="結果を書き出す JSON ファイル")
+    args = parser.parse_args(argv)
+
+    database_url = use_temp_database()
+    random.seed(args.seed)
+    seed(args.users, args.periods_per_user)
+    print(f"database: {database_url}")
+
+    results = asyncio.run(run(args))
+    print(f"{'benchmark':<40} {'ops/s':>10} {'mean us':>9} {'p50 us':>9} {'p95 us':>9} {'p99 us':>9}")
+    for name, summary in results.items():
+        print(
+            f"{name:<40} {summary['ops_per_second']:>10,.0f} {summary['mean_us']:>9.1f} "
+            f"{summary['p50_us']:>9.1f} {summary['p95_us']:>9.1f} {summary['p99_us']:>9.1f}"
+        )
+    if args.output:
+        write_results(args.output, "micro", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
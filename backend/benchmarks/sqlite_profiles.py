@@ -0,0 +1,166 @@
+# backend/benchmarks/sqlite_profiles.py
+# SQLite の性能プロファイル (SQLITE_PROFILE) ごとの書き込み・同時読み込みのスループット
+#   write       : 1件 INSERT して commit する (crud.create_period と同じ1トランザクション1コミット) を繰り返す
+#   read+write  : 1つのスレッドが書き込み続ける間に、--readers 個のスレッドがカレンダーと同じ範囲クエリを実行する
+# プロファイルごとに新しい一時データベースを作り、同じ件数の履歴を入れてから計測します。
+# 一時ディレクトリのファイルシステム (tmpfs など) によって fsync のコストは大きく変わるので、
+# 本番に近いディスクで測る場合は --directory を指定してください。
+#
+# 使い方: python -m backend.benchmarks.sqlite_profiles --writes 2000 --seconds 5 --readers 4 --output sqlite.json
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+from .common import latency_summary, use_temp_database, write_results
+
+
+def make_engine(path: str, profile: str):
+    from sqlalchemy import create_engine
+
+    from .. import sqlite_profile
+    from ..migrations import run_migrations
+
+    url = f"sqlite:///{path}"
+    engine = create_engine(url, **sqlite_profile.engine_options(url, profile))
+    sqlite_profile.install(engine, profile)
+    run_migrations(engine)
+    return engine
+
+
+def seed(engine, users: int, periods_per_user: int) -> None:
+    from sqlalchemy import insert
+
+    from ..database import Period, User
+
+    with engine.begin() as connection:
+        connection.execute(insert(User), [{"email": f"profile{i}@example.com", "auth_provider": "local"} for i in range(users)])
+        rows = []
+        for user_id in range(1, users + 1):
+            start = date(2015, 1, 1)
+            for _ in range(periods_per_user):
+                rows.append({"user_id": user_id, "start_date": start, "end_date": start + timedelta(days=4)})
+                start += timedelta(days=random.randint(24, 35))
+        connection.execute(insert(Period), rows)
+
+
+def write_once(engine, users: int, day: date) -> None:
+    from sqlalchemy import insert
+
+    from ..database import Period
+
+    with engine.begin() as connection:
+        connection.execute(insert(Period).values(user_id=random.randint(1, users), start_date=day, end_date=day + timedelta(days=4)))
+
+
+def read_once(engine, users: int) -> None:
+    from ..crud import _periods_query
+
+    range_start = date(2015, 1, 1) + timedelta(days=random.randint(0, 3000))
+    with engine.connect() as connection:
+        connection.execute(_periods_query(random.randint(1, users), range_start, range_start + timedelta(days=90), order_direction="asc")).all()
+
+
+def bench_writes(engine, writes: int, users: int) -> dict:
+    latencies = []
+    day = date(2030, 1, 1)
+    started = time.perf_counter()
+    for i in range(writes):
+        write_started = time.perf_counter()
+        write_once(engine, users, day + timedelta(days=i))
+        latencies.append(time.perf_counter() - write_started)
+    return latency_summary(latencies, time.perf_counter() - started)
+
+
+def bench_read_write(engine, seconds: float, readers: int, users: int) -> dict:
+    """書き込みスレッド1つと読み込みスレッド readers 個を seconds 秒動かします。"""
+    read_latencies, write_latencies = [], []
+    errors = {"read": 0, "write": 0}
+    stop = threading.Event()
+
+    def writer():
+        day = date(2040, 1, 1)
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                write_once(engine, users, day)
+                write_latencies.append(time.perf_counter() - started)
+            except Exception:
+                errors["write"] += 1
+            day += timedelta(days=1)
+
+    def reader():
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                read_once(engine, users)
+                read_latencies.append(time.perf_counter() - started)
+            except Exception:
+                errors["read"] += 1
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(readers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    reads, writes = latency_summary(read_latencies, elapsed), latency_summary(write_latencies, elapsed)
+    reads["errors"], writes["errors"] = errors["read"], errors["write"]
+    return {"reads": reads, "writes": writes}
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="write and concurrent-read throughput per SQLite profile")
+    parser.add_argument("--profiles", default=None, help="カンマ区切り (デフォルト: すべて)")
+    parser.add_argument("--writes", type=int, default=2000, help="write で実行するコミットの回数")
+    parser.add_argument("--seconds", type=float, default=5.0, help="read+write を動かす秒数")
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--periods-per-user", type=int, default=60)
+    parser.add_argument("--directory", default=None, help="データベースを作るディレクトリ (デフォルト: 一時ディレクトリ)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="結果を書き出す JSON ファイル")
+    args = parser.parse_args(argv)
+
+    use_temp_database() # backend のインポートに必要 (計測にはプロファイルごとのデータベースを使う)
+    from .. import sqlite_profile
+
+    profiles = args.profiles.split(",") if args.profiles else list(sqlite_profile.SQLITE_PROFILES)
+    directory = args.directory or tempfile.mkdtemp(prefix="period-tracker-sqlite-")
+    os.makedirs(directory, exist_ok=True)
+    results = {}
+    for profile in profiles:
+        random.seed(args.seed)
+        path = os.path.join(directory, f"{profile}.db")
+        for suffix in ("", "-wal", "-shm"): # 前回の結果が残っていれば消す
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        engine = make_engine(path, profile)
+        seed(engine, args.users, args.periods_per_user)
+        results[profile] = {
+            "write": bench_writes(engine, args.writes, args.users),
+            "read+write": bench_read_write(engine, args.seconds, args.readers, args.users),
+        }
+        engine.dispose()
+
+    print(f"{'profile':<12} {'workload':<18} {'ops/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    for profile, workloads in results.items():
+        rows = [("write", workloads["write"]), ("read+write reads", workloads["read+write"]["reads"]), ("read+write writes", workloads["read+write"]["writes"])]
+        for name, summary in rows:
+            print(
+                f"{profile:<12} {name:<18} {summary['requests_per_second']:>9.0f} {summary['p50_ms']:>8.2f} "
+                f"{summary['p95_ms']:>8.2f} {summary['p99_ms']:>8.2f} {summary.get('errors', 0):>6}"
+            )
+    if args.output:
+        write_results(args.output, "sqlite_profiles", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
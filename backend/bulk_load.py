@@ -0,0 +1,111 @@
+# backend/bulk_load.py
+# PostgreSQL の COPY を使った一括挿入
+#
+# 大量の行を INSERT (executemany) で入れると、1行ごとにパラメータの変換とサーバーとの往復が発生します。
+# PostgreSQL では COPY ... FROM STDIN で行をまとめて送ると、同じ行数を数倍速く入れられます。
+#   - 同期 (psycopg2)  : cursor.copy_expert に CSV を渡す (copy_rows)
+#   - 非同期 (asyncpg) : Connection.copy_records_to_table にタプルを渡す (async_copy_rows)
+# それ以外のデータベース (SQLite など) とドライバーでは、これまでどおり INSERT の executemany で挿入します。
+# どちらも呼び出し元のトランザクションの中で実行されるので、コミット・ロールバックは呼び出し側で行います。
+
+import io
+from datetime import date, datetime, timezone
+from typing import Iterable, List, Optional, Sequence
+
+from sqlalchemy import Table, insert, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# これより少ない行数では COPY の準備のほうが高くつくので INSERT を使う
+COPY_MIN_ROWS = 500
+
+
+def supports_copy(conn, driver: Optional[str] = None) -> bool:
+    """conn (Connection / AsyncConnection) で COPY を使えるかを返します。"""
+    dialect = conn.dialect
+    return dialect.name == "postgresql" and dialect.driver in ((driver,) if driver else ("psycopg2", "asyncpg"))
+
+
+def _csv_value(value) -> str:
+    """COPY の CSV 形式の1値。NULL は引用符なしの空文字、それ以外はすべて引用符で囲む (空文字列と NULL を区別するため)。"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        value = "true" if value else "false"
+    elif isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None) # UTCDateTime と同じく UTC の naive で保存する
+        value = value.isoformat(sep=" ")
+    elif isinstance(value, date):
+        value = value.isoformat()
+    else:
+        value = str(value)
+    return '"' + value.replace('"', '""') + '"'
+
+
+def _to_csv(rows: Iterable[Sequence]) -> io.StringIO:
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(",".join(_csv_value(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    return buffer
+
+
+def _copy_statement(table: Table, columns: Sequence[str]) -> str:
+    return f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+
+
+def copy_rows(conn: Connection, table: Table, columns: Sequence[str], rows: List[Sequence]) -> int:
+    """
+    rows (columns の順のタプル) を挿入し、挿入した行数を返します。
+    PostgreSQL (psycopg2) で COPY_MIN_ROWS 行以上なら COPY、それ以外は INSERT の executemany を使います。
+    """
+    if not rows:
+        return 0
+    if len(rows) >= COPY_MIN_ROWS and supports_copy(conn, "psycopg2"):
+        # conn と同じトランザクションの DBAPI 接続で実行する
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            cursor.copy_expert(_copy_statement(table, columns), _to_csv(rows))
+        finally:
+            cursor.close()
+    else:
+        conn.execute(insert(table), [dict(zip(columns, row)) for row in rows])
+    return len(rows)
+
+
+async def async_copy_rows(conn: AsyncConnection, table: Table, columns: Sequence[str], rows: List[Sequence]) -> int:
+    """
+    copy_rows の非同期版です。PostgreSQL (asyncpg) で COPY_MIN_ROWS 行以上なら copy_records_to_table を使います。
+    asyncpg のトランザクションは最初の SQL の実行時に始まるので、それより前に COPY だけを実行すると
+    COPY は独立してコミットされます。呼び出し側で先に SELECT などを実行しておいてください。
+    """
+    if not rows:
+        return 0
+    if len(rows) >= COPY_MIN_ROWS and supports_copy(conn, "asyncpg"):
+        raw = await conn.get_raw_connection()
+        records = [tuple(_naive_utc(value) for value in row) for row in rows]
+        await raw.driver_connection.copy_records_to_table(table.name, records=records, columns=list(columns))
+    else:
+        await conn.execute(insert(table), [dict(zip(columns, row)) for row in rows])
+    return len(rows)
+
+
+def _naive_utc(value):
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def reset_sequence(conn: Connection, table: Table, column: str = "id") -> None:
+    """
+    ID を明示して挿入した後に、PostgreSQL のシーケンスを現在の最大値に合わせます
+    (合わせないと、次にアプリが挿入するときに ID が重複する)。SQLite では何もしません。
+    """
+    if conn.dialect.name != "postgresql":
+        return
+    conn.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('{table.name}', '{column}'), "
+        f"COALESCE((SELECT MAX({column}) FROM {table.name}), 0) + 1, false)"
+    ))
@@ -0,0 +1,210 @@
+# backend/chat_context.py
+# チャットの会話コンテキストをトークン予算内に収める
+#
+# クライアントから送られてくる会話履歴をそのままLLMに渡すと、会話が長くなるほど遅く・高くなります。
+# ここでは、トークン数をローカルで数え、予算を超える場合は
+#   - システムプロンプトと直近のやりとりはそのまま残し
+#   - それより古いやりとりは「これまでの会話の要約」1件に置き換えます。
+# 要約は会話ごとにキャッシュし、次のターンでは新しく押し出されたやりとりだけを追加で要約します (ローリング要約)。
+#
+# 環境変数:
+#   CHAT_CONTEXT_MAX_TOKENS            LLMに送るプロンプト全体の上限 (デフォルト 3000)
+#   CHAT_CONTEXT_TARGET_RATIO          要約し直すとき、直近のやりとりを上限の何割まで残すか (デフォルト 0.6)
+#                                      余裕を持たせることで、毎ターン要約し直さずに済む
+#   CHAT_CONTEXT_MIN_RECENT_MESSAGES   予算に関わらずそのまま残す直近のメッセージ数 (デフォルト 2)
+#   CHAT_CONTEXT_SUMMARY_MAX_TOKENS    要約の長さの目安 (デフォルト 300)
+#   CHAT_CONTEXT_CACHE_TTL_SECONDS     要約キャッシュの有効期間 (デフォルト 3600秒)
+#   CHAT_CONTEXT_CACHE_MAXSIZE         要約キャッシュの最大件数 (デフォルト 10000)
+#
+# トークン数は tiktoken がインストールされていればそれで数え、なければ文字種から概算します。
+
+import hashlib
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from cachetools import TTLCache
+from dotenv import load_dotenv
+
+from .app_logging import get_logger
+from .llm_client import LLM_MODEL, LLMError, get_llm_client
+
+try:
+    import tiktoken
+except ImportError: # tiktoken は任意
+    tiktoken = None
+
+load_dotenv()
+
+log = get_logger("chat_context")
+
+CHAT_CONTEXT_MAX_TOKENS = int(os.getenv("CHAT_CONTEXT_MAX_TOKENS", 3000))
+CHAT_CONTEXT_TARGET_RATIO = float(os.getenv("CHAT_CONTEXT_TARGET_RATIO", 0.6))
+CHAT_CONTEXT_MIN_RECENT_MESSAGES = int(os.getenv("CHAT_CONTEXT_MIN_RECENT_MESSAGES", 2))
+CHAT_CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_CONTEXT_SUMMARY_MAX_TOKENS", 300))
+CHAT_CONTEXT_CACHE_TTL_SECONDS = float(os.getenv("CHAT_CONTEXT_CACHE_TTL_SECONDS", 3600))
+CHAT_CONTEXT_CACHE_MAXSIZE = int(os.getenv("CHAT_CONTEXT_CACHE_MAXSIZE", 10000))
+
+# チャット形式では1メッセージごとに role などの分のトークンが加わる
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = (
+    "あなたは会話の要約係です。以下のユーザーとアシスタントの会話を、"
+    "この後の会話を続けるのに必要な情報（ユーザーの体調・悩み・気持ち・アシスタントが伝えたアドバイス）を残して、"
+    f"日本語で{CHAT_CONTEXT_SUMMARY_MAX_TOKENS}トークン以内に要約してください。"
+    "「これまでの要約」がある場合は、その内容も含めて1つの要約にまとめ直してください。"
+)
+
+
+# ==== トークン数 ====
+
+_encoding = None
+if tiktoken is not None:
+    try:
+        _encoding = tiktoken.encoding_for_model(LLM_MODEL)
+    except KeyError:
+        _encoding = tiktoken.get_encoding("o200k_base")
+
+
+def count_text_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    # 概算: ASCIIは約4文字で1トークン、日本語などはほぼ1文字1トークン
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def count_message_tokens(message: dict) -> int:
+    return MESSAGE_OVERHEAD_TOKENS + count_text_tokens(message["content"])
+
+
+def count_tokens(messages: list[dict]) -> int:
+    return sum(count_message_tokens(m) for m in messages)
+
+
+# ==== 要約キャッシュ ====
+
+@dataclass
+class SummaryEntry:
+    covered: int # 要約に含まれている先頭からのメッセージ数
+    prefix_hash: str # 要約した範囲のハッシュ (クライアントが履歴を書き換えていないかの確認用)
+    summary: str
+
+
+_lock = threading.Lock()
+_summary_cache = TTLCache(maxsize=CHAT_CONTEXT_CACHE_MAXSIZE, ttl=CHAT_CONTEXT_CACHE_TTL_SECONDS)
+
+
+def _hash_messages(messages: list[dict]) -> str:
+    payload = [[m["role"], m["content"]] for m in messages]
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _conversation_key(user_id: Optional[int], mode: str, messages: list[dict]) -> str:
+    # 会話は (ユーザー, モード, 最初のメッセージ) で識別する
+    return _hash_messages([{"role": str(user_id), "content": mode}, messages[0]])
+
+
+def _get_summary(key: str, messages: list[dict]) -> Optional[SummaryEntry]:
+    with _lock:
+        entry = _summary_cache.get(key)
+    if entry is None or entry.covered > len(messages):
+        return None
+    if _hash_messages(messages[:entry.covered]) != entry.prefix_hash:
+        return None
+    return entry
+
+
+def _set_summary(key: str, messages: list[dict], covered: int, summary: str) -> SummaryEntry:
+    entry = SummaryEntry(covered=covered, prefix_hash=_hash_messages(messages[:covered]), summary=summary)
+    with _lock:
+        _summary_cache[key] = entry
+    return entry
+
+
+def clear_cache() -> None:
+    with _lock:
+        _summary_cache.clear()
+
+
+# ==== コンテキストの組み立て ====
+
+def summary_message(summary: str) -> dict:
+    return {"role": "system", "content": f"これまでの会話の要約:\n{summary}"}
+
+
+def _split_recent(messages: list[dict], budget: int, start: int) -> int:
+    """
+    messages[start:] のうち、末尾から budget トークンに収まる範囲の開始位置を返します。
+    直近の CHAT_CONTEXT_MIN_RECENT_MESSAGES 件は予算を超えても必ず残します。
+    """
+    split = len(messages)
+    used = 0
+    while split > start:
+        tokens = count_message_tokens(messages[split - 1])
+        if used + tokens > budget and len(messages) - split >= CHAT_CONTEXT_MIN_RECENT_MESSAGES:
+            break
+        used += tokens
+        split -= 1
+    return split
+
+
+async def _summarize(previous: Optional[str], messages: list[dict], user_id: Optional[int]) -> str:
+    lines = []
+    if previous:
+        lines.append(f"これまでの要約:\n{previous}\n")
+    for m in messages:
+        speaker = "ユーザー" if m["role"] == "user" else "アシスタント"
+        lines.append(f"{speaker}: {m['content']}")
+    return await get_llm_client().complete(
+        [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": "\n".join(lines)}],
+        user_id=user_id,
+    )
+
+
+async def fit_to_budget(
+    system_prompt: str,
+    messages: list[dict],
+    mode: str,
+    user_id: Optional[int] = None,
+    max_tokens: int = CHAT_CONTEXT_MAX_TOKENS,
+) -> list[dict]:
+    """
+    システムプロンプト + 会話履歴をトークン予算内に収めたメッセージのリストを返します。
+    古いやりとりは要約に置き換えます。要約に失敗した場合は古いやりとりを切り捨てます。
+    """
+    system = {"role": "system", "content": system_prompt}
+    if count_tokens([system] + messages) <= max_tokens or len(messages) <= CHAT_CONTEXT_MIN_RECENT_MESSAGES:
+        return [system] + messages
+
+    key = _conversation_key(user_id, mode, messages)
+    entry = _get_summary(key, messages)
+
+    # 前のターンの要約がそのまま使えるなら、LLMを呼ばずに済ませる
+    if entry is not None:
+        prompt = [system, summary_message(entry.summary)] + messages[entry.covered:]
+        if count_tokens(prompt) <= max_tokens:
+            return prompt
+
+    # 要約し直す: 直近のやりとりは予算の一部 (TARGET_RATIO) に収まるところまで残す
+    covered = entry.covered if entry is not None else 0
+    reserved = count_tokens([system]) + MESSAGE_OVERHEAD_TOKENS + CHAT_CONTEXT_SUMMARY_MAX_TOKENS
+    recent_budget = max(int(max_tokens * CHAT_CONTEXT_TARGET_RATIO) - reserved, 0)
+    split = max(_split_recent(messages, recent_budget, covered), covered)
+    if split == covered:
+        # 直近のメッセージだけで予算を超えている。これ以上は要約できないのでそのまま送る
+        if entry is not None:
+            return [system, summary_message(entry.summary)] + messages[covered:]
+        return [system] + messages
+
+    try:
+        summary = await _summarize(entry.summary if entry else None, messages[covered:split], user_id)
+        entry = _set_summary(key, messages, split, summary)
+    except LLMError as e:
+        # 会話の要約に失敗したため、古いやりとりを切り捨てる
+        log.warning("chat_context.summarize_failed", error=str(e), user_id=user_id)
+        split = _split_recent(messages, max(max_tokens - count_tokens([system]), 0), 0)
+        return [system] + messages[split:]
+    return [system, summary_message(entry.summary)] + messages[split:]
@@ -1,13 +1,17 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, desc, asc # SQLAlchemyの関数もインポート
-from .database import User, Period, PasswordResetToken, ChatMessage
-from .schemas import UserCreate, PeriodCreate, PeriodUpdate, UserUpdate, ChatMessageCreate
+from sqlalchemy import and_, desc, asc, func, select # SQLAlchemyの関数もインポート
+from sqlalchemy.dialects import postgresql, sqlite
+from .database import User, Period, PasswordResetToken, ChatMessage, UserCycleStats
+from .schemas import UserCreate, PeriodCreate, PeriodUpdate, UserUpdate, ChatMessageCreate, PeriodImportRowError
+from . import bulk_load, period_calendar, period_forecast, period_import
 from datetime import date, timedelta, datetime, timezone
-from passlib.context import CryptContext
+from .password_hashing import pwd_context
+from .pagination import InvalidCursor, apply_keyset
+from .prediction_engines import DEFAULT_CYCLE_LENGTH, DEFAULT_PERIOD_LENGTH, get_prediction_engine
 import uuid
 from typing import List, Optional,Tuple
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 同期版。async def のエンドポイントからは password_hashing の非同期APIを使うこと
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
@@ -42,19 +46,24 @@ def create_user(db: Session, user: UserCreate, auth_provider: str = "local", goo
     if user.password: # パスワードが提供されている場合のみハッシュ化
         hashed_password = get_password_hash(user.password)
 
-    db_user = User(
+    db_user = _new_user(user, hashed_password, auth_provider, google_sub)
+    db.add(db_user)
+    db.commit()
+    db.refresh(db_user)
+    return db_user
+
+def _new_user(user: UserCreate, hashed_password: Optional[str], auth_provider: str, google_sub: Optional[str]) -> User:
+    return User(
         email=user.email,
         hashed_password=hashed_password, # Noneの場合もそのままセット
         name=user.name,
         auth_provider=auth_provider,
         google_sub=google_sub,  # Google認証の場合に設定
         created_at=datetime.now(timezone.utc), # 追加
-        updated_at=datetime.now(timezone.utc)  # 追加
+        updated_at=datetime.now(timezone.utc),  # 追加
+        # 周期統計の行はユーザーと同じトランザクションで作っておく (後から作るときの競合を避ける)
+        cycle_stats=UserCycleStats(period_count=0, period_length_sum=0, updated_at=datetime.now(timezone.utc)),
     )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
 
 # ==== Period CRUD ====
 
@@ -63,49 +72,199 @@ def create_user(db: Session, user: UserCreate, auth_provider: str = "local", goo
 # def get_user_by_id(db: Session, user_id: int) -> Optional[User]:
 #     return db.query(User).filter(User.id == user_id).first()
 
-def calculate_average_period_data(db: Session, user_id: int) -> Tuple[int, int]:
+def _apply_completed_period(stats: UserCycleStats, start_date: date, end_date: date) -> None:
     """
-    ユーザーの過去の生理記録から、平均生理期間と平均生理周期を計算します。
+    完了済みの生理期間1件を統計に加算します。
+    """
+    stats.period_count += 1
+    stats.period_length_sum += (end_date - start_date).days + 1
+    if stats.first_start_date is None or start_date < stats.first_start_date:
+        stats.first_start_date = start_date
+    if stats.last_start_date is None or start_date > stats.last_start_date:
+        stats.last_start_date = start_date
+
+
+def _completed_start_bounds_query(user_id: int, period_id: int):
+    """指定期間を除いた、完了済み生理期間の最初/最後の開始日を求めるクエリ。"""
+    return select(func.min(Period.start_date), func.max(Period.start_date)).where(
+        Period.user_id == user_id,
+        Period.id != period_id,
+        Period.end_date.isnot(None)
+    )
+
+
+def _subtract_completed_period(stats: UserCycleStats, start_date: date, end_date: date) -> bool:
+    """
+    完了済みの生理期間1件を統計から差し引きます。
+    最初/最後の開始日を取り直す必要がある場合は True を返します。
+    """
+    stats.period_count -= 1
+    stats.period_length_sum -= (end_date - start_date).days + 1
+
+    if stats.period_count <= 0:
+        stats.period_count = 0
+        stats.period_length_sum = 0
+        stats.first_start_date = None
+        stats.last_start_date = None
+        return False
+
+    return start_date in (stats.first_start_date, stats.last_start_date)
+
+
+def _remove_completed_period(db: Session, stats: UserCycleStats, period_id: int, start_date: date, end_date: date) -> None:
+    """
+    完了済みの生理期間1件を統計から取り除きます（編集時に変更前の値を差し引くために使用）。
+    最初/最後の開始日が取り除かれる場合のみ、残りの完了済み期間から MIN/MAX を取り直します。
     """
-    past_periods = db.query(Period).filter(
+    if _subtract_completed_period(stats, start_date, end_date):
+        stats.first_start_date, stats.last_start_date = db.execute(
+            _completed_start_bounds_query(stats.user_id, period_id)
+        ).one()
+
+
+def _completed_periods_query(user_id: int):
+    """ユーザーの完了済み生理期間の (start_date, end_date) を取得するクエリ。"""
+    return select(Period.start_date, Period.end_date).where(
         Period.user_id == user_id,
         Period.start_date.isnot(None),
         Period.end_date.isnot(None)
-    ).order_by(Period.start_date.asc()).all()
+    )
+
+
+def _reset_cycle_stats(stats: UserCycleStats, completed_periods) -> None:
+    """統計を (start_date, end_date) の一覧から計算し直します。"""
+    stats.period_count = 0
+    stats.period_length_sum = 0
+    stats.first_start_date = None
+    stats.last_start_date = None
+    for start_date, end_date in completed_periods:
+        _apply_completed_period(stats, start_date, end_date)
+    stats.updated_at = datetime.now(timezone.utc)
+
+
+# upsert 用の INSERT (ON CONFLICT DO NOTHING) を持つ方言
+# それ以外の方言では、ユーザーの行をロックしてから統計の行の有無を確認して作ります (_lock_user_query)
+_DIALECT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def _new_cycle_stats_values(user_id: int) -> dict:
+    return {"user_id": user_id, "period_count": 0, "period_length_sum": 0, "updated_at": datetime.now(timezone.utc)}
+
 
-    period_lengths = []
-    cycle_lengths = []
+def _insert_missing_cycle_stats(dialect_insert, user_id: int):
+    """
+    周期統計の行がなければ空の行を作る INSERT ... ON CONFLICT DO NOTHING。
+    同時に作ろうとしても IntegrityError にならず、どちらか一方だけが挿入されます (rowcount が 1 になる)。
+    """
+    return dialect_insert(UserCycleStats).values(**_new_cycle_stats_values(user_id)).on_conflict_do_nothing(index_elements=["user_id"])
+
+
+def _lock_user_query(user_id: int):
+    """
+    ユーザーの行をロックするクエリ (SELECT ... FOR UPDATE)。
+    upsert のない方言で、同じユーザーの統計の行を同時に作らないように、作る前にこのロックを取ります。
+    """
+    return select(User.id).where(User.id == user_id).with_for_update()
 
-    for i, current_period in enumerate(past_periods):
-        if current_period.end_date and current_period.start_date:
-            period_length = (current_period.end_date - current_period.start_date).days + 1
-            period_lengths.append(period_length)
 
-        if i + 1 < len(past_periods):
-            next_period = past_periods[i+1]
-            if next_period.start_date and current_period.start_date:
-                cycle_length = (next_period.start_date - current_period.start_date).days
-                cycle_lengths.append(cycle_length)
+def _locked_cycle_stats_query(user_id: int):
+    """
+    周期統計の行をロックして取得するクエリ (SELECT ... FOR UPDATE)。
+    同じユーザーの統計を書き換える処理はコミットまで順番に待つので、読んで書き戻す間に更新が失われません。
+    SQLite は FOR UPDATE を無視しますが、書き込みは1つずつしか実行されないので同じ結果になります。
+    Session に読み込み済みのインスタンスがあっても、ロックを取った時点の値で上書きします (populate_existing)。
+    """
+    return select(UserCycleStats).where(UserCycleStats.user_id == user_id).with_for_update().execution_options(populate_existing=True)
+
 
-    # 計算ロジックを修正 (四捨五入して+1を削除)
-    avg_period_length = int(round(sum(period_lengths) / len(period_lengths))) if period_lengths else 5
-    avg_cycle_length = int(round(sum(cycle_lengths) / len(cycle_lengths))) if cycle_lengths else 28
+def _create_missing_cycle_stats(db: Session, user_id: int) -> bool:
+    """周期統計の行がなければ空の行を作ります。作った場合は True を返します。"""
+    dialect_insert = _DIALECT_INSERTS.get(db.get_bind().dialect.name)
+    if dialect_insert is not None:
+        return bool(db.execute(_insert_missing_cycle_stats(dialect_insert, user_id)).rowcount)
+    db.execute(_lock_user_query(user_id))
+    if db.execute(_locked_cycle_stats_query(user_id)).scalar_one_or_none() is not None:
+        return False
+    db.add(UserCycleStats(**_new_cycle_stats_values(user_id)))
+    db.flush()
+    return True
 
+
+def rebuild_user_cycle_stats(db: Session, user_id: int) -> UserCycleStats:
+    """
+    periodsテーブルからユーザーの周期統計を作り直します（修復用）。
+    コミットは呼び出し側で行います。
+    """
+    _create_missing_cycle_stats(db, user_id)
+    stats = db.execute(_locked_cycle_stats_query(user_id)).scalar_one()
+
+    completed_periods = db.execute(_completed_periods_query(user_id)).all()
+    _reset_cycle_stats(stats, completed_periods)
+    return stats
+
+
+def rebuild_all_cycle_stats(db: Session) -> int:
+    """
+    periodsを持つ全ユーザーの周期統計を作り直してコミットします。再構築したユーザー数を返します。
+    """
+    user_ids = [user_id for (user_id,) in db.query(Period.user_id).distinct().all()]
+    for user_id in user_ids:
+        rebuild_user_cycle_stats(db, user_id)
+    db.commit()
+    return len(user_ids)
+
+
+def get_user_cycle_stats(db: Session, user_id: int, for_update: bool = False) -> UserCycleStats:
+    """
+    ユーザーの周期統計を取得します。まだ存在しない場合（既存ユーザーなど）はperiodsから構築します。
+    統計を書き換える場合は for_update=True にして、コミットまで行をロックしてください。
+    """
+    if not for_update:
+        stats = db.get(UserCycleStats, user_id)
+        if stats is not None:
+            return stats
+    if _create_missing_cycle_stats(db, user_id):
+        return rebuild_user_cycle_stats(db, user_id) # 今作った空の行を periods から構築する
+    return db.execute(_locked_cycle_stats_query(user_id)).scalar_one()
+
+
+def average_period_data_from_stats(stats: UserCycleStats) -> Tuple[int, int]:
+    """
+    周期統計から平均生理期間と平均生理周期を計算します。
+    """
+    cycle_count = stats.period_count - 1
+    avg_period_length = int(round(stats.period_length_sum / stats.period_count)) if stats.period_count > 0 else DEFAULT_PERIOD_LENGTH
+    avg_cycle_length = int(round((stats.last_start_date - stats.first_start_date).days / cycle_count)) if cycle_count > 0 else DEFAULT_CYCLE_LENGTH
     return avg_period_length, avg_cycle_length
 
 
-def create_period(db: Session, period: PeriodCreate, user_id: int) -> Period:
+def _completed_history_query(user_id: int):
+    """予測エンジンに渡す、完了済み生理期間の (start_date, end_date) を開始日順に取得するクエリ。"""
+    return _completed_periods_query(user_id).order_by(Period.start_date)
+
+
+def calculate_average_period_data(db: Session, user_id: int) -> Tuple[int, int]:
     """
-    新しい生理期間記録を作成します。
-    この関数は、「この生理の予測終了日」を計算し、`prediction_end_date`に保存します。
+    ユーザーの過去の生理記録から、平均生理期間と平均生理周期を計算します。
+    単純平均 (mean エンジン) の場合は全履歴を走査せず、user_cycle_statsに保持している累積値から求めます。
+    それ以外のエンジンでは完了済みの履歴を読み出して予測エンジン (prediction_engines.py) に渡します。
     """
-    avg_period_length, _ = calculate_average_period_data(db, user_id)
+    engine = get_prediction_engine()
+    if engine.uses_cycle_stats:
+        return average_period_data_from_stats(get_user_cycle_stats(db, user_id))
+    return engine.predict(db.execute(_completed_history_query(user_id)).all())
+
 
+def _new_period(period: PeriodCreate, user_id: int, avg_period_length: int) -> Period:
+    """
+    新しい生理期間のORMオブジェクトを作ります。
+    「この生理の予測終了日」を計算し、`prediction_end_date`に設定します。
+    """
     # 「この生理の予測終了日」を計算
     # (start_date + 平均生理期間日数 - 1日)
     predicted_current_period_end_date = period.start_date + timedelta(days=avg_period_length - 1)
 
-    db_period = Period(
+    return Period(
         user_id=user_id,
         start_date=period.start_date,
         # *** ここを変更 ***
@@ -116,12 +275,33 @@ def create_period(db: Session, period: PeriodCreate, user_id: int) -> Period:
         created_at=datetime.now(timezone.utc),
         updated_at=datetime.now(timezone.utc)
     )
+
+
+def create_period(db: Session, period: PeriodCreate, user_id: int) -> Period:
+    """
+    新しい生理期間記録を作成します。
+    この関数は、「この生理の予測終了日」を計算し、`prediction_end_date`に保存します。
+    """
+    avg_period_length, _ = calculate_average_period_data(db, user_id)
+
+    db_period = _new_period(period, user_id, avg_period_length)
     db.add(db_period)
     db.commit()
     db.refresh(db_period) # DBが生成したIDなどを取得するためにリフレッシュ
     return db_period
 
 
+def get_active_period(db: Session, user_id: int) -> Optional[Period]:
+    """
+    ユーザーの進行中（end_date が NULL）の生理期間を取得します。
+    """
+    return db.scalars(_active_period_query(user_id)).first()
+
+
+def _active_period_query(user_id: int):
+    return select(Period).where(Period.user_id == user_id, Period.start_date.isnot(None), Period.end_date.is_(None)).limit(1)
+
+
 
 def get_periods(
     db: Session,
@@ -138,52 +318,83 @@ def get_periods(
     """
     query = db.query(Period).filter(Period.user_id == user_id)
 
-def get_periods(
-    db: Session,
+# カーソルページングに対応する並び順のカラム (NULL を含まないもの)
+PERIOD_CURSOR_COLUMNS = ("start_date", "created_at", "id")
+
+def _periods_query(
     user_id: int,
-    skip: int = 0,
-    limit: int = 100, # 重複を解消し、デフォルト値を設定
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
     order_by: str = "start_date",
     order_direction: str = "desc",
-) -> List[Period]:
+    cursor: Optional[str] = None,
+):
     """
-    指定されたユーザーの生理記録を全て取得します（フィルタリングオプション付き）。
+    get_periods のクエリ（フィルタリングとソート）を組み立てます。同期版と非同期版で共有します。
+    cursor を渡すと、そのカーソルの続きから取得します (pagination.py)。
     """
-    query = db.query(Period).filter(Period.user_id == user_id)
+    query = select(Period).where(Period.user_id == user_id)
 
     # --- 全てのフィルタリングロジックをここにまとめる ---
     # Period が database.py から直接インポートされているため、Period を直接使う
     if start_date and end_date:
         # 開始日が指定期間の終了日以前、かつ
         # (終了日が指定期間の開始日以降、または終了日がNULL)
-        query = query.filter(
+        query = query.where(
             and_(
                 Period.start_date <= end_date,
                 (Period.end_date >= start_date) | (Period.end_date.is_(None)) # .is_(None) を使用
             )
         )
     elif start_date: # start_dateのみ指定の場合
-        query = query.filter(Period.start_date >= start_date)
+        query = query.where(Period.start_date >= start_date)
     elif end_date: # end_dateのみ指定の場合
         # 指定されたend_dateまでに開始する生理期間
-        query = query.filter(Period.start_date <= end_date)
+        query = query.where(Period.start_date <= end_date)
 
     # --- ソートの適用 (フィルタリングの後) ---
+    # 同じ値の行の順序が毎回変わらないように id を第2キーにする (カーソルページングにも必要)
+    if order_by in PERIOD_CURSOR_COLUMNS:
+        return apply_keyset(
+            query, getattr(Period, order_by), Period.id,
+            descending=order_direction == "desc", cursor=cursor, order=period_cursor_order(order_by, order_direction),
+        )
+    if cursor is not None:
+        raise InvalidCursor(f"cursor pagination is not supported for order_by={order_by}")
     if order_direction == "desc":
-        query = query.order_by(desc(getattr(Period, order_by)))
+        query = query.order_by(desc(getattr(Period, order_by)), Period.id.desc())
     else:
-        query = query.order_by(asc(getattr(Period, order_by)))
+        query = query.order_by(asc(getattr(Period, order_by)), Period.id.asc())
+    return query
+
+
+def period_cursor_order(order_by: str, order_direction: str) -> str:
+    """生理記録一覧のカーソルに埋め込む並び順の識別子。"""
+    return f"periods:{order_by}:{order_direction}"
+
+
+def get_periods(
+    db: Session,
+    user_id: int,
+    skip: int = 0,
+    limit: Optional[int] = 100, # 重複を解消し、デフォルト値を設定
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    order_by: str = "start_date",
+    order_direction: str = "desc",
+    cursor: Optional[str] = None,
+) -> List[Period]:
+    """
+    指定されたユーザーの生理記録を全て取得します（フィルタリングオプション付き）。
+    """
+    query = _periods_query(user_id, start_date, end_date, order_by, order_direction, cursor)
 
     # --- オフセットとリミットの適用 (ソートの後) ---
     # これらを一度だけ、正しく適用します
     query = query.offset(skip).limit(limit)
 
     # --- クエリの実行 ---
-    # 最終的なクエリを .all() で実行します。
-    # ここで order_by, offset, limit を再度呼び出さない
-    return query.all()
+    return list(db.scalars(query))
 
 def get_period_by_id(db: Session, period_id: int, user_id: int) -> Optional[Period]:
     """
@@ -192,15 +403,11 @@ def get_period_by_id(db: Session, period_id: int, user_id: int) -> Optional[Peri
     return db.query(Period).filter(Period.id == period_id, Period.user_id == user_id).first()
 
 
-def update_period(db: Session, db_period: Period, period_update: PeriodUpdate) -> Period:
+def _apply_period_update(db_period: Period, period_update: PeriodUpdate) -> bool:
     """
-    生理期間記録を更新します。
-    start_dateまたはend_dateが変更された場合、関連する予測日を再計算します。
+    更新データを db_period に適用します。
+    start_date または end_date が実際に変わった場合は True を返します。
     """
-    # 変更前のstart_dateとend_dateを保持 (変更があったか確認するため)
-    original_start_date = db_period.start_date
-    original_end_date = db_period.end_date
-
     # Pydanticモデルから更新データを取得
     # exclude_unset=True: リクエストに含まれないフィールドは更新しない
     # exclude_none=False: Noneが指定された場合は、そのフィールドをNoneで更新する
@@ -235,31 +442,164 @@ def update_period(db: Session, db_period: Period, period_update: PeriodUpdate) -
             is_end_date_changed = True
         db_period.end_date = update_data["end_date"] # 新しい値をセット
 
+    return is_start_date_changed or is_end_date_changed
+
+
+def _set_period_predictions(db_period: Period, avg_period_length: int, avg_cycle_length: int) -> None:
+    """
+    平均値から db_period の予測日を再計算します。
+    """
+    # prediction_end_date (この生理の予測終了日) は start_date を基準に常に再計算
+    db_period.prediction_end_date = db_period.start_date + timedelta(days=avg_period_length - 1)
+
+    # prediction_next_start_date (次回の生理予測開始日) は end_date が確定した場合に計算
+    if db_period.end_date is not None:
+        # 一般的に、次回の生理開始日は今回の生理開始日 + 平均生理周期 で計算されることが多い
+        # もし「今回の生理終了日 + 平均周期」であればロジックを変更
+        db_period.prediction_next_start_date = db_period.start_date + timedelta(days=avg_cycle_length)
+    else:
+        # end_dateがNoneの場合は次回の予測日もNoneにする
+        db_period.prediction_next_start_date = None
+
+
+def update_period(db: Session, db_period: Period, period_update: PeriodUpdate) -> Period:
+    """
+    生理期間記録を更新します。
+    start_dateまたはend_dateが変更された場合、関連する予測日を再計算します。
+    """
+    # 変更前のstart_dateとend_dateを保持 (変更があったか確認するため)
+    original_start_date = db_period.start_date
+    original_end_date = db_period.end_date
+
     # 予測の再計算が必要かどうかの判断
     # start_date または end_date のいずれかが変更された場合に予測を再計算する
-    if is_start_date_changed or is_end_date_changed:
+    if _apply_period_update(db_period, period_update):
+        # 予測には今回の書き込み前の統計を使う (autoflush しないので、DBにはまだ変更前の値が入っている)
+        # 統計を先に取得して参照を持っておく (Session の identity map は弱参照なので、
+        # calculate_average_period_data の後に取得すると同じ行をもう一度 SELECT してしまう)
+        # 行はコミットまでロックして、同じユーザーの同時の更新と差分が混ざらないようにする
+        stats = get_user_cycle_stats(db, db_period.user_id, for_update=True)
         avg_period_length, avg_cycle_length = calculate_average_period_data(db, db_period.user_id)
-        
-        # prediction_end_date (この生理の予測終了日) は start_date を基準に常に再計算
-        db_period.prediction_end_date = db_period.start_date + timedelta(days=avg_period_length - 1)
-
-        # prediction_next_start_date (次回の生理予測開始日) は end_date が確定した場合に計算
-        if db_period.end_date is not None:
-            # 一般的に、次回の生理開始日は今回の生理開始日 + 平均生理周期 で計算されることが多い
-            # もし「今回の生理終了日 + 平均周期」であればロジックを変更
-            db_period.prediction_next_start_date = db_period.start_date + timedelta(days=avg_cycle_length)
-        else:
-            # end_dateがNoneの場合は次回の予測日もNoneにする
-            db_period.prediction_next_start_date = None
+
+        # 統計を差分更新 (変更前が完了済みなら差し引き、変更後が完了済みなら加算)
+        if original_start_date is not None and original_end_date is not None:
+            _remove_completed_period(db, stats, db_period.id, original_start_date, original_end_date)
+        if db_period.start_date is not None and db_period.end_date is not None:
+            _apply_completed_period(stats, db_period.start_date, db_period.end_date)
+        stats.updated_at = datetime.now(timezone.utc)
+
+        _set_period_predictions(db_period, avg_period_length, avg_cycle_length)
 
     # updated_at は常に更新
     db_period.updated_at = datetime.now(timezone.utc)
     
     db.add(db_period) # 変更をステージング
-    db.commit() # データベースに保存
+    db.commit() # データベースに保存 (統計の更新も同じトランザクションでコミットされる)
     db.refresh(db_period) # 最新の状態をリフレッシュ
     return db_period
 
+def _periods_watermark_query(user_id: int):
+    """ユーザーの生理記録の変更の目印 (最大 updated_at, 件数)。ETag に使います。"""
+    return select(func.max(Period.updated_at), func.count(Period.id)).where(Period.user_id == user_id)
+
+
+def get_periods_watermark(db: Session, user_id: int) -> tuple:
+    return tuple(db.execute(_periods_watermark_query(user_id)).one())
+
+
+def _latest_period_start_query(user_id: int):
+    return select(func.max(Period.start_date)).where(Period.user_id == user_id)
+
+
+def get_calendar_day_states(db: Session, user_id: int, range_start: date, range_end: date, today: date) -> dict:
+    """
+    range_start〜range_end の日ごとのカレンダーの状態を計算します (period_calendar.build_day_states)。
+    """
+    periods = db.scalars(_periods_query(user_id, range_start, range_end, order_direction="asc"))
+    latest_start = db.scalar(_latest_period_start_query(user_id))
+    avg_period_length, avg_cycle_length = calculate_average_period_data(db, user_id)
+    return period_calendar.build_day_states(
+        range_start, range_end,
+        [(p.start_date, p.end_date, p.prediction_end_date) for p in periods],
+        latest_start, avg_period_length, avg_cycle_length, today,
+    )
+
+
+def _completed_start_dates_query(user_id: int):
+    """周期のばらつきの計算用に、完了済み生理期間の開始日を開始日順に取得するクエリ。"""
+    return select(Period.start_date).where(
+        Period.user_id == user_id,
+        Period.end_date.isnot(None)
+    ).order_by(Period.start_date)
+
+
+def _forecast_params(latest_start: Optional[date], averages: Tuple[int, int], start_dates) -> period_forecast.ForecastParams:
+    avg_period_length, avg_cycle_length = averages
+    return period_forecast.ForecastParams(
+        latest_start=latest_start,
+        avg_period_length=avg_period_length,
+        avg_cycle_length=avg_cycle_length,
+        cycle_length_sd=period_forecast.cycle_length_sd(start_dates),
+        cycle_count=max(len(start_dates) - 1, 0),
+    )
+
+
+def get_forecast_params(db: Session, user_id: int) -> period_forecast.ForecastParams:
+    """
+    複数周期の予測 (period_forecast.build_forecast) の元になる値を求めます。
+    平均は calculate_average_period_data (mean エンジンなら周期統計) から、周期の標準偏差は完了済みの開始日から計算します。
+    """
+    latest_start = db.scalar(_latest_period_start_query(user_id))
+    averages = calculate_average_period_data(db, user_id)
+    start_dates = db.scalars(_completed_start_dates_query(user_id)).all()
+    return _forecast_params(latest_start, averages, start_dates)
+
+
+def _user_period_ranges_query(user_id: int):
+    """一括インポートの重なりチェック用に、ユーザーの既存期間の (start_date, end_date) を取得するクエリ。"""
+    return select(Period.start_date, Period.end_date).where(Period.user_id == user_id)
+
+
+def _plan_period_import(stats: UserCycleStats, raw_rows: list, existing) -> Tuple[List[dict], List[PeriodImportRowError]]:
+    """
+    インポートする行を検証し、挿入する行と行ごとのエラーを返します。
+    採用した完了済み期間は stats に加算し、加算後の平均値で全行の予測日を計算します。
+    """
+    rows, errors = period_import.validate_rows(raw_rows)
+    rows, overlap_errors = period_import.reject_overlaps(rows, existing)
+    errors = sorted(errors + overlap_errors, key=lambda error: error.row)
+
+    for _, row in rows:
+        if row.end_date is not None:
+            _apply_completed_period(stats, row.start_date, row.end_date)
+    stats.updated_at = datetime.now(timezone.utc)
+
+    engine = get_prediction_engine()
+    if engine.uses_cycle_stats:
+        avg_period_length, avg_cycle_length = average_period_data_from_stats(stats)
+    else:
+        history = sorted(
+            [(start, end) for start, end in existing if end is not None]
+            + [(row.start_date, row.end_date) for _, row in rows if row.end_date is not None]
+        )
+        avg_period_length, avg_cycle_length = engine.predict(history)
+    return period_import.build_period_rows(rows, stats.user_id, avg_period_length, avg_cycle_length), errors
+
+
+def import_periods(db: Session, user_id: int, raw_rows: list) -> Tuple[int, List[PeriodImportRowError]]:
+    """
+    生理期間をまとめてインポートします。問題のある行はスキップし、(挿入件数, 行ごとのエラー) を返します。
+    全行を executemany (PostgreSQL で行数が多い場合は COPY) で挿入し、周期統計の更新と合わせて1回だけコミットします。
+    """
+    stats = get_user_cycle_stats(db, user_id, for_update=True)
+    existing = db.execute(_user_period_ranges_query(user_id)).all()
+    period_rows, errors = _plan_period_import(stats, raw_rows, existing)
+    if period_rows:
+        columns = list(period_rows[0])
+        bulk_load.copy_rows(db.connection(), Period.__table__, columns, [tuple(row[name] for name in columns) for row in period_rows])
+    db.commit()
+    return len(period_rows), errors
+
 # def delete_period(db: Session, period_id: int, user_id: int) -> bool: # user_idを追加
 #     """
 #     指定されたIDの生理記録を削除します（ユーザーIDでフィルタリング）。
@@ -271,25 +611,55 @@ def update_period(db: Session, db_period: Period, period_update: PeriodUpdate) -
 #         return True
 #     return False
 
+# ==== Export ====
+
+# エクスポートする列 (ORMオブジェクトを作らず、行のまま流す)
+EXPORT_PERIOD_COLUMNS = (
+    Period.id, Period.start_date, Period.end_date,
+    Period.prediction_end_date, Period.prediction_next_start_date,
+    Period.created_at, Period.updated_at,
+)
+EXPORT_CHAT_MESSAGE_COLUMNS = (
+    ChatMessage.id, ChatMessage.mode, ChatMessage.query, ChatMessage.response,
+    ChatMessage.timestamp, ChatMessage.is_partial,
+)
+
+def _export_periods_query(user_id: int, after_id: int = 0):
+    """id 順に、after_id より後の生理期間を取得するクエリ (途中から再開できるように id で区切る)。"""
+    return select(*EXPORT_PERIOD_COLUMNS).where(Period.user_id == user_id, Period.id > after_id).order_by(Period.id)
+
+def _export_chat_messages_query(user_id: int, after_id: int = 0):
+    return (
+        select(*EXPORT_CHAT_MESSAGE_COLUMNS)
+        .where(ChatMessage.user_id == user_id, ChatMessage.id > after_id)
+        .order_by(ChatMessage.id)
+    )
+
 # ==== Password Reset Token CRUD ====
 
-def create_password_reset_token(db: Session, user_id: int) -> PasswordResetToken:
+def _new_password_reset_token(user_id: int) -> PasswordResetToken:
     token = str(uuid.uuid4())
     expires_at = datetime.now(timezone.utc) + timedelta(hours=1)
-    db_token = PasswordResetToken(user_id=user_id, token=token, expires_at=expires_at)
+    return PasswordResetToken(user_id=user_id, token=token, expires_at=expires_at)
+
+def _password_reset_token_query(token: str):
+    return select(PasswordResetToken).where(
+        PasswordResetToken.token == token,
+        PasswordResetToken.expires_at > datetime.now(timezone.utc)
+    )
+
+def create_password_reset_token(db: Session, user_id: int) -> PasswordResetToken:
+    db_token = _new_password_reset_token(user_id)
     db.add(db_token)
     db.commit()
     db.refresh(db_token)
     return db_token
 
 def get_password_reset_token(db: Session, token: str) -> Optional[PasswordResetToken]:
-    return db.query(PasswordResetToken).filter(
-        PasswordResetToken.token == token,
-        PasswordResetToken.expires_at > datetime.now(timezone.utc)
-    ).first()
+    return db.scalars(_password_reset_token_query(token)).first()
 
 def delete_password_reset_token(db: Session, token_id: int) -> bool:
-    db_token = db.query(PasswordResetToken).filter(PasswordResetToken.id == token_id).first()
+    db_token = db.get(PasswordResetToken, token_id)
     if db_token:
         db.delete(db_token)
         db.commit()
@@ -298,22 +668,40 @@ def delete_password_reset_token(db: Session, token_id: int) -> bool:
 
 # ==== ChatMessage CRUD ====
 
-def create_chat_message(db: Session, chat_message: ChatMessageCreate, user_id: int, ai_response: str) -> ChatMessage:
+def _new_chat_message(chat_message: ChatMessageCreate, user_id: int, ai_response: str, is_partial: bool = False) -> ChatMessage:
     # messages配列から最後のユーザーメッセージを取得してqueryとして保存
     user_messages = [msg for msg in chat_message.messages if msg.role == "user"]
     last_user_query = user_messages[-1].content if user_messages else ""
     
-    db_chat_message = ChatMessage(
+    return ChatMessage(
         user_id=user_id,
         query=last_user_query,
         response=ai_response,
         timestamp=datetime.now(timezone.utc),
-        mode=chat_message.mode
+        mode=chat_message.mode,
+        is_partial=is_partial
     )
+
+def create_chat_message(db: Session, chat_message: ChatMessageCreate, user_id: int, ai_response: str) -> ChatMessage:
+    db_chat_message = _new_chat_message(chat_message, user_id, ai_response)
     db.add(db_chat_message)
     db.commit()
     db.refresh(db_chat_message)
     return db_chat_message 
 
-def get_chat_messages(db: Session, user_id: int, skip: int = 0, limit: int = 100) -> List[ChatMessage]:
-    return db.query(ChatMessage).filter(ChatMessage.user_id == user_id).order_by(ChatMessage.timestamp.desc()).offset(skip).limit(limit).all()
\ No newline at end of file
+CHAT_CURSOR_ORDER = "chat:timestamp:desc"
+
+def _chat_messages_query(user_id: int, cursor: Optional[str] = None):
+    # 新しい順。(timestamp, id) のインデックス ix_chat_messages_user_id_timestamp をそのまま使える
+    query = select(ChatMessage).where(ChatMessage.user_id == user_id)
+    return apply_keyset(query, ChatMessage.timestamp, ChatMessage.id, descending=True, cursor=cursor, order=CHAT_CURSOR_ORDER)
+
+def _chat_messages_watermark_query(user_id: int):
+    """ユーザーのチャット履歴の変更の目印 (最大 timestamp, 最大 id, 件数)。ETag に使います。"""
+    return select(func.max(ChatMessage.timestamp), func.max(ChatMessage.id), func.count(ChatMessage.id)).where(ChatMessage.user_id == user_id)
+
+def get_chat_messages_watermark(db: Session, user_id: int) -> tuple:
+    return tuple(db.execute(_chat_messages_watermark_query(user_id)).one())
+
+def get_chat_messages(db: Session, user_id: int, skip: int = 0, limit: int = 100, cursor: Optional[str] = None) -> List[ChatMessage]:
+    return list(db.scalars(_chat_messages_query(user_id, cursor).offset(skip).limit(limit)))
\ No newline at end of file
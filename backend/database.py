@@ -1,8 +1,11 @@
 # backend/database.py
 
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Date, ForeignKey, func, event, JSON
+from sqlalchemy import create_engine, Boolean, Column, Integer, String, DateTime, Date, ForeignKey, func, event, JSON, Index, text
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, relationship, declarative_base
-from typing import Generator
+from typing import AsyncGenerator, Generator
 from datetime import datetime, timezone # timezone をインポート
 
 
@@ -11,15 +14,109 @@ from dotenv import load_dotenv
 import os
 load_dotenv()
 
-DATABASE_URL = os.getenv("DATABASE_URL")
-
-# SQLiteの場合、check_same_thread=Falseが必要
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+def normalize_database_url(database_url: str) -> str:
+    """postgres:// (Heroku などの形式) は SQLAlchemy が受け付けないので postgresql:// に直します。"""
+    if database_url and database_url.startswith("postgres://"):
+        return "postgresql://" + database_url[len("postgres://"):]
+    return database_url
+
+DATABASE_URL = normalize_database_url(os.getenv("DATABASE_URL"))
+
+# ==== コネクションプール (PostgreSQL などのサーバー型のデータベース) ====
+# 同期エンジンと非同期エンジンがそれぞれプールを持つので、1ワーカーあたりの最大接続数は
+# 2 x (DB_POOL_SIZE + DB_MAX_OVERFLOW) です。ワーカー数を掛けた値が max_connections を超えないようにしてください。
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+# サーバーやロードバランサーに切られる前に、この秒数より古い接続は作り直す
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+# 取り出すときに接続が生きているか確認する (再起動・フェイルオーバー後の最初のリクエストを失敗させない)
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_APPLICATION_NAME = os.getenv("DB_APPLICATION_NAME", "period-tracker")
+
+from . import sqlite_profile
+
+def engine_options(database_url: str) -> dict:
+    """
+    create_engine / create_async_engine に渡す引数を、データベースの種類に合わせて返します。
+    - SQLite: check_same_thread=False と性能プロファイル (sqlite_profile)
+    - PostgreSQL: プールの設定と、接続ごとのタイムゾーン (UTC)・application_name
+    """
+    if sqlite_profile.is_sqlite(database_url):
+        return sqlite_profile.engine_options(database_url)
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    url = make_url(database_url)
+    if url.get_backend_name() == "postgresql":
+        # func.now() の値をアプリが書き込む値 (UTC) と揃えるため、セッションのタイムゾーンを UTC にする
+        if url.get_driver_name() == "asyncpg":
+            options["connect_args"] = {"server_settings": {"application_name": DB_APPLICATION_NAME, "timezone": "UTC"}}
+        else:
+            options["connect_args"] = {"application_name": DB_APPLICATION_NAME, "options": "-c timezone=UTC"}
+    return options
+
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+sqlite_profile.install(engine) # SQLite の場合は接続ごとに PRAGMA を設定する
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+# ==== 非同期エンジン (async def のエンドポイント用) ====
+# 同期ドライバのURLを非同期ドライバのURLに変換する (sqlite -> aiosqlite, postgresql -> asyncpg)
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "postgresql+psycopg": "postgresql+psycopg", # psycopg 3 は同じドライバーで非同期にも対応している
+}
+
+def to_async_database_url(database_url: str) -> str:
+    url = make_url(database_url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername)).render_as_string(hide_password=False)
+
+# ASYNC_DATABASE_URL が設定されていればそれを優先する
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_database_url(DATABASE_URL)
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+sqlite_profile.install(async_engine.sync_engine)
+
+# expire_on_commit=False: commit後に属性へアクセスしても暗黙の再読み込み (同期I/O) が走らないようにする
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# コネクションプールの待ち時間と使用中の接続数を /metrics に出す
+from . import metrics
+metrics.instrument_engine(engine, "sync")
+metrics.instrument_engine(async_engine.sync_engine, "async")
+
+# リクエストごとのクエリ数・DB時間の集計と、遅いクエリ・N+1 の検出
+from . import sql_instrumentation
+sql_instrumentation.instrument_engine(engine)
+sql_instrumentation.instrument_engine(async_engine.sync_engine)
+
 Base = declarative_base()
 
+
+class UTCDateTime(TypeDecorator):
+    """
+    タイムゾーンなしの DateTime に、UTC の時刻をタイムゾーン情報を外して保存する型。
+    アプリは datetime.now(timezone.utc) (aware) を書き込みますが、asyncpg は aware な値を
+    timestamp without time zone に渡せないので、保存前に UTC の naive な値にそろえます (SQLite の保存形式は変わりません)。
+    """
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, datetime) and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+
 # ==== ORM Models ====
 class User(Base):
     __tablename__ = "users"
@@ -29,12 +126,13 @@ class User(Base):
     auth_provider = Column(String, default="local", nullable=False) # 'local' or 'google'
     google_sub = Column(String, unique=True, index=True, nullable=True) # Googleの一意なID
     name = Column(String, nullable=True)
-    created_at = Column(DateTime, default=func.now(), nullable=False)
-    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+    created_at = Column(UTCDateTime, default=func.now(), nullable=False)
+    updated_at = Column(UTCDateTime, default=func.now(), onupdate=func.now(), nullable=False)
 
     periods = relationship("Period", back_populates="owner")
     chat_messages = relationship("ChatMessage", back_populates="owner") # ChatMessageとのリレーションを追加
     password_reset_tokens = relationship("PasswordResetToken", back_populates="user") # PasswordResetTokenとのリレーションを追加
+    cycle_stats = relationship("UserCycleStats", back_populates="user", uselist=False)
 
 
 class Period(Base):
@@ -47,17 +145,54 @@ class Period(Base):
     prediction_next_start_date = Column(Date, nullable=True)
     # 次回生理の終了予測日 (フィールド名を変更)
     prediction_end_date = Column(Date, nullable=True)
-    created_at = Column(DateTime, default=func.now(), nullable=False)
-    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+    created_at = Column(UTCDateTime, default=func.now(), nullable=False)
+    updated_at = Column(UTCDateTime, default=func.now(), onupdate=func.now(), nullable=False)
 
     owner = relationship("User", back_populates="periods")
 
+    __table_args__ = (
+        # crud.get_periods (user_id で絞り込み、start_date で範囲指定・ソート)
+        Index("ix_periods_user_id_start_date", "user_id", "start_date"),
+        # アクティブな (end_date が NULL の) 生理期間のチェック用の部分インデックス
+        Index(
+            "ix_periods_user_id_active",
+            "user_id",
+            sqlite_where=text("end_date IS NULL"),
+            postgresql_where=text("end_date IS NULL"),
+        ),
+    )
+
+
+# ユーザーごとの周期統計 (完了済みの生理期間から集計した累積値)
+# 生理記録の書き込みと同じトランザクションで差分更新し、予測のたびに全履歴を走査しないようにする
+class UserCycleStats(Base):
+    __tablename__ = "user_cycle_stats"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    # 完了済み (start_date と end_date が両方ある) 生理期間の件数と、生理日数の合計
+    period_count = Column(Integer, default=0, nullable=False)
+    period_length_sum = Column(Integer, default=0, nullable=False)
+    # 完了済み生理期間の最初と最後の開始日
+    # 周期日数の合計は隣接する開始日の差の総和なので (last_start_date - first_start_date) に等しい
+    first_start_date = Column(Date, nullable=True)
+    last_start_date = Column(Date, nullable=True)
+    updated_at = Column(UTCDateTime, default=func.now(), onupdate=func.now(), nullable=False)
+
+    user = relationship("User", back_populates="cycle_stats")
+
 # ==== Database Utility Functions ====
 def init_db_connection():
-    """データベーステーブルを全て作成します。"""
-    print("Initializing database tables...")
-    Base.metadata.create_all(bind=engine)
-    print("Database tables initialized.")
+    """未適用のマイグレーションを適用し、スキーマ（テーブル・インデックス）が揃っているか確認します。"""
+    from .migrations import run_migrations, verify_schema
+
+    print("Applying database migrations...")
+    applied = run_migrations(engine)
+    print(f"Applied {len(applied)} migration(s).")
+    verify_schema(engine) # 必要なインデックスが欠けている場合は起動を失敗させる
+    print("Database schema verified.")
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as connection:
+            settings = ", ".join(f"{name}={value}" for name, value in sqlite_profile.describe(connection).items())
+        print(f"SQLite profile: {sqlite_profile.SQLITE_PROFILE} ({settings})")
 
 # get_db_session を get_db に変更
 def get_db() -> Generator: # <--- ここを変更しました
@@ -68,6 +203,11 @@ def get_db() -> Generator: # <--- ここを変更しました
     finally:
         db.close()
 
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """FastAPIの依存性注入で非同期データベースセッションを提供するジェネレーター。"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
 # ==== 新しく追加するチャットメッセージモデル ====
 
 class ChatHistory(Base):
@@ -77,7 +217,7 @@ class ChatHistory(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     mode = Column(String, nullable=False)
     messages = Column(JSON, nullable=False)  # messages配列をそのままJSONで保存
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(UTCDateTime, default=datetime.utcnow)
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
@@ -87,10 +227,17 @@ class ChatMessage(Base):
     response = Column(String, nullable=False) # AIからの回答
     mode = Column(String, nullable=False) # チャットモード（boyfriend, prince, nurse, grandma, mother）
     # timestampのデフォルト値を変更: func.now() を使用し、データベースのタイムスタンプを反映
-    timestamp = Column(DateTime, default=func.now())
+    timestamp = Column(UTCDateTime, default=func.now())
+    # ストリーミング中にクライアントが切断し、途中までの回答しか保存できなかった場合に True
+    is_partial = Column(Boolean, default=False, server_default=text("false"), nullable=False)
 
     owner = relationship("User", back_populates="chat_messages") # リレーションシップ名を修正
 
+    __table_args__ = (
+        # crud.get_chat_messages (user_id で絞り込み、timestamp 順に取得)
+        Index("ix_chat_messages_user_id_timestamp", "user_id", "timestamp", "id"),
+    )
+
 
 # パスワードリセットトークン管理用のテーブル (オプション、必要に応じて追加)
 class PasswordResetToken(Base):
@@ -98,7 +245,7 @@ class PasswordResetToken(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     token = Column(String, unique=True, index=True, nullable=False)
-    expires_at = Column(DateTime, nullable=False)
-    created_at = Column(DateTime, default=func.now(), nullable=False)
+    expires_at = Column(UTCDateTime, nullable=False)
+    created_at = Column(UTCDateTime, default=func.now(), nullable=False)
 
     user = relationship("User", back_populates="password_reset_tokens") # リレーションシップ名を修正
\ No newline at end of file
@@ -0,0 +1,53 @@
+# backend/etag.py
+# 読み取りAPIの ETag / If-None-Match (304 Not Modified)
+#
+# iOS アプリは画面を表示するたびに一覧を取り直しますが、データはほとんど変わりません。
+# ユーザーごとの「変更の目印」(最大 updated_at / timestamp と件数) だけを先に調べて弱い ETag を作り、
+# クライアントが送ってきた If-None-Match と一致すれば、本体のクエリとシリアライズを省いて 304 を返します。
+
+import hashlib
+from typing import Optional
+
+from fastapi import Request, Response, status
+
+# 毎回サーバーに確認させる (キャッシュしてよいが、使う前に必ず ETag で再検証する)
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    """変更の目印とリクエストの条件 (パスやクエリ文字列) から弱い ETag を作ります。"""
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def _opaque(tag: str) -> str:
+    # 弱い比較: W/ の有無は無視する
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """
+    If-None-Match が etag と一致するかを返します。"*" はどの ETag とも一致するので、
+    対象が存在することを確認してから呼んでください (存在しないものには 404 を返す)。
+    """
+    if_none_match: Optional[str] = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return _opaque(etag) in {_opaque(tag) for tag in if_none_match.split(",")}
+
+
+def not_modified_response(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+
+def set_etag(response: Response, etag: str) -> None:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+
+
+def request_etag(request: Request, user_id: int, watermark) -> str:
+    """同じユーザーでもパスやクエリ (フィルター・ページ) が違えば別の ETag になるようにします。"""
+    return make_etag(user_id, request.url.path, request.url.query, *watermark)
@@ -0,0 +1,288 @@
+# backend/google_id_token.py
+# Google の ID トークンを、キャッシュした公開鍵で検証する
+#
+# google.oauth2.id_token.verify_oauth2_token は呼ぶたびに Google の公開鍵をネットワークから取得し、
+# しかも同期処理なので、async def のエンドポイントから呼ぶとその間イベントループ全体が止まります。
+# ここでは公開鍵 (JWKS) を Cache-Control の max-age の間キャッシュし、期限の前にバックグラウンドで取り直します。
+# 署名の検証はキャッシュした鍵を使って、スレッドで行います。
+#
+# - 知らない kid のトークン (鍵のローテーション直後) が来たら、すぐに取り直してもう一度探す
+#   (取り直しは GOOGLE_CERTS_MIN_REFRESH_SECONDS に1回まで。でたらめな kid で Google に取りに行かせないため)
+# - 取り直しに失敗した場合は、GOOGLE_CERTS_MAX_STALE_SECONDS までは期限切れの鍵を使い続ける
+# - GOOGLE_CERTS_URL を差し替えると、ローカルの鍵で動作確認できる (backend/benchmarks/google_auth.py を参照)
+#
+# 環境変数:
+#   GOOGLE_CLIENT_ID                  トークンの aud (routers/auth.py と同じ)
+#   GOOGLE_CERTS_URL                  公開鍵 (JWKS) の URL (デフォルト: https://www.googleapis.com/oauth2/v3/certs)
+#   GOOGLE_CERTS_DEFAULT_MAX_AGE      Cache-Control に max-age がないときにキャッシュする秒数 (デフォルト 3600)
+#   GOOGLE_CERTS_REFRESH_MARGIN       期限の何秒前に取り直すか (デフォルト 300)
+#   GOOGLE_CERTS_MIN_REFRESH_SECONDS  取り直しの最小間隔 (デフォルト 60)
+#   GOOGLE_CERTS_MAX_STALE_SECONDS    取り直せないときに期限切れの鍵を使い続ける上限 (デフォルト 86400)
+#   GOOGLE_CERTS_FETCH_TIMEOUT        取得のタイムアウト秒数 (デフォルト 5)
+#   GOOGLE_ID_TOKEN_CLOCK_SKEW        exp / nbf を確認するときの時刻のずれの許容秒数 (デフォルト 0)
+
+import asyncio
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+from jose import JWTError, jwk, jwt
+
+from . import metrics
+from .app_logging import get_logger
+
+load_dotenv()
+
+GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
+GOOGLE_CERTS_URL = os.getenv("GOOGLE_CERTS_URL", "https://www.googleapis.com/oauth2/v3/certs")
+GOOGLE_CERTS_DEFAULT_MAX_AGE = float(os.getenv("GOOGLE_CERTS_DEFAULT_MAX_AGE", 3600))
+GOOGLE_CERTS_REFRESH_MARGIN = float(os.getenv("GOOGLE_CERTS_REFRESH_MARGIN", 300))
+GOOGLE_CERTS_MIN_REFRESH_SECONDS = float(os.getenv("GOOGLE_CERTS_MIN_REFRESH_SECONDS", 60))
+GOOGLE_CERTS_MAX_STALE_SECONDS = float(os.getenv("GOOGLE_CERTS_MAX_STALE_SECONDS", 86400))
+GOOGLE_CERTS_FETCH_TIMEOUT = float(os.getenv("GOOGLE_CERTS_FETCH_TIMEOUT", 5))
+GOOGLE_ID_TOKEN_CLOCK_SKEW = int(os.getenv("GOOGLE_ID_TOKEN_CLOCK_SKEW", 0))
+
+# google.oauth2.id_token と同じ発行者
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+SUPPORTED_ALGORITHMS = ("RS256",)
+
+log = get_logger("google_id_token")
+
+google_certs_fetches_total = metrics.counter("google_certs_fetches_total", "Fetches of Google's ID token signing keys.", ["outcome"])
+
+
+class InvalidGoogleToken(ValueError):
+    """トークンの形式・署名・クレームが正しくないときに送出されます (ValueError なので 401 として扱える)。"""
+
+
+class GoogleCertsUnavailable(RuntimeError):
+    """公開鍵を取得できず、使えるキャッシュもないときに送出されます。"""
+
+
+_MAX_AGE = re.compile(r"(?:^|,)\s*(?:s-maxage|max-age)\s*=\s*\"?(\d+)", re.IGNORECASE)
+
+
+def parse_max_age(cache_control: Optional[str], age: Optional[str] = None) -> Optional[float]:
+    """
+    Cache-Control の max-age から、あと何秒キャッシュしてよいかを返します (Age ヘッダーの分を引く)。
+    no-store / no-cache の場合は 0、max-age がなければ None です。
+    """
+    if not cache_control:
+        return None
+    directives = cache_control.lower()
+    if "no-store" in directives or "no-cache" in directives:
+        return 0.0
+    match = _MAX_AGE.search(cache_control)
+    if not match:
+        return None
+    try:
+        elapsed = float(age) if age else 0.0
+    except ValueError:
+        elapsed = 0.0
+    return max(0.0, float(match.group(1)) - elapsed)
+
+
+@dataclass
+class KeySet:
+    """取得した公開鍵 (kid -> 鍵) と、その有効期限 (time.monotonic の値)。"""
+    keys: Dict[str, object]
+    fetched_at: float
+    expires_at: float
+    refresh_at: float = field(init=False)
+
+    def __post_init__(self):
+        # 期限の GOOGLE_CERTS_REFRESH_MARGIN 秒前に取り直す (max-age が短い場合は半分が過ぎたら)
+        lifetime = self.expires_at - self.fetched_at
+        self.refresh_at = self.fetched_at + max(lifetime - GOOGLE_CERTS_REFRESH_MARGIN, lifetime / 2)
+
+
+def build_keys(document: dict) -> Dict[str, object]:
+    """JWKS ({"keys": [...]}) から、署名の検証に使う鍵を作ります (検証のたびに鍵を組み立て直さないため)。"""
+    keys = {}
+    for key in document.get("keys", []):
+        algorithm = key.get("alg", "RS256")
+        if key.get("kty") != "RSA" or key.get("use", "sig") != "sig" or algorithm not in SUPPORTED_ALGORITHMS or "kid" not in key:
+            continue
+        keys[key["kid"]] = jwk.construct(key, algorithm)
+    if not keys:
+        raise GoogleCertsUnavailable("The key set has no usable RSA signing keys.")
+    return keys
+
+
+class GoogleTokenVerifier:
+    def __init__(
+        self,
+        client_id: Optional[str] = GOOGLE_CLIENT_ID,
+        certs_url: str = GOOGLE_CERTS_URL,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """transport に httpx.MockTransport などを渡すと、ネットワークに出ずにローカルの鍵を返せます。"""
+        self.client_id = client_id
+        self.certs_url = certs_url
+        self._transport = transport
+        self._clock = clock
+        self._key_set: Optional[KeySet] = None
+        self._failed_at: Optional[float] = None # 最後に取得に失敗した時刻
+        # ロックとタスクはイベントループに紐づくため、最初に使うときに作る
+        self._lock: Optional[asyncio.Lock] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    # ==== 公開鍵の取得 ====
+
+    async def _fetch(self) -> KeySet:
+        # 取得は数時間に1回なので、接続は使い回さない (イベントループをまたいでも動くように)
+        async with httpx.AsyncClient(transport=self._transport, timeout=GOOGLE_CERTS_FETCH_TIMEOUT) as client:
+            response = await client.get(self.certs_url)
+            response.raise_for_status()
+        keys = build_keys(response.json())
+        max_age = parse_max_age(response.headers.get("cache-control"), response.headers.get("age"))
+        if max_age is None:
+            max_age = GOOGLE_CERTS_DEFAULT_MAX_AGE
+        now = self._clock()
+        log.info("google_certs.refreshed", keys=len(keys), max_age=max_age)
+        return KeySet(keys=keys, fetched_at=now, expires_at=now + max_age)
+
+    def _get_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def refresh(self, seen: Optional[KeySet] = None) -> KeySet:
+        """
+        公開鍵を取り直します。同時に呼ばれても取得は1回だけで、待っていた側は取得した結果を使います。
+        seen には呼び出し側が持っていた KeySet を渡します (それ以降に取り直されていれば、もう一度は取りに行かない)。
+        """
+        async with self._get_lock():
+            current = self._key_set
+            if current is not None and current is not seen:
+                return current
+            try:
+                self._key_set = await self._fetch()
+            except Exception as e:
+                google_certs_fetches_total.inc(outcome="error")
+                self._failed_at = self._clock()
+                if current is not None and self._clock() < current.expires_at + GOOGLE_CERTS_MAX_STALE_SECONDS:
+                    log.warning("google_certs.refresh_failed", error=str(e), using_stale=True)
+                    return current
+                raise GoogleCertsUnavailable(f"Could not fetch Google signing keys: {e}") from e
+            google_certs_fetches_total.inc(outcome="success")
+            self._failed_at = None
+            return self._key_set
+
+    async def get_key_set(self) -> KeySet:
+        """キャッシュした公開鍵を返します。期限が切れていれば (バックグラウンドの取り直しが間に合わなかった場合) 取り直します。"""
+        self.start()
+        key_set = self._key_set
+        now = self._clock()
+        if key_set is None or now >= key_set.expires_at:
+            if (
+                key_set is not None and self._failed_at is not None
+                and now - self._failed_at < GOOGLE_CERTS_MIN_REFRESH_SECONDS
+                and now < key_set.expires_at + GOOGLE_CERTS_MAX_STALE_SECONDS
+            ):
+                return key_set # 取得に失敗した直後なので、ログインのたびには取りに行かない
+            key_set = await self.refresh(key_set)
+        return key_set
+
+    # ==== バックグラウンドでの取り直し ====
+
+    def start(self) -> None:
+        """実行中のイベントループで、期限の前に公開鍵を取り直すタスクを起動します (起動済みなら何もしない)。"""
+        loop = asyncio.get_running_loop()
+        task = self._refresh_task
+        if task is not None and not task.done() and task.get_loop() is loop:
+            return
+        if self._lock is not None and task is not None and task.get_loop() is not loop:
+            self._lock = None # 別のイベントループ (テストなど) で作ったロックは使えない
+        self._refresh_task = loop.create_task(self._refresh_loop(), name="google-certs-refresh")
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            key_set = self._key_set
+            if key_set is not None:
+                await asyncio.sleep(max(key_set.refresh_at - self._clock(), 0))
+            try:
+                await self.refresh(key_set)
+            except Exception as e:
+                log.warning("google_certs.background_refresh_failed", error=str(e))
+            if self._key_set is key_set:
+                # 取り直せなかった (または期限切れの鍵を使い続けている) ので、間隔を空けて再試行する
+                await asyncio.sleep(GOOGLE_CERTS_MIN_REFRESH_SECONDS)
+
+    async def aclose(self) -> None:
+        task, self._refresh_task = self._refresh_task, None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    # ==== トークンの検証 ====
+
+    def _decode(self, token: str, key) -> dict:
+        """署名・有効期限・aud・iss を確認してクレームを返します (スレッドで呼ばれる)。"""
+        options = {
+            "leeway": GOOGLE_ID_TOKEN_CLOCK_SKEW,
+            "verify_aud": self.client_id is not None,
+            "verify_at_hash": False, # アクセストークンは受け取らないので at_hash は確認できない
+        }
+        try:
+            claims = jwt.decode(token, key, algorithms=list(SUPPORTED_ALGORITHMS), audience=self.client_id, options=options)
+        except JWTError as e:
+            raise InvalidGoogleToken(str(e)) from e
+        if claims.get("iss") not in GOOGLE_ISSUERS:
+            raise InvalidGoogleToken(f"Wrong issuer: {claims.get('iss')}")
+        return claims
+
+    async def verify(self, token: str) -> dict:
+        """
+        ID トークンを検証してクレームを返します。
+        正しくないトークンでは InvalidGoogleToken、公開鍵が取得できない場合は GoogleCertsUnavailable を送出します。
+        """
+        try:
+            header = jwt.get_unverified_header(token)
+        except JWTError as e:
+            raise InvalidGoogleToken(str(e)) from e
+        if header.get("alg") not in SUPPORTED_ALGORITHMS:
+            raise InvalidGoogleToken(f"Unsupported signature algorithm: {header.get('alg')}")
+        kid = header.get("kid")
+
+        key_set = await self.get_key_set()
+        key = key_set.keys.get(kid)
+        if key is None and self._clock() - key_set.fetched_at >= GOOGLE_CERTS_MIN_REFRESH_SECONDS:
+            # 鍵がローテーションされた直後の可能性があるので、取り直してもう一度探す
+            key_set = await self.refresh(key_set)
+            key = key_set.keys.get(kid)
+        if key is None:
+            raise InvalidGoogleToken(f"Unknown key id: {kid}")
+        return await asyncio.to_thread(self._decode, token, key)
+
+
+_verifier: Optional[GoogleTokenVerifier] = None
+
+
+def get_google_verifier() -> GoogleTokenVerifier:
+    """プロセス全体で共有する検証器を返します。"""
+    global _verifier
+    if _verifier is None:
+        _verifier = GoogleTokenVerifier()
+    return _verifier
+
+
+def start_google_certs_refresh() -> None:
+    """起動時に公開鍵を先に取得しておく (最初のログインで取得を待たせない)。GOOGLE_CLIENT_ID がなければ何もしません。"""
+    if GOOGLE_CLIENT_ID:
+        get_google_verifier().start()
+
+
+async def close_google_verifier() -> None:
+    global _verifier
+    if _verifier is not None:
+        await _verifier.aclose()
+        _verifier = None
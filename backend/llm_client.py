@@ -0,0 +1,214 @@
+# backend/llm_client.py
+# チャット用の非同期LLMクライアント
+#
+# - AsyncOpenAI + httpx のコネクションプール (keep-alive) を1つ使い回す
+# - 呼び出しごとのタイムアウト
+# - ジッター付き指数バックオフでのリトライ (ストリーミングは最初のトークンを返す前まで)
+# - 全体とユーザーごとの同時実行数の上限 (セマフォ)
+#
+# 環境変数:
+#   OPENAI_API_KEY / OPENAI_BASE_URL   OPENAI_BASE_URL を指定するとローカルのフェイクサーバーなどに向けられる
+#   LLM_MODEL                          使用するモデル (デフォルト gpt-4o)
+#   LLM_TIMEOUT_SECONDS                1回の呼び出しのタイムアウト (デフォルト 60秒)
+#   LLM_CONNECT_TIMEOUT_SECONDS        接続タイムアウト (デフォルト 5秒)
+#   LLM_MAX_RETRIES                    リトライ回数 (デフォルト 2)
+#   LLM_RETRY_BASE_DELAY_SECONDS       バックオフの基準時間 (デフォルト 0.5秒)
+#   LLM_MAX_CONNECTIONS                コネクションプールの最大接続数 (デフォルト 100)
+#   LLM_MAX_KEEPALIVE_CONNECTIONS      keep-alive で保持する接続数 (デフォルト 20)
+#   LLM_MAX_CONCURRENCY                全体の同時実行数の上限 (デフォルト 32)
+#   LLM_MAX_CONCURRENCY_PER_USER       ユーザーごとの同時実行数の上限 (デフォルト 2)
+#   LLM_QUEUE_TIMEOUT_SECONDS          同時実行枠の空き待ちの上限 (デフォルト 30秒)
+
+import asyncio
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
+import openai
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+from . import metrics
+
+# .envからAPIキーを読み込む
+load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", 60))
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", 5))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+LLM_RETRY_BASE_DELAY_SECONDS = float(os.getenv("LLM_RETRY_BASE_DELAY_SECONDS", 0.5))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 100))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", 20))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 32))
+LLM_MAX_CONCURRENCY_PER_USER = int(os.getenv("LLM_MAX_CONCURRENCY_PER_USER", 2))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", 30))
+
+# 一時的な障害とみなしてリトライする例外
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError, # APITimeoutError を含む
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+class LLMError(RuntimeError):
+    """LLMの呼び出しに失敗したときに送出されます。"""
+
+
+class LLMBusyError(LLMError):
+    """同時実行枠の空き待ちがタイムアウトしたときに送出されます。"""
+
+
+class LLMClient:
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        model: str = LLM_MODEL,
+        timeout: float = LLM_TIMEOUT_SECONDS,
+        max_retries: int = LLM_MAX_RETRIES,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_concurrency_per_user: int = LLM_MAX_CONCURRENCY_PER_USER,
+    ):
+        self.model = model
+        self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        self.max_concurrency_per_user = max_concurrency_per_user
+        self._http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(timeout, connect=LLM_CONNECT_TIMEOUT_SECONDS),
+        )
+        # リトライはこのクラスで行うので、SDK側のリトライは無効にする
+        self._client = AsyncOpenAI(
+            api_key=api_key or os.getenv("OPENAI_API_KEY"),
+            base_url=base_url or os.getenv("OPENAI_BASE_URL") or None,
+            max_retries=0,
+            http_client=self._http_client,
+        )
+        # セマフォはイベントループに紐づくため、最初に使うときに作る
+        self._global_semaphore: Optional[asyncio.Semaphore] = None
+        self._user_semaphores: Dict[int, asyncio.Semaphore] = {}
+        self._user_waiters: Dict[int, int] = {}
+
+    async def aclose(self) -> None:
+        await self._client.close()
+
+    # ==== 同時実行数の制御 ====
+
+    @asynccontextmanager
+    async def _slot(self, user_id: Optional[int]):
+        """全体とユーザーごとの同時実行枠を1つずつ確保します。"""
+        if self._global_semaphore is None:
+            self._global_semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        user_semaphore = None
+        if user_id is not None:
+            user_semaphore = self._user_semaphores.setdefault(user_id, asyncio.Semaphore(self.max_concurrency_per_user))
+            self._user_waiters[user_id] = self._user_waiters.get(user_id, 0) + 1
+
+        acquired = []
+        try:
+            try:
+                async with asyncio.timeout(LLM_QUEUE_TIMEOUT_SECONDS):
+                    for semaphore in (user_semaphore, self._global_semaphore):
+                        if semaphore is not None:
+                            await semaphore.acquire()
+                            acquired.append(semaphore)
+            except TimeoutError:
+                raise LLMBusyError("Too many concurrent AI requests.")
+            yield
+        finally:
+            for semaphore in acquired:
+                semaphore.release()
+            if user_id is not None:
+                # 使われなくなったユーザーのセマフォは破棄してメモリを増やさない
+                self._user_waiters[user_id] -= 1
+                if self._user_waiters[user_id] == 0:
+                    del self._user_waiters[user_id]
+                    del self._user_semaphores[user_id]
+
+    # ==== リトライ ====
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """フルジッター付きの指数バックオフ。"""
+        return random.uniform(0, LLM_RETRY_BASE_DELAY_SECONDS * (2 ** attempt))
+
+    # ==== API ====
+
+    async def complete(self, messages: list[dict], user_id: Optional[int] = None) -> str:
+        """回答全文を返します。"""
+        async with self._slot(user_id):
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                for attempt in range(self.max_retries + 1):
+                    try:
+                        res = await self._client.chat.completions.create(model=self.model, messages=messages)
+                        outcome = "ok"
+                        return res.choices[0].message.content
+                    except RETRYABLE_ERRORS as e:
+                        if attempt >= self.max_retries:
+                            raise LLMError(f"LLM request failed after {attempt + 1} attempts: {e}") from e
+                        await asyncio.sleep(self._backoff_delay(attempt))
+                    except openai.OpenAIError as e:
+                        raise LLMError(f"LLM request failed: {e}") from e
+            finally:
+                # 同時実行枠の待ち時間は含めず、リトライを含めた呼び出し全体の時間
+                metrics.llm_request_duration_seconds.observe(time.perf_counter() - started, kind="complete", outcome=outcome)
+
+    async def stream(self, messages: list[dict], user_id: Optional[int] = None) -> AsyncIterator[str]:
+        """回答をトークン（差分テキスト）ごとに返します。最初のトークンを返す前のエラーのみリトライします。"""
+        async with self._slot(user_id):
+            requested = time.perf_counter()
+            outcome = "error"
+            try:
+                for attempt in range(self.max_retries + 1):
+                    started = False
+                    try:
+                        stream = await self._client.chat.completions.create(model=self.model, messages=messages, stream=True)
+                        try:
+                            async for chunk in stream:
+                                if chunk.choices and chunk.choices[0].delta.content:
+                                    if not started:
+                                        metrics.llm_time_to_first_token_seconds.observe(time.perf_counter() - requested)
+                                    started = True
+                                    yield chunk.choices[0].delta.content
+                        finally:
+                            await stream.close()
+                        outcome = "ok"
+                        return
+                    except RETRYABLE_ERRORS as e:
+                        if started or attempt >= self.max_retries:
+                            raise LLMError(f"LLM stream failed after {attempt + 1} attempts: {e}") from e
+                        await asyncio.sleep(self._backoff_delay(attempt))
+                    except openai.OpenAIError as e:
+                        raise LLMError(f"LLM stream failed: {e}") from e
+            finally:
+                # 途中で切断された (aclose された) ストリームは error として数える
+                metrics.llm_request_duration_seconds.observe(time.perf_counter() - requested, kind="stream", outcome=outcome)
+
+
+_llm_client: Optional[LLMClient] = None
+
+
+def get_llm_client() -> LLMClient:
+    """プロセス全体で共有するLLMクライアントを返します。"""
+    global _llm_client
+    if _llm_client is None:
+        _llm_client = LLMClient()
+    return _llm_client
+
+
+async def close_llm_client() -> None:
+    global _llm_client
+    if _llm_client is not None:
+        await _llm_client.aclose()
+        _llm_client = None
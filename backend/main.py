@@ -2,28 +2,41 @@
 
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from .database import init_db_connection
+from .database import init_db_connection, async_engine
+from .password_hashing import PasswordHashingOverloaded, shutdown_executor
+from .llm_client import close_llm_client
+from .google_id_token import close_google_verifier, start_google_certs_refresh
+from .pagination import NEXT_CURSOR_HEADER
+from . import metrics, sql_instrumentation
+from .app_logging import get_logger
 # chatルーターをインポートリストに追加
-from .routers import auth, periods, chat
+from .routers import auth, periods, chat, export
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 from fastapi import Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi import status
 
+log = get_logger("app")
+
 # lifespanコンテキストマネージャーを定義 ->アプリの起動時や終了時に処理を挟みたい時に使う
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
     アプリケーションのライフサイクルイベント（起動時とシャットダウン時）を処理します。
     """
-    print("Application startup...")
+    log.info("app.startup")
     # データベース接続の初期化をここで行います
     init_db_connection() # データベーステーブルの作成など
-    print("Database connection initialized.")
+    log.info("app.database_initialized")
+    start_google_certs_refresh() # Google の公開鍵を先に取得しておき、期限の前に取り直す
     yield # アプリケーションがリクエストを受け付ける準備ができたことを示します
     # アプリケーションシャットダウン時のクリーンアップ処理があればここに記述
-    print("Application shutdown.")
+    await async_engine.dispose() # 非同期エンジンのコネクションプールを閉じる
+    shutdown_executor() # パスワードハッシュ用のワーカープールを停止
+    await close_llm_client() # LLMクライアントのコネクションプールを閉じる
+    await close_google_verifier() # Google の公開鍵の取り直しを止める
+    log.info("app.shutdown")
 
 # FastAPIアプリケーションのインスタンスを作成します。
 app = FastAPI(
@@ -47,16 +60,31 @@ app.add_middleware(
     allow_credentials=True,# フロントが認証情報を送ってくるのを許可する
     allow_methods=["*"], # 全てのHTTPメソッドを許可
     allow_headers=["*"], # 全てのヘッダーを許可
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", sql_instrumentation.QUERY_COUNT_HEADER, sql_instrumentation.QUERY_TIME_HEADER], # ページングのカーソルと ETag をブラウザからも読めるようにする
 )
 
+# リクエストごとの SQL の件数・DB時間を集計する (SQL_DEBUG_HEADERS=true でレスポンスヘッダーに付ける)
+app.add_middleware(sql_instrumentation.QueryStatsMiddleware)
+
+# ルートごとのリクエスト数・レイテンシを集計する (最後に追加したミドルウェアが一番外側になるので、全体の時間を計測できる)
+app.add_middleware(metrics.MetricsMiddleware)
+
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
-    print(f"request: {await request.body()}")
-    print(f"[VALIDATION-ERROR] リクエスト形式エラー: path={request.url.path}, method={request.method}")
-    print(f"[VALIDATION-ERROR] エラー詳細: {exc.errors()}")
+    # リクエスト本文は読み直さない。エラー詳細の input (送られてきた値) は LOG_REDACT=false のときだけ出る
+    log.warning("request.validation_error", path=request.url.path, method=request.method, errors=exc.errors())
     return JSONResponse(content={"detail": "Validation error"}, status_code=status.HTTP_422_UNPROCESSABLE_ENTITY)
 
+# パスワードハッシュの待ち行列があふれた場合は、しばらく待って再試行してもらう
+@app.exception_handler(PasswordHashingOverloaded)
+async def password_hashing_overloaded_handler(request: Request, exc: PasswordHashingOverloaded):
+    return JSONResponse(
+        content={"detail": "Server is busy. Please retry later."},
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": "1"},
+    )
+
 # アプリケーションのルートエンドポイント
 # このルートは、上記の `app = FastAPI(...)` インスタンスに直接関連付けられます。
 @app.get("/")
@@ -65,7 +93,16 @@ async def read_root():
     return {"message": "Welcome to the Period Tracker API!"}
 
 
+# Prometheus 形式のメトリクス (METRICS_TOKEN を設定した場合は Bearer トークンが必要)
+@app.get("/metrics", include_in_schema=False)
+async def read_metrics(request: Request):
+    if not metrics.is_authorized(request.headers.get("authorization")):
+        return JSONResponse(content={"detail": "Not authenticated"}, status_code=status.HTTP_401_UNAUTHORIZED)
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 # 別ファイルで定義されたAPIエンドポイントをmain.pyに統合する
 app.include_router(auth.router)
 app.include_router(periods.router)
 app.include_router(chat.router) # 新しく追加するチャットルーター
+app.include_router(export.router)
@@ -0,0 +1,137 @@
+# backend/manage.py
+# 運用・保守用のコマンドラインツール
+# 使い方: python -m backend.manage <command>
+
+import argparse
+from datetime import date
+
+from .database import SessionLocal, engine
+from . import crud
+from .migrations import LATEST_VERSION, run_migrations, verify_schema
+
+
+def rebuild_stats(args: argparse.Namespace) -> None:
+    """periodsテーブルから周期統計 (user_cycle_stats) を作り直します。"""
+    db = SessionLocal()
+    try:
+        if args.user_id is not None:
+            crud.rebuild_user_cycle_stats(db, args.user_id)
+            db.commit()
+            print(f"Rebuilt cycle stats for user {args.user_id}.")
+        else:
+            count = crud.rebuild_all_cycle_stats(db)
+            print(f"Rebuilt cycle stats for {count} users.")
+    finally:
+        db.close()
+
+
+def migrate(args: argparse.Namespace) -> None:
+    """未適用のスキーママイグレーションを適用します。"""
+    applied = run_migrations(engine, target_version=args.to)
+    print(f"Applied {len(applied)} migration(s).")
+
+
+def check_schema(args: argparse.Namespace) -> None:
+    """スキーマが最新で必要なインデックスが揃っているか確認します（不足時は RuntimeError）。"""
+    verify_schema(engine)
+    print("Database schema is up to date.")
+
+
+def recompute_predictions(args: argparse.Namespace) -> None:
+    """全ての生理記録の予測日を、現在の予測エンジンで再計算します。"""
+    from .prediction_engines import get_prediction_engine, make_prediction_engine
+    from .prediction_jobs import recompute_predictions as run_job # NumPy が必要なのはこのコマンドだけ
+
+    result = run_job(
+        engine,
+        chunk_size=args.chunk_size,
+        batch_size=args.batch_size,
+        dry_run=args.dry_run,
+        diff_limit=args.diff_limit,
+        predictor=make_prediction_engine(args.engine) if args.engine else get_prediction_engine(),
+    )
+    if args.dry_run:
+        for change in result.samples:
+            print(
+                f"period {change.period_id} (user {change.user_id}): "
+                f"prediction_end_date {change.old_end} -> {change.new_end}, "
+                f"prediction_next_start_date {change.old_next} -> {change.new_next}"
+            )
+        if result.changed > len(result.samples):
+            print(f"... and {result.changed - len(result.samples)} more")
+    action = "would change" if args.dry_run else "updated"
+    print(
+        f"Scanned {result.rows} periods for {result.users} users in {result.seconds:.2f}s "
+        f"({result.rows_per_second:,.0f} rows/s); {action} {result.changed} periods."
+    )
+
+
+def populate(args: argparse.Namespace) -> None:
+    """負荷試験用の合成データ (ユーザー・生理記録・チャット履歴) を投入します。"""
+    from .synthetic_population import PopulationConfig, populate as run_populate
+
+    config = PopulationConfig(
+        users=args.users,
+        seed=args.seed,
+        cycles_mean=args.cycles_mean,
+        cycle_length_mean=args.cycle_length_mean,
+        cycle_sd_min=args.cycle_sd_min,
+        cycle_sd_max=args.cycle_sd_max,
+        period_length_mean=args.period_length_mean,
+        period_length_sd=args.period_length_sd,
+        ongoing_rate=args.ongoing_rate,
+        chat_messages_mean=args.chat_messages_mean,
+        email_prefix=args.email_prefix,
+        today=date.fromisoformat(args.today) if args.today else None,
+    )
+    result = run_populate(engine, config)
+    print(
+        f"Inserted {result.users} users, {result.periods} periods and {result.chat_messages} chat messages "
+        f"in {result.seconds:.2f}s ({result.rows_per_second:,.0f} rows/s)."
+    )
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m backend.manage", description="Period Tracker API management commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rebuild_parser = subparsers.add_parser("rebuild-stats", help="periodsから周期統計を再構築する")
+    rebuild_parser.add_argument("--user-id", type=int, default=None, help="対象ユーザーID (省略時は全ユーザー)")
+    rebuild_parser.set_defaults(func=rebuild_stats)
+
+    migrate_parser = subparsers.add_parser("migrate", help="未適用のスキーママイグレーションを適用する")
+    migrate_parser.add_argument("--to", type=int, default=LATEST_VERSION, help="適用するバージョンの上限")
+    migrate_parser.set_defaults(func=migrate)
+
+    check_parser = subparsers.add_parser("check-schema", help="スキーマとインデックスが揃っているか確認する")
+    check_parser.set_defaults(func=check_schema)
+
+    recompute_parser = subparsers.add_parser("recompute-predictions", help="全ての生理記録の予測日を再計算する")
+    recompute_parser.add_argument("--dry-run", action="store_true", help="書き込まずに変わる行の差分だけ表示する")
+    recompute_parser.add_argument("--chunk-size", type=int, default=50000, help="一度に読み出す行数")
+    recompute_parser.add_argument("--batch-size", type=int, default=1000, help="1トランザクションで更新する行数")
+    recompute_parser.add_argument("--diff-limit", type=int, default=20, help="dry-run で表示する差分の最大件数")
+    recompute_parser.add_argument("--engine", default=None, help="使う予測エンジン (省略時は PREDICTION_ENGINE)")
+    recompute_parser.set_defaults(func=recompute_predictions)
+
+    populate_parser = subparsers.add_parser("populate", help="負荷試験用の合成データを投入する")
+    populate_parser.add_argument("--users", type=int, default=1000, help="作成するユーザー数")
+    populate_parser.add_argument("--seed", type=int, default=0, help="乱数のシード (同じシードなら同じデータ)")
+    populate_parser.add_argument("--cycles-mean", type=float, default=24, help="ユーザーあたりの生理記録の件数の平均")
+    populate_parser.add_argument("--cycle-length-mean", type=float, default=29.0, help="平均周期 (日)")
+    populate_parser.add_argument("--cycle-sd-min", type=float, default=1.0, help="ユーザーごとの周期の標準偏差の下限 (日)")
+    populate_parser.add_argument("--cycle-sd-max", type=float, default=5.0, help="ユーザーごとの周期の標準偏差の上限 (日)")
+    populate_parser.add_argument("--period-length-mean", type=float, default=5.0, help="平均生理期間 (日)")
+    populate_parser.add_argument("--period-length-sd", type=float, default=1.0, help="生理期間の標準偏差 (日)")
+    populate_parser.add_argument("--ongoing-rate", type=float, default=0.15, help="最新の生理が進行中のユーザーの割合")
+    populate_parser.add_argument("--chat-messages-mean", type=float, default=30, help="ユーザーあたりのチャット履歴の件数の平均")
+    populate_parser.add_argument("--email-prefix", default="synthetic", help="作成するユーザーのメールアドレスの接頭辞")
+    populate_parser.add_argument("--today", default=None, help="履歴の最終日 (YYYY-MM-DD、省略時は今日)。固定すると実行日によらず同じデータになる")
+    populate_parser.set_defaults(func=populate)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
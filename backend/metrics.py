@@ -0,0 +1,304 @@
+# backend/metrics.py
+# Prometheus 形式のメトリクス (GET /metrics)
+#
+# 別のメトリクスサーバーを立てずに、アプリ自身が /metrics でテキスト形式 (text/plain; version=0.0.4) を返します。
+# 値はプロセス内のカウンター・ゲージ・ヒストグラムに貯め、スクレイプ時にまとめて出力します。
+#   - HTTP: ルート (パスのテンプレート)・メソッド・ステータスごとのリクエスト数とレイテンシ、処理中のリクエスト数 (MetricsMiddleware)
+#   - bcrypt: ハッシュ化・検証の所要時間 (password_hashing)
+#   - LLM: 呼び出しのレイテンシと最初のトークンまでの時間 (llm_client)、ChatMode ごとのトークン数 (routers/chat)
+#   - DB: コネクションプールからの取り出しの待ち時間と使用中の接続数 (instrument_engine)
+#   - スクレイプ時に読むもの: password_hashing.get_stats()、response_cache.get_stats() など (register_collector)
+# 複数ワーカーで動かす場合、値はワーカーごとです (Prometheus 側で合算してください)。
+#
+# 環境変数:
+#   METRICS_TOKEN   設定すると /metrics に Authorization: Bearer <METRICS_TOKEN> が必要になる
+
+import bisect
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# レイテンシ用のバケット (秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# LLM は数秒〜数十秒かかる
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+# プールの待ち時間は通常ほぼ 0
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    @abstractmethod
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        """(サフィックス, ラベル, 値) を返します。"""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{self.name}{suffix}{labels} {_format_value(value)}" for suffix, labels, value in self.samples())
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield "", _format_labels(self.label_names, key), value
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield "", _format_labels(self.label_names, key), value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # ラベルごとに [バケットごとの件数 (累積ではない)..., +Inf の件数], 合計
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[index] += 1
+            self._sums[key] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), self._sums[key]) for key, counts in self._counts.items()]
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield "_bucket", _format_labels(self.label_names, key, f'le="{_format_value(bound)}"'), cumulative
+            yield "_sum", _format_labels(self.label_names, key), total
+            yield "_count", _format_labels(self.label_names, key), cumulative
+
+
+# ==== レジストリ ====
+
+_metrics: List[_Metric] = []
+# スクレイプ時に呼ばれ、(名前, 種類, 説明, [(ラベル dict, 値), ...]) を返す関数
+Collector = Callable[[], Iterable[Tuple[str, str, str, Iterable[Tuple[dict, float]]]]]
+_collectors: List[Collector] = []
+
+
+def _register(metric: _Metric) -> _Metric:
+    _metrics.append(metric)
+    return metric
+
+
+def counter(name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+    return _register(Counter(name, documentation, labels))
+
+
+def gauge(name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+    return _register(Gauge(name, documentation, labels))
+
+
+def histogram(name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    return _register(Histogram(name, documentation, labels, buckets))
+
+
+def register_collector(collector: Collector) -> None:
+    _collectors.append(collector)
+
+
+def render() -> str:
+    """全メトリクスを Prometheus のテキスト形式で返します。"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    # 同じ名前のメトリクスを複数のコレクターが返す場合 (エンジンごとのプールなど) は1つにまとめる
+    collected: Dict[str, Tuple[str, str, list]] = {}
+    for collector in _collectors:
+        for name, metric_type, documentation, samples in collector():
+            collected.setdefault(name, (metric_type, documentation, []))[2].extend(samples)
+    for name, (metric_type, documentation, samples) in collected.items():
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# ==== アプリのメトリクス ====
+
+http_requests_total = counter("http_requests_total", "HTTP requests by route, method and status.", ["method", "route", "status"])
+http_request_duration_seconds = histogram("http_request_duration_seconds", "HTTP request latency (until the response body is sent).", ["method", "route"])
+http_requests_in_progress = gauge("http_requests_in_progress", "HTTP requests currently being handled.", ["method"])
+
+password_hash_duration_seconds = histogram(
+    "password_hash_duration_seconds", "bcrypt hash/verify time including the wait for a worker.", ["operation"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+llm_request_duration_seconds = histogram("llm_request_duration_seconds", "LLM call latency.", ["kind", "outcome"], buckets=LLM_BUCKETS)
+llm_time_to_first_token_seconds = histogram("llm_time_to_first_token_seconds", "Time until the first streamed token.", buckets=LLM_BUCKETS)
+llm_tokens_total = counter("llm_tokens_total", "Tokens sent to / received from the LLM by chat mode.", ["mode", "direction"])
+
+db_pool_checkout_wait_seconds = histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled DB connection.", ["engine"], buckets=POOL_WAIT_BUCKETS)
+
+
+# ==== HTTP ミドルウェア ====
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class MetricsMiddleware:
+    """
+    ASGI ミドルウェア。ルートのテンプレート (例: /periods/{period_id}) ごとに集計するので、
+    ラベルの種類が ID の数だけ増えることはありません。どのルートにも一致しないリクエストは <unmatched> にまとめます。
+    StreamingResponse は本文を送り終わるまでを計測します。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_progress.inc(method=method)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_progress.dec(method=method)
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or UNMATCHED_ROUTE
+            http_request_duration_seconds.observe(time.perf_counter() - started, method=method, route=route_path)
+            http_requests_total.inc(method=method, route=route_path, status=status_code)
+
+
+def is_authorized(authorization: Optional[str]) -> bool:
+    if not METRICS_TOKEN:
+        return True
+    return authorization == f"Bearer {METRICS_TOKEN}"
+
+
+# ==== DB コネクションプール ====
+
+def _instrument_pool(pool, engine_name: str) -> None:
+    """プールの取り出し (_do_get) の時間を計測します。空きがなければここで待つので、待ち時間がそのまま分かります。"""
+    do_get = pool._do_get
+
+    def timed_do_get():
+        started = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            db_pool_checkout_wait_seconds.observe(time.perf_counter() - started, engine=engine_name)
+
+    pool._do_get = timed_do_get
+
+
+def instrument_engine(engine, engine_name: str) -> None:
+    """
+    同期エンジン (AsyncEngine の場合は .sync_engine) のプールを計測対象にします。
+    Engine.dispose() でプールが作り直されたときも計測を続けます。
+    """
+    from sqlalchemy import event
+
+    _instrument_pool(engine.pool, engine_name)
+    event.listen(engine, "engine_disposed", lambda disposed: _instrument_pool(disposed.pool, engine_name))
+
+    def collect():
+        pool = engine.pool
+        samples = []
+        if hasattr(pool, "checkedout"):
+            samples.append(("db_pool_checked_out", "gauge", "DB connections currently checked out.", [({"engine": engine_name}, pool.checkedout())]))
+        if hasattr(pool, "size"):
+            samples.append(("db_pool_size", "gauge", "Configured DB pool size.", [({"engine": engine_name}, pool.size())]))
+        return samples
+
+    register_collector(collect)
@@ -0,0 +1,299 @@
+# backend/migrations.py
+# バージョン管理されたスキーママイグレーション
+#
+# 適用済みのバージョンは schema_migrations テーブルに記録され、起動時 (init_db_connection) や
+# `python -m backend.manage migrate` で未適用のものだけが順番に適用されます。
+# 新しいマイグレーションは MIGRATIONS の末尾に追加してください（既存のものは書き換えない）。
+# マイグレーションの中ではORMモデルを参照せず、その時点のスキーマ定義を書き写して使います。
+
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, List, NamedTuple, Tuple
+
+from sqlalchemy import JSON, Boolean, Column, Date, DateTime, ForeignKey, Index, Integer, MetaData, String, Table, inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+migration_metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    migration_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+def _create_tables(metadata: MetaData, *table_names: str) -> Callable[[Connection], None]:
+    """固定したテーブル定義から、テーブルを（存在しなければ）インデックスごと作成するマイグレーションを返します。"""
+    def upgrade(conn: Connection) -> None:
+        metadata.create_all(bind=conn, tables=[metadata.tables[name] for name in table_names], checkfirst=True)
+    return upgrade
+
+
+def _create_indexes(*indexes: Index) -> Callable[[Connection], None]:
+    """固定したインデックス定義から、インデックスを（存在しなければ）作成するマイグレーションを返します。"""
+    def upgrade(conn: Connection) -> None:
+        for index in indexes:
+            index.create(bind=conn, checkfirst=True)
+    return upgrade
+
+
+def _add_columns(table_name: str, *columns: Column) -> Callable[[Connection], None]:
+    """固定したカラム定義から、カラムを（存在しなければ）ALTER TABLE で追加するマイグレーションを返します。"""
+    def upgrade(conn: Connection) -> None:
+        existing = {column["name"] for column in inspect(conn).get_columns(table_name)}
+        for column in columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            ddl = f"ALTER TABLE {table_name} ADD COLUMN {column.name} {column_type}"
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg.text}"
+            if not column.nullable:
+                ddl += " NOT NULL"
+            conn.execute(text(ddl))
+    return upgrade
+
+
+def _normalize_sqlite_datetimes(*columns: Tuple[str, str]) -> Callable[[Connection], None]:
+    """
+    SQLite では func.now() (CURRENT_TIMESTAMP) で入った値は秒までの文字列、アプリから入れた値はマイクロ秒付きの文字列になり、
+    文字列として比較すると同じ時刻でも一致しません。カーソルページングで (timestamp, id) を比較できるように形式を揃えます。
+    columns は (テーブル名, カラム名) のタプルです。
+    """
+    def upgrade(conn: Connection) -> None:
+        if conn.dialect.name != "sqlite":
+            return
+        for table_name, name in columns:
+            conn.execute(text(f"UPDATE {table_name} SET {name} = {name} || '.000000' WHERE length({name}) = 19"))
+    return upgrade
+
+
+# ==== マイグレーションごとに固定したスキーマ定義 ====
+# database.py のORMモデルは今後も変わるので、マイグレーションの中では使いません。
+# 各マイグレーションが作るテーブル・インデックス・カラムは、書いた時点の定義をここに書き写して固定します。
+# (ORMモデルを変更するときは、ここを書き換えずに新しいマイグレーションを追加する)
+
+# 1: initial schema
+v1_metadata = MetaData()
+
+Table(
+    "users",
+    v1_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("email", String, unique=True, index=True, nullable=False),
+    Column("hashed_password", String, nullable=True),
+    Column("auth_provider", String, nullable=False),
+    Column("google_sub", String, unique=True, index=True, nullable=True),
+    Column("name", String, nullable=True),
+    Column("created_at", DateTime, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+)
+
+Table(
+    "periods",
+    v1_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("start_date", Date, nullable=False),
+    Column("end_date", Date, nullable=True),
+    Column("prediction_next_start_date", Date, nullable=True),
+    Column("prediction_end_date", Date, nullable=True),
+    Column("created_at", DateTime, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+)
+
+Table(
+    "chat_histories",
+    v1_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("mode", String, nullable=False),
+    Column("messages", JSON, nullable=False),
+    Column("created_at", DateTime),
+)
+
+Table(
+    "chat_messages",
+    v1_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id")),
+    Column("query", String, nullable=False),
+    Column("response", String, nullable=False),
+    Column("mode", String, nullable=False),
+    Column("timestamp", DateTime),
+)
+
+Table(
+    "password_reset_tokens",
+    v1_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("token", String, unique=True, index=True, nullable=False),
+    Column("expires_at", DateTime, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+)
+
+# 2: user_cycle_stats
+v2_metadata = MetaData()
+
+Table("users", v2_metadata, Column("id", Integer, primary_key=True)) # 外部キーの参照先 (作成はしない)
+
+Table(
+    "user_cycle_stats",
+    v2_metadata,
+    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+    Column("period_count", Integer, nullable=False),
+    Column("period_length_sum", Integer, nullable=False),
+    Column("first_start_date", Date, nullable=True),
+    Column("last_start_date", Date, nullable=True),
+    Column("updated_at", DateTime, nullable=False),
+)
+
+# 3: hot-path indexes for periods and chat_messages
+v3_metadata = MetaData()
+
+v3_periods = Table(
+    "periods",
+    v3_metadata,
+    Column("user_id", Integer),
+    Column("start_date", Date),
+    Column("end_date", Date),
+)
+
+v3_chat_messages = Table(
+    "chat_messages",
+    v3_metadata,
+    Column("id", Integer),
+    Column("user_id", Integer),
+    Column("timestamp", DateTime),
+)
+
+v3_indexes = (
+    Index("ix_periods_user_id_start_date", v3_periods.c.user_id, v3_periods.c.start_date),
+    Index(
+        "ix_periods_user_id_active",
+        v3_periods.c.user_id,
+        sqlite_where=text("end_date IS NULL"),
+        postgresql_where=text("end_date IS NULL"),
+    ),
+    Index("ix_chat_messages_user_id_timestamp", v3_chat_messages.c.user_id, v3_chat_messages.c.timestamp, v3_chat_messages.c.id),
+)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "initial schema", _create_tables(
+        v1_metadata, "users", "periods", "chat_histories", "chat_messages", "password_reset_tokens",
+    )),
+    Migration(2, "user_cycle_stats", _create_tables(v2_metadata, "user_cycle_stats")),
+    Migration(3, "hot-path indexes for periods and chat_messages", _create_indexes(*v3_indexes)),
+    Migration(4, "chat_messages.is_partial", _add_columns(
+        "chat_messages",
+        Column("is_partial", Boolean, server_default=text("false"), nullable=False),
+    )),
+    Migration(5, "normalize sqlite datetimes for cursor pagination", _normalize_sqlite_datetimes(
+        ("periods", "created_at"),
+        ("chat_messages", "timestamp"),
+    )),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+# 起動時に存在を確認するインデックス (テーブル名 -> インデックス名)
+REQUIRED_INDEXES = {
+    "periods": {"ix_periods_user_id_start_date", "ix_periods_user_id_active"},
+    "chat_messages": {"ix_chat_messages_user_id_timestamp"},
+}
+
+
+def get_current_version(conn: Connection) -> int:
+    """適用済みの最新バージョンを返します（未適用なら0）。"""
+    if not inspect(conn).has_table(schema_migrations.name):
+        return 0
+    versions = [row.version for row in conn.execute(schema_migrations.select())]
+    return max(versions, default=0)
+
+
+# PostgreSQL の advisory lock のキー (このアプリのマイグレーション用の任意の固定値)
+MIGRATION_LOCK_ID = 0x5045_5249 # "PERI"
+
+
+@contextmanager
+def _migration_lock(engine: Engine):
+    """
+    PostgreSQL では、複数のワーカーが同時に起動しても1つずつマイグレーションを適用するように advisory lock を取ります。
+    SQLite では何もしません (ファイルのロックで書き込みは1つずつになる)。
+    """
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+    with engine.connect() as lock_conn:
+        lock_conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        lock_conn.commit() # セッション単位のロックなので、トランザクションを開いたまま待たせない
+        try:
+            yield
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+            lock_conn.commit()
+
+
+def run_migrations(engine: Engine, target_version: int = LATEST_VERSION) -> List[Migration]:
+    """
+    未適用のマイグレーションを順番に適用し、適用したマイグレーションのリストを返します。
+    各マイグレーションはバージョンの記録と同じトランザクションで実行されます。
+    """
+    with _migration_lock(engine):
+        migration_metadata.create_all(bind=engine, checkfirst=True)
+
+        applied = []
+        with engine.connect() as conn:
+            current_version = get_current_version(conn)
+
+        for migration in MIGRATIONS:
+            if migration.version <= current_version or migration.version > target_version:
+                continue
+            with engine.begin() as conn:
+                migration.upgrade(conn)
+                conn.execute(schema_migrations.insert().values(
+                    version=migration.version,
+                    description=migration.description,
+                    applied_at=datetime.now(timezone.utc),
+                ))
+            print(f"Applied migration {migration.version}: {migration.description}")
+            applied.append(migration)
+    return applied
+
+
+def verify_schema(engine: Engine) -> None:
+    """
+    スキーマが最新で、必要なインデックスが全て存在することを確認します。
+    欠けている場合は RuntimeError を送出します。
+    """
+    with engine.connect() as conn:
+        current_version = get_current_version(conn)
+        inspector = inspect(conn)
+        missing = []
+        for table_name, index_names in REQUIRED_INDEXES.items():
+            if not inspector.has_table(table_name):
+                missing.append(f"table {table_name}")
+                continue
+            existing = {index["name"] for index in inspector.get_indexes(table_name)}
+            missing.extend(f"{table_name}.{name}" for name in sorted(index_names - existing))
+
+    problems = []
+    if current_version < LATEST_VERSION:
+        problems.append(f"schema version {current_version} is behind {LATEST_VERSION}")
+    if missing:
+        problems.append("missing " + ", ".join(missing))
+    if problems:
+        raise RuntimeError(
+            "Database schema check failed: " + "; ".join(problems)
+            + ". Run `python -m backend.manage migrate`."
+        )
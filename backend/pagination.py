@@ -0,0 +1,99 @@
+# backend/pagination.py
+# カーソル (keyset) ページング
+#
+# offset(skip) は読み飛ばす行数に比例して遅くなるため、一覧APIは「前のページの最後の行の (ソートキー, id)」から
+# 続きを取得するカーソル方式に対応しています。カーソルはクライアントにとって中身を気にしない文字列 (base64) です。
+#
+#   GET /chat?limit=50                 -> レスポンスヘッダー X-Next-Cursor: <cursor>
+#   GET /chat?limit=50&cursor=<cursor> -> 次のページ
+#
+# 最後のページでは X-Next-Cursor は付きません。既存クライアント向けに skip/limit もそのまま使えます。
+#
+# 環境変数:
+#   PAGINATION_DEFAULT_LIMIT   limit 未指定時の件数 (デフォルト 100)
+#   PAGINATION_MAX_LIMIT       1ページの最大件数。これより大きい limit は切り詰める (デフォルト 200)
+
+import base64
+import json
+import os
+from datetime import date, datetime
+from typing import Any, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import Response
+from sqlalchemy import Date, DateTime, and_, or_
+
+load_dotenv()
+
+PAGINATION_DEFAULT_LIMIT = int(os.getenv("PAGINATION_DEFAULT_LIMIT", 100))
+PAGINATION_MAX_LIMIT = int(os.getenv("PAGINATION_MAX_LIMIT", 200))
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class InvalidCursor(ValueError):
+    """カーソルが壊れている、または別の並び順のカーソルが渡されたときに送出されます。"""
+
+
+def clamp_limit(limit: Optional[int]) -> int:
+    if limit is None:
+        return PAGINATION_DEFAULT_LIMIT
+    return max(1, min(limit, PAGINATION_MAX_LIMIT))
+
+
+def encode_cursor(value: Any, row_id: int, order: str) -> str:
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    payload = json.dumps({"v": value, "id": row_id, "o": order}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, column, order: str) -> Tuple[Any, int]:
+    """カーソルから (ソートキーの値, id) を取り出します。"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if payload["o"] != order:
+            raise InvalidCursor("cursor does not match the requested order")
+        value = payload["v"]
+        if isinstance(column.type, DateTime):
+            value = datetime.fromisoformat(value)
+        elif isinstance(column.type, Date):
+            value = date.fromisoformat(value)
+        return value, int(payload["id"])
+    except InvalidCursor:
+        raise
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor("invalid cursor") from e
+
+
+def apply_keyset(query, column, id_column, descending: bool, cursor: Optional[str], order: str):
+    """
+    (column, id) の順に並べ、cursor があればその続きから取得するようにクエリを変更します。
+    order はカーソルに埋め込む並び順の識別子で、別の並び順のカーソルの使い回しを防ぎます。
+    """
+    if cursor is not None:
+        value, row_id = decode_cursor(cursor, column, order)
+        if descending:
+            query = query.where(or_(column < value, and_(column == value, id_column < row_id)))
+        else:
+            query = query.where(or_(column > value, and_(column == value, id_column > row_id)))
+    if descending:
+        return query.order_by(column.desc(), id_column.desc())
+    return query.order_by(column.asc(), id_column.asc())
+
+
+def paginate(rows: List[Any], limit: int, sort_key: str, order: str) -> Tuple[List[Any], Optional[str]]:
+    """
+    limit + 1 件取得した結果を1ページ分と次のページのカーソルに分けます。
+    次のページがなければカーソルは None です。
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, sort_key), last.id, order)
+
+
+def set_next_cursor(response: Response, next_cursor: Optional[str]) -> None:
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
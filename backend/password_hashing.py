@@ -0,0 +1,139 @@
+# backend/password_hashing.py
+# bcrypt によるパスワードのハッシュ化・検証
+#
+# bcrypt は1回で数十〜数百ミリ秒かかるため、async def のエンドポイントから直接呼ぶとイベントループ全体が止まります。
+# ここでは上限付きのワーカープール (スレッド or プロセス) で実行し、待ち行列の深さなどのメトリクスを記録します。
+#
+# 環境変数:
+#   BCRYPT_ROUNDS                  bcrypt のコスト (デフォルト 12)。変更すると既存ハッシュは次回ログイン成功時に再ハッシュされる
+#   PASSWORD_HASH_EXECUTOR         "thread" (デフォルト) または "process"
+#   PASSWORD_HASH_WORKERS          同時に実行するハッシュ処理の上限 (デフォルト min(4, CPU数))
+#   PASSWORD_HASH_MAX_QUEUE        実行待ちの上限。超えた場合は PasswordHashingOverloaded を送出 (0 で無制限)
+
+import asyncio
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+from passlib.context import CryptContext
+
+from . import metrics
+
+load_dotenv()
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", 100))
+
+# bcrypt__rounds と異なるコストのハッシュは needs_update() / verify_and_update() で更新対象になる
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+class PasswordHashingOverloaded(RuntimeError):
+    """ハッシュ処理の待ち行列が上限を超えたときに送出されます。"""
+
+
+@dataclass
+class PasswordHashingStats:
+    pending: int = 0 # ワーカーで実行中 + 実行待ちの件数
+    max_queue_depth: int = 0 # 実行待ち (ワーカー数を超えた分) の最大値
+    completed: int = 0
+    rejected: int = 0
+    total_seconds: float = 0.0 # 完了した処理の所要時間 (待ち時間を含む) の合計
+
+    @property
+    def in_flight(self) -> int:
+        return min(self.pending, PASSWORD_HASH_WORKERS)
+
+    @property
+    def queued(self) -> int:
+        return max(0, self.pending - PASSWORD_HASH_WORKERS)
+
+
+stats = PasswordHashingStats()
+
+_executor: Optional[Executor] = None
+
+
+# ==== ワーカーで実行される関数 (ProcessPoolExecutor で pickle できるようにモジュールレベルに置く) ====
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+def _verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+# ==== プールの管理 ====
+
+def get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if PASSWORD_HASH_EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+    return _executor
+
+def shutdown_executor() -> None:
+    """アプリケーション終了時にワーカープールを停止します。"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+def get_stats() -> dict:
+    return {**asdict(stats), "in_flight": stats.in_flight, "queued": stats.queued, "workers": PASSWORD_HASH_WORKERS}
+
+
+def _collect_metrics():
+    return [
+        ("password_hash_pending", "gauge", "bcrypt jobs running or waiting for a worker.", [({}, stats.pending)]),
+        ("password_hash_queued", "gauge", "bcrypt jobs waiting for a worker.", [({}, stats.queued)]),
+        ("password_hash_max_queue_depth", "gauge", "Largest bcrypt queue depth seen.", [({}, stats.max_queue_depth)]),
+        ("password_hash_rejected_total", "counter", "bcrypt jobs rejected because the queue was full.", [({}, stats.rejected)]),
+    ]
+
+
+metrics.register_collector(_collect_metrics)
+
+
+async def _run(func, *args):
+    if PASSWORD_HASH_MAX_QUEUE and stats.queued >= PASSWORD_HASH_MAX_QUEUE:
+        stats.rejected += 1
+        raise PasswordHashingOverloaded("Too many password hashing requests in progress.")
+
+    stats.pending += 1
+    stats.max_queue_depth = max(stats.max_queue_depth, stats.queued)
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(get_executor(), func, *args)
+    finally:
+        elapsed = time.perf_counter() - started
+        stats.pending -= 1
+        stats.completed += 1
+        stats.total_seconds += elapsed
+        metrics.password_hash_duration_seconds.observe(elapsed, operation=func.__name__.lstrip("_"))
+
+
+# ==== 非同期API (async def のエンドポイントから使う) ====
+
+async def hash_password(password: str) -> str:
+    return await _run(_hash, password)
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await _run(_verify, plain_password, hashed_password)
+
+async def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    パスワードを検証し、ハッシュのコストが現在の設定と異なる場合は新しいハッシュも返します。
+    戻り値: (検証結果, 新しいハッシュ or None)
+    """
+    return await _run(_verify_and_update, plain_password, hashed_password)
@@ -0,0 +1,160 @@
+# backend/period_calendar.py
+# カレンダー表示用の日ごとの状態 (GET /periods/calendar)
+#
+# iOS の CalendarView が生の生理記録から日付計算をしなくて済むように、月ごとに1日1文字の状態を返します。
+#   "0": なし
+#   "1": 生理日 (記録済み。進行中の生理は今日まで)
+#   "2": 生理予測日 (進行中の生理の今日より後の予測日と、次回以降の予測生理期間)
+#   "3": 次回生理の予測開始日
+# 計算結果は (ユーザー, 月) ごとにキャッシュし、生理記録が書き込まれたら invalidate_user() で破棄します。
+#
+# 環境変数:
+#   CALENDAR_CACHE_TTL_SECONDS   キャッシュの有効期間 (デフォルト 3600秒、0 で無効)
+#   CALENDAR_CACHE_MAXSIZE       キャッシュするユーザー数の上限 (デフォルト 10000)
+
+import calendar
+import os
+import threading
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from cachetools import TTLCache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CALENDAR_CACHE_TTL_SECONDS = float(os.getenv("CALENDAR_CACHE_TTL_SECONDS", 3600))
+CALENDAR_CACHE_MAXSIZE = int(os.getenv("CALENDAR_CACHE_MAXSIZE", 10000))
+CALENDAR_MAX_MONTHS = 12
+
+NONE = "0"
+PERIOD = "1"
+PREDICTED = "2"
+PREDICTED_START = "3"
+
+Month = Tuple[int, int] # (年, 月)
+
+
+# ==== 月の計算 ====
+
+def parse_month(value: str) -> Month:
+    """ "YYYY-MM" を (年, 月) にします。"""
+    try:
+        year, month = (int(part) for part in value.split("-"))
+        date(year, month, 1)
+    except ValueError:
+        raise ValueError("月は YYYY-MM の形式で指定してください。")
+    return year, month
+
+
+def format_month(month: Month) -> str:
+    return f"{month[0]:04d}-{month[1]:02d}"
+
+
+def month_range(first: Month, months: int) -> List[Month]:
+    year, month = first
+    result = []
+    for _ in range(months):
+        result.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return result
+
+
+def month_bounds(month: Month) -> Tuple[date, date]:
+    first_day = date(month[0], month[1], 1)
+    return first_day, first_day.replace(day=calendar.monthrange(month[0], month[1])[1])
+
+
+# ==== 日ごとの状態 ====
+
+def build_day_states(
+    range_start: date,
+    range_end: date,
+    periods: Iterable[Tuple[date, Optional[date], Optional[date]]],
+    latest_start: Optional[date],
+    avg_period_length: int,
+    avg_cycle_length: int,
+    today: date,
+) -> Dict[date, str]:
+    """
+    range_start〜range_end の日ごとの状態を返します (状態が "0" の日は含みません)。
+    periods は範囲に重なる生理期間の (start_date, end_date, prediction_end_date)、latest_start は最新の生理の開始日です。
+    """
+    states: Dict[date, str] = {}
+
+    def mark(first: date, last: date, state: str, overwrite: bool = True) -> None:
+        day = max(first, range_start)
+        while day <= min(last, range_end):
+            if overwrite or day not in states:
+                states[day] = state
+            day += timedelta(days=1)
+
+    for start_date, end_date, prediction_end_date in periods:
+        if end_date is not None:
+            mark(start_date, end_date, PERIOD)
+        else:
+            # 進行中: 今日までは生理日、その後は予測終了日まで生理予測日
+            mark(start_date, min(today, prediction_end_date or today), PERIOD)
+            if prediction_end_date is not None and prediction_end_date > today:
+                mark(today + timedelta(days=1), prediction_end_date, PREDICTED, overwrite=False)
+
+    # 次回以降の予測: 最新の生理の開始日から平均周期ごと
+    if latest_start is not None and avg_cycle_length > 0:
+        next_start = latest_start + timedelta(days=avg_cycle_length)
+        # 範囲より前の予測は飛ばす
+        while next_start + timedelta(days=avg_period_length - 1) < range_start:
+            next_start += timedelta(days=avg_cycle_length)
+        while next_start <= range_end:
+            mark(next_start + timedelta(days=1), next_start + timedelta(days=avg_period_length - 1), PREDICTED, overwrite=False)
+            mark(next_start, next_start, PREDICTED_START, overwrite=False)
+            next_start += timedelta(days=avg_cycle_length)
+    return states
+
+
+def month_days(month: Month, states: Dict[date, str]) -> str:
+    first_day, last_day = month_bounds(month)
+    return "".join(states.get(first_day + timedelta(days=i), NONE) for i in range(last_day.day))
+
+
+# ==== キャッシュ ====
+
+_lock = threading.Lock()
+# user_id -> {(年, 月): (計算した日, 日ごとの状態)}。ユーザー単位で持つことで invalidate_user を O(1) にする
+_cache: Optional[TTLCache] = None
+if CALENDAR_CACHE_TTL_SECONDS > 0:
+    _cache = TTLCache(maxsize=CALENDAR_CACHE_MAXSIZE, ttl=CALENDAR_CACHE_TTL_SECONDS)
+
+
+def get_cached_month(user_id: int, month: Month, today: date) -> Optional[str]:
+    """キャッシュ済みの月の状態を返します。日付が変わると「今日」が動くので、計算した日が今日でなければ None。"""
+    if _cache is None:
+        return None
+    with _lock:
+        entry = _cache.get(user_id, {}).get(month)
+    if entry is None or entry[0] != today:
+        return None
+    return entry[1]
+
+
+def set_cached_month(user_id: int, month: Month, today: date, days: str) -> None:
+    if _cache is None:
+        return
+    with _lock:
+        months = _cache.get(user_id)
+        if months is None:
+            months = _cache[user_id] = {}
+        months[month] = (today, days)
+
+
+def invalidate_user(user_id: int) -> None:
+    """生理記録を作成・更新・インポートしたときに呼び、そのユーザーの全ての月を破棄します。"""
+    if _cache is None:
+        return
+    with _lock:
+        _cache.pop(user_id, None)
+
+
+def clear() -> None:
+    with _lock:
+        if _cache is not None:
+            _cache.clear()
@@ -0,0 +1,128 @@
+# backend/period_forecast.py
+# 複数周期先までの予測 (GET /periods/forecast)
+#
+# prediction_next_start_date は次の1回分しかないため、3〜6周期先まで表示したいクライアントは
+# 全履歴を取得して自分で外挿していました。このエンドポイントは、最新の生理の開始日から平均周期ごとに
+# N 回分の予測期間を返し、周期のばらつき (標準偏差) から予測開始日の幅 (信頼区間) を付けます。
+#
+# k 周期先の開始日の誤差は「k 回分の周期のばらつき」と「平均の推定誤差 (k 倍される)」の和なので、
+#   分散 = k * σ² + k² * σ² / n   (σ: 周期の標準偏差、n: 平均の計算に使った周期の数)
+# とし、その平方根に FORECAST_BAND_Z を掛けた日数を幅とします。先の周期ほど幅が広がります。
+#
+# 予測の元になる値 (ForecastParams) はユーザーごとにキャッシュし、生理記録が書き込まれたら invalidate_user() で破棄します。
+#
+# 環境変数:
+#   FORECAST_CACHE_TTL_SECONDS   キャッシュの有効期間 (デフォルト 3600秒、0 で無効)
+#   FORECAST_CACHE_MAXSIZE       キャッシュするユーザー数の上限 (デフォルト 10000)
+
+import math
+import os
+import threading
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import List, Optional, Sequence
+
+from cachetools import TTLCache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+FORECAST_CACHE_TTL_SECONDS = float(os.getenv("FORECAST_CACHE_TTL_SECONDS", 3600))
+FORECAST_CACHE_MAXSIZE = int(os.getenv("FORECAST_CACHE_MAXSIZE", 10000))
+FORECAST_DEFAULT_CYCLES = 3
+FORECAST_MAX_CYCLES = 12
+
+# 約80%の区間 (正規分布)
+FORECAST_BAND_Z = 1.28
+# 周期が2つ未満で標準偏差を計算できないときの値 (一般的な周期のばらつき)
+DEFAULT_CYCLE_LENGTH_SD = 4.0
+
+
+@dataclass(frozen=True)
+class ForecastParams:
+    """予測の元になるユーザーごとの値。"""
+    latest_start: Optional[date] # 最新の生理 (進行中を含む) の開始日
+    avg_period_length: int
+    avg_cycle_length: int
+    cycle_length_sd: float
+    cycle_count: int # 標準偏差の計算に使った周期の数
+
+
+@dataclass(frozen=True)
+class ForecastWindow:
+    cycle: int # 最新の生理から何周期先か (1 始まり)
+    start_date: date
+    end_date: date
+    start_earliest: date
+    start_latest: date
+
+
+def cycle_length_sd(start_dates: Sequence[date]) -> float:
+    """開始日順の完了済み生理期間の開始日から、周期の標本標準偏差を求めます。"""
+    lengths = [(start_dates[i + 1] - start_dates[i]).days for i in range(len(start_dates) - 1)]
+    if len(lengths) < 2:
+        return DEFAULT_CYCLE_LENGTH_SD
+    mean = sum(lengths) / len(lengths)
+    return math.sqrt(sum((length - mean) ** 2 for length in lengths) / (len(lengths) - 1))
+
+
+def band_days(params: ForecastParams, cycle: int) -> int:
+    """cycle 周期先の予測開始日の幅 (前後の日数)。"""
+    n = max(params.cycle_count, 1)
+    variance = cycle * params.cycle_length_sd ** 2 + cycle ** 2 * params.cycle_length_sd ** 2 / n
+    return math.ceil(FORECAST_BAND_Z * math.sqrt(variance))
+
+
+def build_forecast(params: ForecastParams, cycles: int, today: date) -> List[ForecastWindow]:
+    """
+    今日以降に終わる予測期間を cycles 回分返します。
+    生理の記録が途絶えている場合は、今日より前に終わる周期を飛ばします (幅は最新の生理からの周期数で計算)。
+    """
+    if params.latest_start is None or params.avg_cycle_length <= 0:
+        return []
+    windows = []
+    cycle = 1
+    while len(windows) < cycles:
+        start = params.latest_start + timedelta(days=params.avg_cycle_length * cycle)
+        end = start + timedelta(days=params.avg_period_length - 1)
+        if end >= today:
+            band = timedelta(days=band_days(params, cycle))
+            windows.append(ForecastWindow(cycle, start, end, start - band, start + band))
+        cycle += 1
+    return windows
+
+
+# ==== キャッシュ ====
+
+_lock = threading.Lock()
+_cache: Optional[TTLCache] = None
+if FORECAST_CACHE_TTL_SECONDS > 0:
+    _cache = TTLCache(maxsize=FORECAST_CACHE_MAXSIZE, ttl=FORECAST_CACHE_TTL_SECONDS)
+
+
+def get_cached_params(user_id: int) -> Optional[ForecastParams]:
+    if _cache is None:
+        return None
+    with _lock:
+        return _cache.get(user_id)
+
+
+def set_cached_params(user_id: int, params: ForecastParams) -> None:
+    if _cache is None:
+        return
+    with _lock:
+        _cache[user_id] = params
+
+
+def invalidate_user(user_id: int) -> None:
+    """生理記録を作成・更新・インポートしたときに呼びます。"""
+    if _cache is None:
+        return
+    with _lock:
+        _cache.pop(user_id, None)
+
+
+def clear() -> None:
+    with _lock:
+        if _cache is not None:
+            _cache.clear()
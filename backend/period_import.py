@@ -0,0 +1,137 @@
+# backend/period_import.py
+# 生理記録の一括インポート (POST /periods/import) の解析と検証
+#
+# 他のアプリから移行するユーザーが過去の履歴を1件ずつ POST / PATCH しなくて済むように、
+# JSON または CSV の全行をメモリ上で検証し、問題のない行だけを1トランザクションでまとめて挿入します。
+# ここはDBにアクセスしない純粋な処理だけを置き、挿入は crud.import_periods / async_crud.import_periods で行います。
+#
+# 受け付ける形式:
+#   JSON: [{"start_date": "2024-01-01", "end_date": "2024-01-05"}, ...] または {"periods": [...]}
+#   CSV : ヘッダー行に start_date,end_date (end_date は空欄可)
+#
+# 環境変数:
+#   PERIOD_IMPORT_MAX_ROWS   1回のインポートの最大行数 (デフォルト 20000)
+
+import csv
+import io
+import json
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from pydantic import ValidationError
+
+from .schemas import PeriodImportRow, PeriodImportRowError
+
+load_dotenv()
+
+PERIOD_IMPORT_MAX_ROWS = int(os.getenv("PERIOD_IMPORT_MAX_ROWS", 20000))
+
+# 進行中 (end_date が NULL) の期間は終わりがないものとして重なりを判定する
+_OPEN_END = date.max
+
+
+class PeriodImportError(ValueError):
+    """ファイル全体が読み込めないときに送出されます (行ごとのエラーは結果に含めます)。"""
+
+
+def parse_json_rows(body: bytes) -> List[dict]:
+    try:
+        data = json.loads(body)
+    except ValueError as e:
+        raise PeriodImportError(f"JSONとして読み込めません: {e}")
+    if isinstance(data, dict):
+        data = data.get("periods")
+    if not isinstance(data, list):
+        raise PeriodImportError("JSONは生理期間の配列、または {\"periods\": [...]} の形式で送ってください。")
+    return data
+
+
+def parse_csv_rows(body: bytes) -> List[dict]:
+    try:
+        text = body.decode("utf-8-sig") # Excel で保存したCSVの BOM を取り除く
+    except UnicodeDecodeError:
+        raise PeriodImportError("CSVは UTF-8 で保存してください。")
+    reader = csv.DictReader(io.StringIO(text))
+    if reader.fieldnames is None or "start_date" not in reader.fieldnames:
+        raise PeriodImportError("CSVの1行目に start_date,end_date のヘッダーが必要です。")
+    # 空欄の end_date は「進行中」として扱う
+    return [{key: (value or None) for key, value in row.items() if key} for row in reader]
+
+
+def validate_rows(raw_rows: List) -> Tuple[List[Tuple[int, PeriodImportRow]], List[PeriodImportRowError]]:
+    """各行を PeriodImportRow として検証し、(行番号, 行) のリストとエラーのリストを返します。"""
+    if len(raw_rows) > PERIOD_IMPORT_MAX_ROWS:
+        raise PeriodImportError(f"一度にインポートできるのは {PERIOD_IMPORT_MAX_ROWS} 件までです。")
+
+    rows, errors = [], []
+    for row_number, raw in enumerate(raw_rows, start=1):
+        try:
+            row = PeriodImportRow.model_validate(raw)
+        except ValidationError as e:
+            detail = "; ".join(f"{'.'.join(str(loc) for loc in err['loc']) or 'row'}: {err['msg']}" for err in e.errors())
+            errors.append(PeriodImportRowError(row=row_number, detail=detail))
+            continue
+        if row.end_date is not None and row.end_date < row.start_date:
+            errors.append(PeriodImportRowError(row=row_number, detail="終了日は開始日より前に設定できません。"))
+            continue
+        rows.append((row_number, row))
+    return rows, errors
+
+
+def reject_overlaps(
+    rows: List[Tuple[int, PeriodImportRow]],
+    existing: Iterable[Tuple[date, Optional[date]]],
+) -> Tuple[List[Tuple[int, PeriodImportRow]], List[PeriodImportRowError]]:
+    """
+    既存の期間やファイル内の他の行と重なる行を取り除きます。先に出てきた (開始日が早い、同じなら行番号が小さい) 行を優先します。
+    開始日順に1回走査するだけなので O(n log n) です。
+    """
+    existing = sorted((start, end or _OPEN_END) for start, end in existing)
+    candidates = sorted(rows, key=lambda item: (item[1].start_date, item[0]))
+
+    accepted, errors = [], []
+    previous_end = None # 開始日がこれまでに見た期間の中で最も遅い終了日
+    i = 0
+    for row_number, row in candidates:
+        # 開始日が今の行以前の既存期間を取り込む
+        while i < len(existing) and existing[i][0] <= row.start_date:
+            previous_end = max(previous_end or existing[i][1], existing[i][1])
+            i += 1
+        end = row.end_date or _OPEN_END
+        next_existing_start = existing[i][0] if i < len(existing) else None
+        if (previous_end is not None and previous_end >= row.start_date) or (
+            next_existing_start is not None and next_existing_start <= end
+        ):
+            errors.append(PeriodImportRowError(row=row_number, detail="他の生理期間と重なっています。"))
+            continue
+        accepted.append((row_number, row))
+        previous_end = max(previous_end or end, end)
+    accepted.sort(key=lambda item: item[0])
+    return accepted, errors
+
+
+def build_period_rows(
+    rows: List[Tuple[int, PeriodImportRow]],
+    user_id: int,
+    avg_period_length: int,
+    avg_cycle_length: int,
+) -> List[dict]:
+    """
+    executemany で挿入する periods の行 (dict) を作ります。
+    予測日はインポート後の統計から求めた平均値で、全行まとめて1回だけ計算します (_set_period_predictions と同じ式)。
+    """
+    now = datetime.now(timezone.utc)
+    return [
+        {
+            "user_id": user_id,
+            "start_date": row.start_date,
+            "end_date": row.end_date,
+            "prediction_end_date": row.start_date + timedelta(days=avg_period_length - 1),
+            "prediction_next_start_date": row.start_date + timedelta(days=avg_cycle_length) if row.end_date is not None else None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for _, row in rows
+    ]
@@ -0,0 +1,142 @@
+# backend/prediction_engines.py
+# 生理期間・生理周期の予測エンジン
+#
+# 予測は「平均生理期間」と「平均生理周期」の2つの日数で表します (prediction_end_date / prediction_next_start_date の計算に使う)。
+# エンジンは完了済みの生理期間の履歴 (開始日順の (start_date, end_date) のリスト) から、この2つを求めます。
+#
+#   mean      : 単純平均 (これまでの計算方法。user_cycle_stats の累積値だけで計算できる)
+#   recency   : 直近の周期ほど重くする指数加重平均
+#   median    : 中央値 (記録漏れで極端に長い周期があっても引っ張られにくい)
+#   trimmed   : 上下を一定割合ずつ除いた平均
+#   bayesian  : 一般的な周期 (28日 / 5日) を事前分布とし、記録が少ないうちはそちらに寄せる (縮小推定)
+#
+# アプリで使うエンジンは PREDICTION_ENGINE で選びます (デフォルト mean)。
+# どれを使うかは `python -m backend.benchmarks.backtest` の結果 (誤差と速度) を見て決めてください。
+
+import math
+import os
+import statistics
+from abc import ABC, abstractmethod
+from datetime import date
+from typing import Dict, List, Sequence, Tuple, Type
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PREDICTION_ENGINE = os.getenv("PREDICTION_ENGINE", "mean")
+
+# 履歴が足りないときの値
+DEFAULT_PERIOD_LENGTH = 5
+DEFAULT_CYCLE_LENGTH = 28
+
+History = Sequence[Tuple[date, date]]
+
+
+def period_lengths(history: History) -> List[int]:
+    return [(end - start).days + 1 for start, end in history]
+
+
+def cycle_lengths(history: History) -> List[int]:
+    """連続する開始日の間隔 (日数) のリスト。"""
+    return [(history[i + 1][0] - history[i][0]).days for i in range(len(history) - 1)]
+
+
+class PredictionEngine(ABC):
+    """予測エンジンのインターフェース。"""
+
+    name = ""
+    # True の場合、履歴の代わりに user_cycle_stats の累積値だけで計算できる (crud で全件の読み出しを省く)
+    uses_cycle_stats = False
+
+    def predict(self, history: History) -> Tuple[int, int]:
+        """開始日順の完了済み生理期間から (平均生理期間, 平均生理周期) を返します。"""
+        return (
+            self.estimate(period_lengths(history), DEFAULT_PERIOD_LENGTH),
+            self.estimate(cycle_lengths(history), DEFAULT_CYCLE_LENGTH),
+        )
+
+    @abstractmethod
+    def estimate(self, values: List[int], default: int) -> int:
+        """日数のリスト (古い順) から代表値を返します。values が空なら default。"""
+
+
+class MeanEngine(PredictionEngine):
+    name = "mean"
+    uses_cycle_stats = True
+
+    def estimate(self, values: List[int], default: int) -> int:
+        if not values:
+            return default
+        return int(round(sum(values) / len(values)))
+
+
+class RecencyWeightedMeanEngine(PredictionEngine):
+    name = "recency"
+
+    def __init__(self, half_life: float = 3.0):
+        self.half_life = half_life # この回数前の周期の重みが半分になる
+
+    def estimate(self, values: List[int], default: int) -> int:
+        if not values:
+            return default
+        n = len(values)
+        weights = [0.5 ** ((n - 1 - i) / self.half_life) for i in range(n)]
+        return int(round(sum(w * v for w, v in zip(weights, values)) / sum(weights)))
+
+
+class MedianEngine(PredictionEngine):
+    name = "median"
+
+    def estimate(self, values: List[int], default: int) -> int:
+        if not values:
+            return default
+        return int(round(statistics.median(values)))
+
+
+class TrimmedMeanEngine(PredictionEngine):
+    name = "trimmed"
+
+    def __init__(self, trim_ratio: float = 0.1):
+        self.trim_ratio = trim_ratio # 上下それぞれ除く割合
+
+    def estimate(self, values: List[int], default: int) -> int:
+        if not values:
+            return default
+        k = math.floor(len(values) * self.trim_ratio)
+        trimmed = sorted(values)[k:len(values) - k] if k > 0 else values
+        return int(round(sum(trimmed) / len(trimmed)))
+
+
+class BayesianShrinkageEngine(PredictionEngine):
+    name = "bayesian"
+
+    def __init__(self, prior_strength: float = 3.0):
+        self.prior_strength = prior_strength # 事前分布を何回分の観測とみなすか
+
+    def estimate(self, values: List[int], default: int) -> int:
+        # 正規分布の事後平均: (事前の重み * 事前平均 + 観測の合計) / (事前の重み + 観測数)
+        return int(round((self.prior_strength * default + sum(values)) / (self.prior_strength + len(values))))
+
+
+ENGINES: Dict[str, Type[PredictionEngine]] = {
+    engine.name: engine
+    for engine in (MeanEngine, RecencyWeightedMeanEngine, MedianEngine, TrimmedMeanEngine, BayesianShrinkageEngine)
+}
+
+_engine = None
+
+
+def make_prediction_engine(name: str) -> PredictionEngine:
+    try:
+        return ENGINES[name]()
+    except KeyError:
+        raise ValueError(f"Unknown prediction engine: {name} (choose from {', '.join(ENGINES)})")
+
+
+def get_prediction_engine() -> PredictionEngine:
+    """PREDICTION_ENGINE で選ばれたエンジンを返します。"""
+    global _engine
+    if _engine is None:
+        _engine = make_prediction_engine(PREDICTION_ENGINE)
+    return _engine
@@ -0,0 +1,226 @@
+# backend/prediction_jobs.py
+# 保存済みの予測日 (prediction_end_date / prediction_next_start_date) の一括再計算 (オフラインジョブ)
+#
+# 予測日は生理記録を書き込んだときにしか計算されないため、平均の計算方法を変えたりバグを直したりしても、
+# 既存の予測日は古いままになります。このジョブは periods テーブルを (user_id, start_date, id) 順にチャンクで読み出し、
+# 日付を序数 (date.toordinal) の NumPy 配列にして、ユーザーごとの平均をグループ単位のベクトル演算で求め、
+# 変わった行だけをまとめて UPDATE します。
+#
+# 計算は crud.average_period_data_from_stats / _set_period_predictions と同じです。
+#   平均生理期間 = 完了済み期間の日数の合計 / 件数 (四捨五入、期間がなければ 5)
+#   平均生理周期 = (最後の開始日 - 最初の開始日) / (件数 - 1) (四捨五入、2件未満なら 28)
+#   prediction_end_date        = start_date + 平均生理期間 - 1
+#   prediction_next_start_date = start_date + 平均生理周期 (終了日があるときのみ)
+# PREDICTION_ENGINE が mean 以外の場合は、ユーザーごとに予測エンジン (prediction_engines.py) で平均を求めます (ベクトル化なし)。
+#
+# 使い方: python -m backend.manage recompute-predictions [--dry-run] [--chunk-size 50000]
+
+import time
+from dataclasses import dataclass, field
+from datetime import date
+from typing import List, Optional
+
+import numpy as np
+from sqlalchemy import bindparam, select, tuple_, update
+from sqlalchemy.engine import Engine
+
+from .database import Period
+from .prediction_engines import DEFAULT_CYCLE_LENGTH, DEFAULT_PERIOD_LENGTH, PredictionEngine, get_prediction_engine
+
+NULL = -1 # NULL の日付を表す序数 (実際の序数は 1 以上)
+
+_periods = Period.__table__
+
+
+@dataclass
+class PredictionChange:
+    period_id: int
+    user_id: int
+    old_end: Optional[date]
+    new_end: Optional[date]
+    old_next: Optional[date]
+    new_next: Optional[date]
+
+
+@dataclass
+class RecomputeResult:
+    rows: int = 0
+    users: int = 0
+    changed: int = 0
+    seconds: float = 0.0
+    samples: List[PredictionChange] = field(default_factory=list) # dry-run で表示する差分
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def _to_ordinal(value: Optional[date]) -> int:
+    return value.toordinal() if value is not None else NULL
+
+
+def _to_date(ordinal: int) -> Optional[date]:
+    return date.fromordinal(int(ordinal)) if ordinal != NULL else None
+
+
+class _Chunk:
+    """periods の行を列ごとの NumPy 配列で持ちます。"""
+
+    def __init__(self, rows):
+        self.period_id = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        self.user_id = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+        self.start = np.fromiter((_to_ordinal(row[2]) for row in rows), dtype=np.int64, count=len(rows))
+        self.end = np.fromiter((_to_ordinal(row[3]) for row in rows), dtype=np.int64, count=len(rows))
+        self.prediction_end = np.fromiter((_to_ordinal(row[4]) for row in rows), dtype=np.int64, count=len(rows))
+        self.prediction_next = np.fromiter((_to_ordinal(row[5]) for row in rows), dtype=np.int64, count=len(rows))
+
+    def __len__(self) -> int:
+        return len(self.period_id)
+
+    def take(self, index) -> "_Chunk":
+        chunk = _Chunk.__new__(_Chunk)
+        for name in ("period_id", "user_id", "start", "end", "prediction_end", "prediction_next"):
+            setattr(chunk, name, getattr(self, name)[index])
+        return chunk
+
+    @staticmethod
+    def concat(a: "_Chunk", b: "_Chunk") -> "_Chunk":
+        chunk = _Chunk.__new__(_Chunk)
+        for name in ("period_id", "user_id", "start", "end", "prediction_end", "prediction_next"):
+            setattr(chunk, name, np.concatenate([getattr(a, name), getattr(b, name)]))
+        return chunk
+
+
+def _predictor_averages(chunk: _Chunk, group_starts, completed, predictor: PredictionEngine):
+    """mean 以外のエンジン: ユーザーごとに完了済みの履歴を渡して平均を求めます。"""
+    bounds = np.r_[group_starts, len(chunk)]
+    avg_period_length = np.empty(len(group_starts), dtype=np.int64)
+    avg_cycle_length = np.empty(len(group_starts), dtype=np.int64)
+    for group in range(len(group_starts)):
+        rows = slice(bounds[group], bounds[group + 1])
+        mask = completed[rows]
+        # 行は (user_id, start_date) 順なので、そのまま開始日順の履歴になる
+        history = [
+            (date.fromordinal(int(start)), date.fromordinal(int(end)))
+            for start, end in zip(chunk.start[rows][mask], chunk.end[rows][mask])
+        ]
+        avg_period_length[group], avg_cycle_length[group] = predictor.predict(history)
+    return avg_period_length, avg_cycle_length
+
+
+def compute_predictions(chunk: _Chunk, predictor: Optional[PredictionEngine] = None):
+    """
+    ユーザーごとに連続して並んだ行から、各行の新しい (prediction_end, prediction_next) の序数を返します。
+    ユーザー単位の集計は np.add.reduceat / np.minimum.reduceat などで一度に行います。
+    """
+    # 各ユーザーの先頭行の位置 (行は user_id 順に並んでいる)
+    group_starts = np.flatnonzero(np.r_[True, chunk.user_id[1:] != chunk.user_id[:-1]])
+    group_of_row = np.cumsum(np.r_[True, chunk.user_id[1:] != chunk.user_id[:-1]]) - 1
+
+    completed = chunk.end != NULL
+    if predictor is not None and not predictor.uses_cycle_stats:
+        avg_period_length, avg_cycle_length = _predictor_averages(chunk, group_starts, completed, predictor)
+        new_end = chunk.start + avg_period_length[group_of_row] - 1
+        new_next = np.where(completed, chunk.start + avg_cycle_length[group_of_row], NULL)
+        return new_end, new_next, len(group_starts)
+
+    count = np.add.reduceat(completed.astype(np.int64), group_starts)
+    length_sum = np.add.reduceat(np.where(completed, chunk.end - chunk.start + 1, 0), group_starts)
+    first_start = np.minimum.reduceat(np.where(completed, chunk.start, np.iinfo(np.int64).max), group_starts)
+    last_start = np.maximum.reduceat(np.where(completed, chunk.start, np.iinfo(np.int64).min), group_starts)
+
+    # Python の round() と同じく、np.rint は偶数丸め
+    with np.errstate(divide="ignore", invalid="ignore"):
+        avg_period_length = np.where(count > 0, np.rint(length_sum / np.maximum(count, 1)), DEFAULT_PERIOD_LENGTH).astype(np.int64)
+        avg_cycle_length = np.where(count > 1, np.rint((last_start - first_start) / np.maximum(count - 1, 1)), DEFAULT_CYCLE_LENGTH).astype(np.int64)
+
+    new_end = chunk.start + avg_period_length[group_of_row] - 1
+    new_next = np.where(completed, chunk.start + avg_cycle_length[group_of_row], NULL)
+    return new_end, new_next, len(group_starts)
+
+
+def _read_chunk(conn, after, chunk_size: int):
+    query = select(
+        _periods.c.id, _periods.c.user_id, _periods.c.start_date, _periods.c.end_date,
+        _periods.c.prediction_end_date, _periods.c.prediction_next_start_date,
+    ).order_by(_periods.c.user_id, _periods.c.start_date, _periods.c.id).limit(chunk_size)
+    if after is not None:
+        # (user_id, start_date, id) の keyset で続きを読む (ix_periods_user_id_start_date を使う)
+        query = query.where(tuple_(_periods.c.user_id, _periods.c.start_date, _periods.c.id) > tuple_(*after))
+    return conn.execute(query).all()
+
+
+def _write_changes(engine: Engine, chunk: _Chunk, new_end, new_next, changed, batch_size: int) -> None:
+    statement = (
+        update(_periods)
+        .where(_periods.c.id == bindparam("b_id"))
+        .values(prediction_end_date=bindparam("b_end"), prediction_next_start_date=bindparam("b_next"))
+    )
+    params = [
+        {"b_id": int(period_id), "b_end": _to_date(end), "b_next": _to_date(next_start)}
+        for period_id, end, next_start in zip(chunk.period_id[changed], new_end[changed], new_next[changed])
+    ]
+    for i in range(0, len(params), batch_size):
+        with engine.begin() as conn:
+            conn.execute(statement, params[i:i + batch_size])
+
+
+def recompute_predictions(
+    engine: Engine,
+    chunk_size: int = 50000,
+    batch_size: int = 1000,
+    dry_run: bool = False,
+    diff_limit: int = 20,
+    predictor: Optional[PredictionEngine] = None,
+) -> RecomputeResult:
+    """
+    全ユーザーの予測日を再計算し、変わった行を書き戻します (dry_run の場合は書き込まずに差分だけ集計)。
+    ユーザーの行がチャンクの境界をまたぐ場合は、次のチャンクと合わせて計算します。
+    predictor (予測エンジン) を省略した場合は PREDICTION_ENGINE のエンジンを使います。
+    """
+    predictor = predictor or get_prediction_engine()
+    result = RecomputeResult()
+    started = time.perf_counter()
+    pending: Optional[_Chunk] = None # 最後のユーザーの行 (次のチャンクに続きがあるかもしれない)
+    after = None
+
+    while True:
+        with engine.connect() as conn:
+            rows = _read_chunk(conn, after, chunk_size)
+        if rows:
+            after = (rows[-1][1], rows[-1][2], rows[-1][0])
+            chunk = _Chunk(rows)
+            chunk = _Chunk.concat(pending, chunk) if pending is not None else chunk
+        else:
+            chunk = pending
+        if chunk is None or len(chunk) == 0:
+            break
+
+        if rows:
+            # 最後のユーザーは次のチャンクに続きがあるかもしれないので、計算を次に回す
+            last_user_rows = chunk.user_id == chunk.user_id[-1]
+            pending = chunk.take(last_user_rows)
+            chunk = chunk.take(~last_user_rows)
+        else:
+            pending = None
+
+        if len(chunk):
+            new_end, new_next, users = compute_predictions(chunk, predictor)
+            changed = (new_end != chunk.prediction_end) | (new_next != chunk.prediction_next)
+            result.rows += len(chunk)
+            result.users += users
+            result.changed += int(changed.sum())
+            for index in np.flatnonzero(changed)[:max(diff_limit - len(result.samples), 0)]:
+                result.samples.append(PredictionChange(
+                    period_id=int(chunk.period_id[index]), user_id=int(chunk.user_id[index]),
+                    old_end=_to_date(chunk.prediction_end[index]), new_end=_to_date(new_end[index]),
+                    old_next=_to_date(chunk.prediction_next[index]), new_next=_to_date(new_next[index]),
+                ))
+            if not dry_run and changed.any():
+                _write_changes(engine, chunk, new_end, new_next, changed, batch_size)
+
+        if not rows:
+            break
+
+    result.seconds = time.perf_counter() - started
+    return result
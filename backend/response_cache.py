@@ -0,0 +1,160 @@
+# backend/response_cache.py
+# チャット回答のキャッシュ (オプトイン)
+#
+# 同じモードで同じ会話 (例: 最初の「お腹が痛い」) が送られてきたときに、LLMを呼ばずに前回の回答を返します。
+# キーは (実際に使うキャラ, メッセージ履歴) を正規化してハッシュ化したものです。ユーザー固有の情報はキーにも値にも含みません。
+#
+# 環境変数:
+#   CHAT_CACHE_ENABLED        "true" で有効化 (デフォルト無効)
+#   CHAT_CACHE_MODES          キャッシュするモードをカンマ区切りで指定 (例: "nurse,grandma")。"*" で全モード (デフォルト)
+#   CHAT_CACHE_TTL_SECONDS    有効期間 (デフォルト 3600秒)
+#   CHAT_CACHE_MAXSIZE        最大件数。超えたら古いものから捨てる (デフォルト 1000)
+#   CHAT_CACHE_MAX_MESSAGES   キャッシュ対象とする会話の最大メッセージ数 (デフォルト 1 = 最初の質問のみ)
+#   CHAT_CACHE_BACKEND        "memory" (デフォルト)。複数ワーカーで共有するストアは ResponseCacheBackend を実装して追加する
+
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Iterable, Optional
+
+from cachetools import TTLCache
+from dotenv import load_dotenv
+
+from . import metrics
+from .schemas import mode_label
+
+load_dotenv()
+
+CHAT_CACHE_ENABLED = os.getenv("CHAT_CACHE_ENABLED", "false").lower() == "true"
+CHAT_CACHE_MODES = os.getenv("CHAT_CACHE_MODES", "*")
+CHAT_CACHE_TTL_SECONDS = float(os.getenv("CHAT_CACHE_TTL_SECONDS", 3600))
+CHAT_CACHE_MAXSIZE = int(os.getenv("CHAT_CACHE_MAXSIZE", 1000))
+CHAT_CACHE_MAX_MESSAGES = int(os.getenv("CHAT_CACHE_MAX_MESSAGES", 1))
+CHAT_CACHE_BACKEND = os.getenv("CHAT_CACHE_BACKEND", "memory")
+
+
+class ResponseCacheBackend(ABC):
+    """キャッシュの保存先のインターフェース。共有ストア (Redisなど) はこれを実装します。
+    メソッドが1つでも足りない実装は、作る時点で TypeError になります。"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: str) -> None:
+        ...
+
+    @abstractmethod
+    async def clear(self) -> None:
+        ...
+
+
+class InMemoryResponseCacheBackend(ResponseCacheBackend):
+    """プロセス内の TTL + LRU キャッシュ。ワーカー間では共有されません。"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._cache.get(key)
+
+    async def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._cache[key] = value
+
+    async def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+
+def _normalize_mode(mode: str) -> str:
+    return mode.strip().lower()
+
+
+def _normalize_text(text: str) -> str:
+    # 全角/半角の揺れ・前後の空白・連続する空白を吸収する
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def make_key(character: str, messages: Iterable[dict]) -> str:
+    """
+    character には、回答を作るのに実際に使ったキャラ (routers.chat.resolve_character の値) を渡します。
+    ここで別の正規化をすると、違うプロンプトで作った回答が同じキーになってしまうので、値はそのまま使います。
+    """
+    normalized = [character] + [[m["role"], _normalize_text(m["content"])] for m in messages]
+    return hashlib.sha256(json.dumps(normalized, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, backend: ResponseCacheBackend, enabled: bool, modes: str, max_messages: int):
+        self.backend = backend
+        self.enabled = enabled
+        self.modes = None if modes.strip() == "*" else {_normalize_mode(m) for m in modes.split(",") if m.strip()}
+        self.max_messages = max_messages
+        # モードごとのヒット数・ミス数。mode はクライアントが送る任意の文字列なので、
+        # メトリクスのラベルが増え続けないように mode_label (ChatMode の値か OTHER) で数える
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def is_cacheable(self, mode: str, messages: list[dict]) -> bool:
+        if not self.enabled or not messages or len(messages) > self.max_messages:
+            return False
+        return self.modes is None or _normalize_mode(mode) in self.modes
+
+    async def get(self, mode: str, messages: list[dict]) -> Optional[str]:
+        """キャッシュ済みの回答を返します。対象外またはミスの場合は None。"""
+        if not self.is_cacheable(mode, messages):
+            return None
+        value = await self.backend.get(make_key(mode, messages))
+        if value is None:
+            self.misses[mode_label(mode)] += 1
+        else:
+            self.hits[mode_label(mode)] += 1
+        return value
+
+    async def set(self, mode: str, messages: list[dict], response: str) -> None:
+        if not response or not self.is_cacheable(mode, messages):
+            return
+        await self.backend.set(make_key(mode, messages), response)
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "hits": sum(self.hits.values()),
+            "misses": sum(self.misses.values()),
+            "hits_by_mode": dict(self.hits),
+            "misses_by_mode": dict(self.misses),
+        }
+
+
+def _create_backend() -> ResponseCacheBackend:
+    if CHAT_CACHE_BACKEND == "memory":
+        return InMemoryResponseCacheBackend(maxsize=CHAT_CACHE_MAXSIZE, ttl=CHAT_CACHE_TTL_SECONDS)
+    raise ValueError(f"Unknown CHAT_CACHE_BACKEND: {CHAT_CACHE_BACKEND}")
+
+
+response_cache = ResponseCache(
+    backend=_create_backend(),
+    enabled=CHAT_CACHE_ENABLED,
+    modes=CHAT_CACHE_MODES,
+    max_messages=CHAT_CACHE_MAX_MESSAGES,
+)
+
+
+def _collect_metrics():
+    return [
+        ("chat_cache_hits_total", "counter", "Chat response cache hits by mode.", [({"mode": mode}, count) for mode, count in response_cache.hits.items()]),
+        ("chat_cache_misses_total", "counter", "Chat response cache misses by mode.", [({"mode": mode}, count) for mode, count in response_cache.misses.items()]),
+    ]
+
+
+metrics.register_collector(_collect_metrics)
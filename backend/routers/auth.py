@@ -1,21 +1,22 @@
 from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 from jose import JWTError, jwt
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
 
 # REMOVED: from backend import crud, schemas (redundant)
-from ..database import get_db, User, PasswordResetToken # <--- Corrected to get_db
+from ..database import get_async_db, User, PasswordResetToken
 from dotenv import load_dotenv
-from .. import crud, schemas # This import is sufficient
+from .. import async_crud, auth_cache, google_id_token, password_hashing, schemas
+from ..app_logging import get_logger
 import os
 
 load_dotenv()
 
+log = get_logger("auth")
+
 # 環境変数から設定を読み込み
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
@@ -25,7 +26,7 @@ GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 if not SECRET_KEY:
     raise ValueError("SECRET_KEY environment variable not set.")
 if not GOOGLE_CLIENT_ID:
-    print("Warning: GOOGLE_CLIENT_ID not set. Google Auth will not work.")
+    log.warning("auth.google_client_id_missing", detail="GOOGLE_CLIENT_ID not set. Google Auth will not work.")
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login") # 認証が必要なエンドポイントで利用
@@ -47,33 +48,57 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 # 依存性注入：現在のユーザーを取得 (保護されたエンドポイントで利用)
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User: # <--- CHANGED HERE
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        # デコード済みトークンと解決済みユーザーはキャッシュを優先し、DBへの問い合わせを省く
+        payload = auth_cache.get_token_payload(token)
+        if payload is None:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            auth_cache.set_token_payload(token, payload)
         user_id: int = payload.get("user_id")
         auth_provider: str = payload.get("auth_provider")
         if user_id is None or auth_provider is None:
             raise credentials_exception
-        user = crud.get_user_by_id(db, user_id=user_id)
+        user = auth_cache.get_user(user_id)
         if user is None:
-            raise credentials_exception
+            user = await async_crud.get_user_by_id(db, user_id=user_id)
+            if user is None:
+                raise credentials_exception
+            db.expunge(user) # リクエスト間で共有するのでセッションから切り離す
+            auth_cache.set_user(user)
         return user
     except JWTError:
         raise credentials_exception
 
 
+# ヘルパー関数：メールアドレスとパスワードでローカル認証ユーザーを検証
+# bcryptのコスト (BCRYPT_ROUNDS) が変わっている場合は、ログイン成功時に新しいコストで再ハッシュして保存する
+async def authenticate_local_user(db: AsyncSession, email: str, password: str) -> Optional[User]:
+    user = await async_crud.get_user_by_email(db, email=email)
+    if not user or user.auth_provider != "local" or not user.hashed_password:
+        return None
+    verified, new_hash = await password_hashing.verify_and_update(password, user.hashed_password)
+    if not verified:
+        return None
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
+        auth_cache.invalidate_user(user.id)
+    return user
+
+
 # ==== エンドポイントの実装 ====
 
 @router.post("/register", response_model=schemas.TokenResponse, status_code=status.HTTP_201_CREATED)
-async def register_user(user_in: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register_user(user_in: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
     # 1. メールアドレスの重複チェック
     # 同じメールアドレスのユーザーが既に存在するかデータベースで確認します。
-    db_user = crud.get_user_by_email(db, email=user_in.email)
+    db_user = await async_crud.get_user_by_email(db, email=user_in.email)
     if db_user:
         # 既に登録済みの場合はHTTP 409 Conflictエラーを返します。
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Email already registered")
@@ -81,7 +106,7 @@ async def register_user(user_in: schemas.UserCreate, db: Session = Depends(get_d
     # 2. 新しいユーザーの作成とデータベースへの保存
     # メールアドレスが重複していなければ、crudモジュールを使って新しいユーザーを作成します。
     # auth_provider="local"は、このユーザーがメールとパスワードで認証することを意味します。
-    user = crud.create_user(db=db, user=user_in, auth_provider="local")
+    user = await async_crud.create_user(db=db, user=user_in, auth_provider="local")
 
     # 3. アクセストークンの生成
     # 新規登録に成功したユーザーのために、今後の認証で使用するJWTアクセストークンを生成します。
@@ -106,9 +131,9 @@ async def register_user(user_in: schemas.UserCreate, db: Session = Depends(get_d
 
 # SwaggerUI OAuth2認証用（usernameフィールドにメールアドレスを入力）
 @router.post("/login", response_model=schemas.Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = crud.get_user_by_email(db, email=form_data.username)  # usernameフィールドにメールアドレスを入力
-    if not user or user.auth_provider != "local" or not crud.verify_password(form_data.password, user.hashed_password):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await authenticate_local_user(db, email=form_data.username, password=form_data.password)  # usernameフィールドにメールアドレスを入力
+    if not user:
 
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -119,7 +144,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     access_token = create_access_token(
         data={"user_id": user.id, "email": user.email, "auth_provider": user.auth_provider, "name": user.name}
     )
-    print(f"access_token: {access_token}")  
+    log.info("auth.login", user_id=user.id, auth_provider=user.auth_provider) # トークン自体はログに出さない
     return schemas.TokenResponse(
         access_token=access_token,
         token_type="bearer",
@@ -131,9 +156,9 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 
 # フロントエンド用ログイン（emailフィールドを使用）
 @router.post("/login-email", response_model=schemas.Token)
-async def login_with_email(login_request: schemas.LoginRequest, db: Session = Depends(get_db)):
-    user = crud.get_user_by_email(db, email=login_request.email)
-    if not user or user.auth_provider != "local" or not crud.verify_password(login_request.password, user.hashed_password):
+async def login_with_email(login_request: schemas.LoginRequest, db: AsyncSession = Depends(get_async_db)):
+    user = await authenticate_local_user(db, email=login_request.email, password=login_request.password)
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password, or account uses Google authentication.",
@@ -152,14 +177,15 @@ async def login_with_email(login_request: schemas.LoginRequest, db: Session = De
 
 # Google認証
 @router.post("/google", response_model=schemas.Token)
-async def google_auth(id_token_str: str, db: Session = Depends(get_db)):
+async def google_auth(id_token_str: str, db: AsyncSession = Depends(get_async_db)):
     try:
-        idinfo = id_token.verify_oauth2_token(id_token_str, google_requests.Request(), GOOGLE_CLIENT_ID)
+        # キャッシュした Google の公開鍵で検証する (署名の検証はスレッドで行う)
+        idinfo = await google_id_token.get_google_verifier().verify(id_token_str)
         google_sub = idinfo['sub']
         email = idinfo['email']
         name = idinfo.get('name')
 
-        user = crud.get_user_by_google_sub(db, google_sub=google_sub)
+        user = await async_crud.get_user_by_google_sub(db, google_sub=google_sub)
 
         if user: # 既存のGoogle認証ユーザー
             if user.auth_provider != 'google':
@@ -169,7 +195,7 @@ async def google_auth(id_token_str: str, db: Session = Depends(get_db)):
                 )
         else: # 新規Google認証ユーザー
             # 同じメールアドレスでローカル認証済みのアカウントがないかチェック
-            existing_local_user = crud.get_user_by_email(db, email=email)
+            existing_local_user = await async_crud.get_user_by_email(db, email=email)
             if existing_local_user and existing_local_user.auth_provider == 'local':
                 raise HTTPException(
                     status_code=status.HTTP_409_CONFLICT,
@@ -178,7 +204,7 @@ async def google_auth(id_token_str: str, db: Session = Depends(get_db)):
 
             # 新規ユーザー作成（hashed_passwordはNone）
             user_create_data = schemas.UserCreate(email=email, password=None, name=name)
-            user = crud.create_user(db=db, user=user_create_data, auth_provider='google', google_sub=google_sub)
+            user = await async_crud.create_user(db=db, user=user_create_data, auth_provider='google', google_sub=google_sub)
 
         access_token = create_access_token(
             data={"user_id": user.id, "email": user.email, "auth_provider": user.auth_provider, "name": user.name}
@@ -193,8 +219,14 @@ async def google_auth(id_token_str: str, db: Session = Depends(get_db)):
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"Invalid Google ID token: {e}"
         )
+    except google_id_token.GoogleCertsUnavailable as e:
+        log.error("auth.google_certs_unavailable", error=str(e))
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Google authentication is temporarily unavailable. Please retry later."
+        )
     except Exception as e:
-        print(f"Google auth error: {e}")
+        log.exception("auth.google_error", error=str(e))
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An unexpected error occurred during Google authentication."
@@ -202,36 +234,38 @@ async def google_auth(id_token_str: str, db: Session = Depends(get_db)):
 
 # パスワード再設定要求
 @router.post("/forgot-password", status_code=status.HTTP_200_OK)
-async def forgot_password(request: schemas.ForgotPasswordRequest, db: Session = Depends(get_db)):
-    user = crud.get_user_by_email(db, email=request.email)
+async def forgot_password(request: schemas.ForgotPasswordRequest, db: AsyncSession = Depends(get_async_db)):
+    user = await async_crud.get_user_by_email(db, email=request.email)
     if user and user.auth_provider == "local": # ローカル認証ユーザーのみ再設定可能
         # トークンを生成してDBに保存
-        reset_token = crud.create_password_reset_token(db, user_id=user.id)
+        reset_token = await async_crud.create_password_reset_token(db, user_id=user.id)
         
         # メール送信ロジックを実装する場合はここに追加
-        print(f"Password reset link for {user.email}: http://your-frontend.com/reset-password?token={reset_token.token}")
+        # (それまでは開発用にログに出す。リンクはトークンを含むので LOG_REDACT=false のときだけ見える)
+        log.info("auth.password_reset_link", user_id=user.id, reset_token=reset_token.token)
 
     # セキュリティのため、ユーザーが存在しない場合でも同じ成功メッセージを返す
     return {"message": "If an account with that email exists, a password reset link has been sent."}
 
 # パスワード再設定実行
 @router.post("/reset-password", status_code=status.HTTP_200_OK)
-async def reset_password(request: schemas.ResetPasswordRequest, db: Session = Depends(get_db)):
-    reset_token_db = crud.get_password_reset_token(db, token=request.token)
+async def reset_password(request: schemas.ResetPasswordRequest, db: AsyncSession = Depends(get_async_db)):
+    reset_token_db = await async_crud.get_password_reset_token(db, token=request.token)
 
     if not reset_token_db:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid or expired reset token.")
 
-    user = crud.get_user_by_id(db, user_id=reset_token_db.user_id)
+    user = await async_crud.get_user_by_id(db, user_id=reset_token_db.user_id)
     if not user or user.auth_provider != "local":
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid request.")
 
     # パスワードを更新
-    user.hashed_password = crud.get_password_hash(request.new_password)
+    user.hashed_password = await password_hashing.hash_password(request.new_password)
     user.updated_at = datetime.now(timezone.utc)
-    db.commit()
+    await db.commit()
+    auth_cache.invalidate_user(user.id) # キャッシュ済みのユーザー情報を破棄
 
     # 使用済みトークンを削除
-    crud.delete_password_reset_token(db, reset_token_db.id)
+    await async_crud.delete_password_reset_token(db, reset_token_db.id)
 
     return {"message": "Password has been reset successfully."}
@@ -1,29 +1,36 @@
 # # backend/routers/chat.py
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from ..database import get_db, User # database.py から get_db と User をインポート
-from ..schemas import ChatMessageCreate, ChatMessageResponse, ChatMode # schema.py からスキーマをインポート (UserResponseは削除)
-from .. import crud # crud.py から CRUD 関数をインポート
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..database import get_async_db, AsyncSessionLocal, User # database.py から get_async_db と User をインポート
+from ..schemas import ChatMessageCreate, ChatMessageResponse, ChatMode, mode_label # schema.py からスキーマをインポート (UserResponseは削除)
+from .. import async_crud # async_crud.py から CRUD 関数をインポート
+from .. import chat_context, metrics
+from ..app_logging import get_logger
+from ..crud import CHAT_CURSOR_ORDER
+from ..llm_client import LLMBusyError, LLMError, get_llm_client
+from ..etag import is_not_modified, not_modified_response, request_etag, set_etag
+from ..pagination import PAGINATION_DEFAULT_LIMIT, PAGINATION_MAX_LIMIT, InvalidCursor, clamp_limit, paginate, set_next_cursor
+from ..response_cache import response_cache
 from .auth import get_current_user # 認証済みユーザーを取得する依存関係
-from openai import OpenAI
-from dotenv import load_dotenv
-import os
-from pathlib import Path
+from contextlib import aclosing
+from typing import AsyncIterator, Optional
+import anyio
+import json
+import time
 from pydantic import BaseModel
 
-# .envからAPIキーを読み込む
-env_path = Path(__file__).resolve().parent.parent / ".env"
-load_dotenv(dotenv_path=env_path)
-
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
 router = APIRouter(
     prefix="/chat",
     tags=["Chat"],
-    dependencies=[Depends(get_current_user)], # このルーターの全エンドポイントで認証が必要
+    # このルーターの全エンドポイントで認証が必要
+    # (エンドポイント引数の current_user と同じ依存関係なので、FastAPIの依存キャッシュにより1リクエストで1回だけ解決される)
+    dependencies=[Depends(get_current_user)],
     responses={404: {"description": "Not found"}},
 )
 
+log = get_logger("chat")
+
 # キャラ別のプロンプト
 CHARACTER_PROMPTS = {
     "boyfriend": "あなたは優しい彼氏として、相手の生理の愚痴を共感たっぷりに聞いてあげてください。",
@@ -33,34 +40,94 @@ CHARACTER_PROMPTS = {
     "mother": "あなたは母親として、母性と愛情を感じさせるように、温かく包み込むように話を聞いてあげてください。",
 }
 
-def get_response(mode: str, messages: list[dict]) -> str:
-    system_prompt = CHARACTER_PROMPTS.get(mode, CHARACTER_PROMPTS["mother"])
+DEFAULT_CHARACTER = "mother"
+
+def resolve_character(mode: str) -> str:
+    """
+    リクエストの mode から、実際に使うキャラ (CHARACTER_PROMPTS のキー) を決めます。知らないモードは mother です。
+    プロンプト・回答のキャッシュのキー・メトリクスのすべてにこの値を使います
+    (mode の文字列のままキャッシュすると、違うキャラで作った回答を返してしまうため)。
+    """
+    return mode if mode in CHARACTER_PROMPTS else DEFAULT_CHARACTER
+
+async def build_messages(character: str, messages: list[dict], user_id: Optional[int] = None) -> list[dict]:
+    """character は resolve_character で決めたキャラです。"""
+    system_prompt = CHARACTER_PROMPTS[character]
 
     # システムプロンプトを先頭に追加
-    full_messages = [{"role": "system", "content": system_prompt}] + messages
+    # 会話が長い場合は、古いやりとりを要約してトークン予算内に収める (chat_context.py)
+    return await chat_context.fit_to_budget(system_prompt, messages, mode=character, user_id=user_id)
 
-    res = client.chat.completions.create(
-        model="gpt-4o",
-        messages=full_messages
-    )
-    return res.choices[0].message.content
+def record_tokens(mode: str, prompt: list[dict], response: str) -> None:
+    metrics.llm_tokens_total.inc(chat_context.count_tokens(prompt), mode=mode_label(mode), direction="prompt")
+    metrics.llm_tokens_total.inc(chat_context.count_text_tokens(response), mode=mode_label(mode), direction="completion")
+
+async def get_response(mode: str, messages: list[dict], user_id: Optional[int] = None) -> str:
+    character = resolve_character(mode)
+    # 同じキャラ・同じ会話の回答がキャッシュにあればLLMを呼ばない (CHAT_CACHE_ENABLED で有効化)
+    cached = await response_cache.get(character, messages)
+    if cached is not None:
+        return cached
+    prompt = await build_messages(character, messages, user_id)
+    response = await get_llm_client().complete(prompt, user_id=user_id)
+    record_tokens(character, prompt, response)
+    await response_cache.set(character, messages, response)
+    return response
+
+async def stream_response(mode: str, messages: list[dict], user_id: Optional[int] = None) -> AsyncIterator[str]:
+    """回答をトークン（差分テキスト）ごとに返す非同期イテレーター。"""
+    character = resolve_character(mode)
+    cached = await response_cache.get(character, messages)
+    if cached is not None:
+        yield cached
+        return
+    chunks = []
+    prompt = await build_messages(character, messages, user_id)
+    try:
+        async with aclosing(get_llm_client().stream(prompt, user_id=user_id)) as deltas:
+            async for delta in deltas:
+                chunks.append(delta)
+                yield delta
+    finally:
+        # 途中で切断された場合も、そこまでに生成されたトークンを数える
+        record_tokens(character, prompt, "".join(chunks))
+    # 最後まで生成できた回答だけをキャッシュする
+    await response_cache.set(character, messages, "".join(chunks))
+
+def llm_http_exception(e: LLMError) -> HTTPException:
+    """LLMの呼び出しエラーをHTTPエラーに変換します。"""
+    if isinstance(e, LLMBusyError):
+        return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="AIが混み合っています。しばらくしてから再度お試しください。")
+    log.warning("chat.llm_error", error=str(e))
+    return HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail="AIとの通信エラーが発生しました。")
+
+def format_sse(data: dict, event: str | None = None) -> str:
+    """Server-Sent Events の1イベント分の文字列を作ります。"""
+    payload = json.dumps(data, ensure_ascii=False)
+    if event:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return f"data: {payload}\n\n"
 
 
 @router.post("/", response_model=ChatMessageResponse, status_code=status.HTTP_201_CREATED)
-def chat_with_ai(
+async def chat_with_ai(
     chat_message_create: ChatMessageCreate, # Pydanticスキーマを使用
     current_user: User = Depends(get_current_user), # <--- UserResponseからUserに変更
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     AIに質問を送信し、回答を取得して履歴に保存します。
     ユーザーが選択したモードに基づいてAIの応答を生成します。
     """
     # フロントエンドから送られてきたmessages配列を使用
-    ai_response = get_response(chat_message_create.mode, chat_message_create.messages)
+    messages = [message.model_dump() for message in chat_message_create.messages]
+    try:
+        ai_response = await get_response(chat_message_create.mode, messages, user_id=current_user.id)
+    except LLMError as e:
+        raise llm_http_exception(e)
     
     # チャット履歴をデータベースに保存
-    db_chat_message = crud.create_chat_message(
+    db_chat_message = await async_crud.create_chat_message(
         db=db,
         chat_message=chat_message_create,
         user_id=current_user.id,
@@ -68,17 +135,91 @@ def chat_with_ai(
     )
     return db_chat_message
 
+@router.post("/stream")
+async def chat_with_ai_stream(
+    chat_message_create: ChatMessageCreate,
+    current_user: User = Depends(get_current_user),
+):
+    """
+    AIの回答を Server-Sent Events でトークンごとに返します。
+    - `data: {"delta": "..."}` : 生成された差分テキスト
+    - `event: done` : 保存されたチャット履歴 (ChatMessageResponse)
+    - `event: error` : 生成中にエラーが発生した場合
+    回答は生成完了後に履歴へ保存します。途中でクライアントが切断した場合は、そこまでの回答を is_partial=True で保存します。
+    """
+    user_id = current_user.id
+    messages = [message.model_dump() for message in chat_message_create.messages]
+
+    async def event_stream():
+        chunks = []
+        completed = False
+        error = None
+        started = time.perf_counter()
+        try:
+            # aclosing: 切断時にも上流のストリームと同時実行枠をすぐに解放する
+            async with aclosing(stream_response(chat_message_create.mode, messages, user_id=user_id)) as deltas:
+                async for delta in deltas:
+                    if not chunks:
+                        log.info("chat.stream.first_token", ms=round((time.perf_counter() - started) * 1000), user_id=user_id)
+                    chunks.append(delta)
+                    yield format_sse({"delta": delta})
+            completed = True
+        except Exception as e:
+            error = e
+        finally:
+            # クライアント切断時はキャンセルされるため、保存処理はキャンセルから保護して必ず実行する
+            if chunks or completed:
+                with anyio.CancelScope(shield=True):
+                    async with AsyncSessionLocal() as db:
+                        db_chat_message = await async_crud.create_chat_message(
+                            db=db,
+                            chat_message=chat_message_create,
+                            user_id=user_id,
+                            ai_response="".join(chunks),
+                            is_partial=not completed,
+                        )
+
+        if error is not None:
+            log.warning("chat.stream.error", error=str(error), user_id=user_id, partial=bool(chunks))
+            yield format_sse({"detail": "AI応答の生成中にエラーが発生しました。"}, event="error")
+            return
+        yield format_sse(ChatMessageResponse.model_validate(db_chat_message, from_attributes=True).model_dump(mode="json"), event="done")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}, # プロキシでバッファリングさせない
+    )
+
 @router.get("/", response_model=list[ChatMessageResponse])
-def get_chat_history(
-    skip: int = 0,
-    limit: int = 100,
+async def get_chat_history(
+    request: Request,
+    response: Response,
+    skip: int = Query(0, ge=0, description="読み飛ばす件数 (互換用。深いページには cursor を使ってください)"),
+    limit: int | None = Query(None, description=f"取得する件数 (未指定時 {PAGINATION_DEFAULT_LIMIT}件、最大 {PAGINATION_MAX_LIMIT}件)"),
+    cursor: str | None = Query(None, description="前のレスポンスの X-Next-Cursor ヘッダーの値。指定するとその続き (より古いメッセージ) を返します"),
     current_user: User = Depends(get_current_user), # <--- UserResponseからUserに変更
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    認証済みユーザーのチャット履歴を取得します。
+    認証済みユーザーのチャット履歴を新しい順に取得します。
+    次のページがある場合は X-Next-Cursor ヘッダーにカーソルを返します。
+    If-None-Match の ETag と一致する (履歴が変わっていない) 場合は 304 を返します。
     """
-    return crud.get_chat_messages(db=db, user_id=current_user.id, skip=skip, limit=limit)
+    etag = request_etag(request, current_user.id, await async_crud.get_chat_messages_watermark(db, current_user.id))
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    set_etag(response, etag)
+
+    limit = clamp_limit(limit)
+    try:
+        # 次のページがあるかを知るために1件多く取得する
+        messages = await async_crud.get_chat_messages(db=db, user_id=current_user.id, skip=skip, limit=limit + 1, cursor=cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    messages, next_cursor = paginate(messages, limit, "timestamp", CHAT_CURSOR_ORDER)
+    set_next_cursor(response, next_cursor)
+    return messages
 
 
 
@@ -0,0 +1,114 @@
+# backend/routers/export.py
+# アカウントデータ (生理記録・チャット履歴) のエクスポート
+#
+# 一覧APIをページごとに何百回も呼ばなくても、1回のリクエストで全データをダウンロードできます。
+# DBからはサーバーサイドカーソル (yield_per) で少しずつ読み出してそのままストリーミングするので、
+# チャット履歴がどれだけ多くてもメモリ使用量は一定です。
+#
+# 途中で接続が切れた場合は、最後に受け取った行の id を periods_after_id / chat_messages_after_id に指定すると
+# その続きからエクスポートできます (行は種類ごとに id 順で出力されます)。
+
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from typing import AsyncIterator, Literal
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+
+from .. import async_crud
+from ..crud import EXPORT_CHAT_MESSAGE_COLUMNS, EXPORT_PERIOD_COLUMNS
+from ..database import AsyncSessionLocal, User
+from .auth import get_current_user
+
+router = APIRouter(prefix="/export", tags=["export"])
+
+# この大きさ (バイト) まで溜めてから送る。1行ずつ送るとオーバーヘッドが大きいため
+CHUNK_SIZE = 64 * 1024
+# DBから一度に取り出す行数
+BATCH_SIZE = 500
+
+RESOURCES = {
+    # リソース名: (NDJSON の type, CSV の列, 行を取り出す関数)
+    "periods": ("period", [c.key for c in EXPORT_PERIOD_COLUMNS], async_crud.stream_periods_for_export),
+    "chat_messages": ("chat_message", [c.key for c in EXPORT_CHAT_MESSAGE_COLUMNS], async_crud.stream_chat_messages_for_export),
+}
+
+
+def _to_text(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _ndjson_line(record_type: str, row) -> str:
+    record = {"type": record_type}
+    record.update({key: _to_text(value) for key, value in row.items()})
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def _csv_line(row) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(_to_text(value) for value in row.values())
+    return buffer.getvalue()
+
+
+@router.get("/")
+async def export_account_data(
+    format: Literal["ndjson", "csv"] = Query("ndjson", description="ndjson: 1行1レコードのJSON / csv: 1種類のデータのCSV"),
+    resource: Literal["all", "periods", "chat_messages"] = Query("all", description="エクスポートするデータ (csv の場合は periods か chat_messages のどちらか)"),
+    gzip: bool = Query(False, description="true の場合 gzip 圧縮したファイルを返します"),
+    periods_after_id: int = Query(0, ge=0, description="再開用: この id より後の生理記録から出力します"),
+    chat_messages_after_id: int = Query(0, ge=0, description="再開用: この id より後のチャット履歴から出力します"),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    認証済みユーザーの生理記録とチャット履歴をストリーミングでエクスポートします。
+    NDJSON の各行には種類を表す "type" ("period" / "chat_message") が付きます。
+    """
+    if format == "csv" and resource == "all":
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="CSVでエクスポートする場合は resource に periods か chat_messages を指定してください。")
+
+    user_id = current_user.id
+    names = list(RESOURCES) if resource == "all" else [resource]
+    after_ids = {"periods": periods_after_id, "chat_messages": chat_messages_after_id}
+
+    async def lines() -> AsyncIterator[str]:
+        # レスポンスを送り終わるまで使うので、リクエストの依存関係とは別にセッションを開く
+        async with AsyncSessionLocal() as db:
+            for name in names:
+                record_type, columns, stream = RESOURCES[name]
+                if format == "csv":
+                    yield ",".join(columns) + "\n"
+                async for row in stream(db, user_id=user_id, after_id=after_ids[name], batch_size=BATCH_SIZE):
+                    yield _csv_line(row) if format == "csv" else _ndjson_line(record_type, row)
+
+    async def body() -> AsyncIterator[bytes]:
+        compressor = zlib.compressobj(wbits=31) if gzip else None # wbits=31: gzip 形式
+        buffer, size = [], 0
+        async for line in lines():
+            data = line.encode("utf-8")
+            buffer.append(data)
+            size += len(data)
+            if size >= CHUNK_SIZE:
+                chunk = b"".join(buffer)
+                buffer, size = [], 0
+                chunk = compressor.compress(chunk) if compressor else chunk
+                if chunk:
+                    yield chunk
+        chunk = b"".join(buffer)
+        if compressor:
+            chunk = compressor.compress(chunk) + compressor.flush()
+        if chunk:
+            yield chunk
+
+    extension = "ndjson" if format == "ndjson" else "csv"
+    filename = f"period-tracker-{resource}.{extension}" + (".gz" if gzip else "")
+    media_type = "application/gzip" if gzip else ("application/x-ndjson" if format == "ndjson" else "text/csv; charset=utf-8")
+    return StreamingResponse(
+        body(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -1,9 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
-from ..database import get_db, User, Period
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..database import get_async_db, User, Period
 from ..routers.auth import get_current_user
 from datetime import date, timedelta, datetime, timezone # datetime, timezone を追加
-from .. import crud, schemas
+from .. import async_crud, period_calendar, period_forecast, period_import, schemas
+from ..crud import PERIOD_CURSOR_COLUMNS, period_cursor_order
+from ..etag import is_not_modified, not_modified_response, request_etag, set_etag
+from ..pagination import PAGINATION_DEFAULT_LIMIT, PAGINATION_MAX_LIMIT, InvalidCursor, clamp_limit, paginate, set_next_cursor
 
 router = APIRouter(prefix="/periods", tags=["periods"])
 
@@ -12,10 +15,10 @@ router = APIRouter(prefix="/periods", tags=["periods"])
 async def create_period_entry( # 関数名をシンプルに
     period: schemas.PeriodCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # ユーザーが現在アクティブな生理期間を持っていないかチェック
-    active_period = db.query(Period).filter(Period.user_id == current_user.id, Period.start_date != None, Period.end_date == None).first()
+    active_period = await async_crud.get_active_period(db, user_id=current_user.id)
     if active_period:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
@@ -25,12 +28,41 @@ async def create_period_entry( # 関数名をシンプルに
     # PeriodCreateスキーマはstart_dateのみを持つため、end_dateの検証は不要
 
     # crud関数を呼び出して生理レコードを作成
-    # crud.create_period内で予測日が計算され、DBに保存されます
-    db_period = crud.create_period(db=db, period=period, user_id=current_user.id)
+    # async_crud.create_period内で予測日が計算され、DBに保存されます
+    db_period = await async_crud.create_period(db=db, period=period, user_id=current_user.id)
+    period_calendar.invalidate_user(current_user.id) # カレンダーのキャッシュを破棄
+    period_forecast.invalidate_user(current_user.id) # 複数周期の予測のキャッシュを破棄
 
     # db_periodには既に予測日が含まれているため、それを直接返す
     return db_period
 
+# 過去の履歴の一括インポート (JSON / CSV)
+@router.post("/import", response_model=schemas.PeriodImportResponse)
+async def import_period_history(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    他のアプリから移行するときに、過去の生理期間をまとめて登録します。
+    - Content-Type: application/json : [{"start_date": "...", "end_date": "..."}, ...]
+    - Content-Type: text/csv : ヘッダー行 start_date,end_date
+    既存の期間やファイル内の他の行と重なる行、日付が不正な行はスキップし、errors に行番号と理由を返します。
+    """
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
+    try:
+        if "csv" in content_type:
+            raw_rows = period_import.parse_csv_rows(body)
+        else:
+            raw_rows = period_import.parse_json_rows(body)
+        imported, errors = await async_crud.import_periods(db, user_id=current_user.id, raw_rows=raw_rows)
+    except period_import.PeriodImportError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    period_calendar.invalidate_user(current_user.id) # カレンダーのキャッシュを破棄
+    period_forecast.invalidate_user(current_user.id) # 複数周期の予測のキャッシュを破棄
+    return schemas.PeriodImportResponse(imported=imported, errors=errors)
+
 # --- 既存のPATCHエンドポイントは削除し、以下の予測専用POSTエンドポイントを推奨 ---
 # 既存のPATCHエンドポイントは「登録した後の編集機能は一切入りません」という要件に反するため削除
 # @router.patch("/{period_id}", ...)
@@ -43,12 +75,12 @@ async def end_period(
     period_id: int,
     period_end: schemas.PeriodEndDate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     アクティブな生理期間に終了日を登録します。
     """
-    db_period = crud.get_period_by_id(db, period_id=period_id, user_id=current_user.id)
+    db_period = await async_crud.get_period_by_id(db, period_id=period_id, user_id=current_user.id)
     if not db_period:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="生理期間が見つからないか、アクセス権がありません。")
 
@@ -62,41 +94,144 @@ async def end_period(
 
     # PeriodUpdateスキーマを使用して更新
     period_update = schemas.PeriodUpdate(end_date=period_end.end_date)
-    return crud.update_period(db=db, db_period=db_period, period_update=period_update)
+    db_period = await async_crud.update_period(db=db, db_period=db_period, period_update=period_update)
+    period_calendar.invalidate_user(current_user.id) # カレンダーのキャッシュを破棄
+    period_forecast.invalidate_user(current_user.id) # 複数周期の予測のキャッシュを破棄
+    return db_period
 
 # ③ カレンダー表示＆六ヶ月分の表示 (柔軟な取得)
 @router.get("/", response_model=list[schemas.PeriodResponse])
 async def read_periods(
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     start_date: date | None = Query(None, description="この日付以降に開始する生理期間をフィルタリングします (YYYY-MM-DD)。カレンダー表示には月の開始日を使用してください。"),
     end_date: date | None = Query(None, description="この日付以前に開始する生理期間をフィルタリングします (YYYY-MM-DD)。カレンダー表示には月の終了日を使用してください。"), # 「終了」ではなく「開始」に文言修正
-    limit: int | None = Query(None, description="取得するレコードの最大数"),
+    limit: int | None = Query(None, description=f"取得するレコードの最大数 (未指定時 {PAGINATION_DEFAULT_LIMIT}件、最大 {PAGINATION_MAX_LIMIT}件)"),
+    skip: int = Query(0, ge=0, description="読み飛ばす件数 (互換用。深いページには cursor を使ってください)"),
+    cursor: str | None = Query(None, description="前のレスポンスの X-Next-Cursor ヘッダーの値。指定するとその続きを返します"),
     order_by: str = Query("start_date", description="ソートするカラム名 (例: start_date, created_at)"),
     order_direction: str = Query("desc", description="ソート順 (asc:昇順, desc:降順)"),
 ):
-    # crud.get_periods にフィルタリング引数を渡す
-    periods = crud.get_periods(
-        db=db,
-        user_id=current_user.id,
-        start_date=start_date,
-        end_date=end_date,
-        limit=limit, # crud関数に渡す
-        order_by=order_by, # crud関数に渡す
-        order_direction=order_direction, # crud関数に渡す
+    """
+    次のページがある場合は X-Next-Cursor ヘッダーにカーソルを返します (start_date / created_at / id 順のとき)。
+    """
+    # データが変わっていなければ、一覧のクエリを実行せずに 304 を返す
+    etag = request_etag(request, current_user.id, await async_crud.get_periods_watermark(db, current_user.id))
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    set_etag(response, etag)
+
+    limit = clamp_limit(limit)
+    # async_crud.get_periods にフィルタリング引数を渡す
+    # 次のページがあるかを知るために1件多く取得する
+    try:
+        periods = await async_crud.get_periods(
+            db=db,
+            user_id=current_user.id,
+            start_date=start_date,
+            end_date=end_date,
+            skip=skip,
+            limit=limit + 1, # crud関数に渡す
+            order_by=order_by, # crud関数に渡す
+            order_direction=order_direction, # crud関数に渡す
+            cursor=cursor,
+        )
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    if order_by in PERIOD_CURSOR_COLUMNS:
+        periods, next_cursor = paginate(periods, limit, order_by, period_cursor_order(order_by, order_direction))
+        set_next_cursor(response, next_cursor)
+    return periods[:limit]
+
+# カレンダー表示用の日ごとの状態 (/{period_id} より前に定義する)
+@router.get("/calendar", response_model=schemas.CalendarResponse)
+async def read_calendar(
+    from_month: str | None = Query(None, alias="from", description="最初の月 (YYYY-MM)。未指定なら今月"),
+    months: int = Query(1, ge=1, le=period_calendar.CALENDAR_MAX_MONTHS, description="何ヶ月分返すか"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    指定した月から months ヶ月分の、日ごとの状態を返します。
+    days は1日1文字で "0": なし / "1": 生理日 / "2": 生理予測日 / "3": 次回生理の予測開始日 です。
+    """
+    today = date.today()
+    try:
+        first = period_calendar.parse_month(from_month) if from_month else (today.year, today.month)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    month_list = period_calendar.month_range(first, months)
+    days_by_month = {month: period_calendar.get_cached_month(current_user.id, month, today) for month in month_list}
+    missing = [month for month, days in days_by_month.items() if days is None]
+    if missing:
+        # キャッシュにない月をまとめて1回で計算する
+        range_start = period_calendar.month_bounds(missing[0])[0]
+        range_end = period_calendar.month_bounds(missing[-1])[1]
+        states = await async_crud.get_calendar_day_states(db, current_user.id, range_start, range_end, today)
+        for month in missing:
+            days_by_month[month] = period_calendar.month_days(month, states)
+            period_calendar.set_cached_month(current_user.id, month, today, days_by_month[month])
+
+    return schemas.CalendarResponse(months=[
+        schemas.CalendarMonth(month=period_calendar.format_month(month), days=days_by_month[month])
+        for month in month_list
+    ])
+
+# 複数周期の予測 (/{period_id} より前に定義する)
+@router.get("/forecast", response_model=schemas.ForecastResponse)
+async def read_forecast(
+    cycles: int = Query(period_forecast.FORECAST_DEFAULT_CYCLES, ge=1, le=period_forecast.FORECAST_MAX_CYCLES, description="何周期分の予測を返すか"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    今後 cycles 回分の予測生理期間を返します。
+    start_earliest〜start_latest は周期のばらつきから求めた予測開始日の幅で、先の周期ほど広くなります。
+    生理の記録がない場合 cycles は空です。
+    """
+    params = period_forecast.get_cached_params(current_user.id)
+    if params is None:
+        params = await async_crud.get_forecast_params(db, current_user.id)
+        period_forecast.set_cached_params(current_user.id, params)
+
+    return schemas.ForecastResponse(
+        avg_cycle_length=params.avg_cycle_length,
+        avg_period_length=params.avg_period_length,
+        cycle_length_sd=round(params.cycle_length_sd, 2),
+        cycles=[
+            schemas.ForecastCycle(
+                cycle=window.cycle,
+                start_date=window.start_date,
+                end_date=window.end_date,
+                start_earliest=window.start_earliest,
+                start_latest=window.start_latest,
+            )
+            for window in period_forecast.build_forecast(params, cycles, date.today())
+        ],
     )
-    return periods
 
 # 特定生理期間の取得（これは残します）
 @router.get("/{period_id}", response_model=schemas.PeriodResponse)
 async def read_single_period(
     period_id: int,
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    db_period = crud.get_period_by_id(db, period_id=period_id, user_id=current_user.id)
+    # 存在の確認を ETag より先に行う (If-None-Match: * や古い ETag で、無い記録や他人の記録に 304 を返さないため)
+    db_period = await async_crud.get_period_by_id(db, period_id=period_id, user_id=current_user.id)
     if not db_period:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="生理期間が見つからないか、アクセス権がありません。")
+
+    etag = request_etag(request, current_user.id, await async_crud.get_periods_watermark(db, current_user.id))
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    set_etag(response, etag)
     return db_period
 
 # # 削除機能は「登録した後の編集機能は一切入りません」という要件から、今回は含めません。
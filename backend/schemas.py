@@ -14,6 +14,12 @@ class ChatMode(str, Enum):
     BOYFRIEND = "BOYFRIEND"
     NURSE = "NURSE"
 
+def mode_label(mode: str) -> str:
+    """メトリクスのラベル用に、モードを ChatMode の値にそろえます (任意の文字列でラベルが増えないように)。"""
+    value = mode.strip().upper()
+    value = "MOM" if value == "MOTHER" else value
+    return value if value in ChatMode.__members__ else "OTHER"
+
 # ==== User関連スキーマ ====
 class UserBase(BaseModel):
     email: str
@@ -108,6 +114,43 @@ class PeriodResponse(PeriodBase):
     class Config:
         orm_mode = True
 
+# 一括インポート (POST /periods/import)
+class PeriodImportRow(BaseModel):
+    start_date: date
+    end_date: Optional[date] = None
+
+class PeriodImportRowError(BaseModel):
+    row: int # 1始まりの行番号 (CSVはヘッダーを除いたデータ行)
+    detail: str
+
+class PeriodImportResponse(BaseModel):
+    imported: int
+    errors: List[PeriodImportRowError]
+
+# カレンダー (GET /periods/calendar)
+class CalendarMonth(BaseModel):
+    month: str # "YYYY-MM"
+    # 1日1文字の状態 (1日目から月末まで)。"0": なし / "1": 生理日 / "2": 生理予測日 / "3": 次回生理の予測開始日
+    days: str
+
+class CalendarResponse(BaseModel):
+    months: List[CalendarMonth]
+
+# 複数周期の予測 (GET /periods/forecast)
+class ForecastCycle(BaseModel):
+    cycle: int # 最新の生理から何周期先か
+    start_date: date # 予測開始日
+    end_date: date # 予測終了日
+    # 予測開始日の幅 (約80%の区間)
+    start_earliest: date
+    start_latest: date
+
+class ForecastResponse(BaseModel):
+    avg_cycle_length: int
+    avg_period_length: int
+    cycle_length_sd: float # 周期の標準偏差 (日)
+    cycles: List[ForecastCycle]
+
 # ==== ChatMessage関連スキーマ ====
 
 #スキーマ：データの形式を定義するルール（入力データの検証、出力データの整形）
@@ -126,6 +169,7 @@ class ChatMessageResponse(BaseModel):
     query: str
     response: str  # ai_responseではなくresponseフィールドを使用
     timestamp: datetime  # created_atではなくtimestampフィールドを使用
+    is_partial: bool = False  # ストリーミングが途中で切断された回答の場合 True
     
     class Config:
         orm_mode = True
@@ -0,0 +1,182 @@
+# backend/sql_instrumentation.py
+# リクエストごとのSQLの計測 (クエリ数・DB時間) と、遅いクエリ・N+1 の検出
+#
+# SQLAlchemy の before/after_cursor_execute イベントで、実行した SQL の件数と所要時間をリクエスト単位で集計します。
+# 集計先は contextvars に置くので、async のハンドラーからでも、スレッドプールで動く同期の依存関係
+# (get_db を使うもの) からでも、同じリクエストの値にまとまります。
+#   - SQL_DEBUG_HEADERS=true のとき、レスポンスに X-DB-Query-Count / X-DB-Time-Ms を付ける
+#   - SQL_SLOW_QUERY_MS を超えたクエリは、SQL と実行計画 (SQLite: EXPLAIN QUERY PLAN / PostgreSQL: EXPLAIN) をログに出す
+#   - 1リクエストの中で同じ SQL が SQL_N_PLUS_ONE_THRESHOLD 回以上実行されたら、N+1 の疑いとしてログに出す
+# 1リクエストあたりのクエリ数は /metrics の db_queries_per_request にも出ます。
+#
+# 環境変数:
+#   SQL_DEBUG_HEADERS          true でクエリ数と DB 時間をレスポンスヘッダーに付ける (デフォルト: false)
+#   SQL_SLOW_QUERY_MS          遅いクエリとしてログに出すしきい値 (ミリ秒、0 で無効、デフォルト: 100)
+#   SQL_EXPLAIN_SLOW_QUERIES   false で遅いクエリの実行計画を取らない (デフォルト: true)
+#   SQL_N_PLUS_ONE_THRESHOLD   同じ SQL がこの回数以上実行されたら N+1 の疑いとする (0 で無効、デフォルト: 5)
+
+import os
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+from . import metrics
+from .app_logging import get_logger
+
+load_dotenv()
+
+log = get_logger("sql")
+
+SQL_DEBUG_HEADERS = os.getenv("SQL_DEBUG_HEADERS", "false").lower() == "true"
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "100"))
+SQL_EXPLAIN_SLOW_QUERIES = os.getenv("SQL_EXPLAIN_SLOW_QUERIES", "true").lower() == "true"
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "5"))
+
+QUERY_COUNT_HEADER = "X-DB-Query-Count"
+QUERY_TIME_HEADER = "X-DB-Time-Ms"
+
+# ログに出す SQL の最大文字数
+MAX_LOGGED_STATEMENT_LENGTH = 2000
+
+db_queries_per_request = metrics.histogram(
+    "db_queries_per_request", "SQL statements executed per HTTP request.", ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+
+
+class QueryStats:
+    """1リクエストで実行した SQL の集計。"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Counter = Counter()
+
+    @property
+    def milliseconds(self) -> float:
+        return self.seconds * 1000
+
+    def record(self, statement: str, elapsed: float) -> None:
+        self.count += 1
+        self.seconds += elapsed
+        self.statements[statement] += 1
+
+    def repeated_statements(self, threshold: int = SQL_N_PLUS_ONE_THRESHOLD) -> List[tuple]:
+        """threshold 回以上実行された SQL を (SQL, 回数) の多い順で返します。"""
+        if threshold <= 0:
+            return []
+        return [(statement, count) for statement, count in self.statements.most_common() if count >= threshold]
+
+
+_current: ContextVar[Optional[QueryStats]] = ContextVar("sql_query_stats", default=None)
+
+
+def current() -> Optional[QueryStats]:
+    """実行中のリクエストの集計を返します (リクエストの外では None)。"""
+    return _current.get()
+
+
+def _shorten(statement: str) -> str:
+    statement = " ".join(statement.split())
+    if len(statement) > MAX_LOGGED_STATEMENT_LENGTH:
+        return statement[:MAX_LOGGED_STATEMENT_LENGTH] + "..."
+    return statement
+
+
+# ==== SQLAlchemy のイベント ====
+
+def _explain(conn, statement: str, parameters) -> Optional[List[str]]:
+    """同じ接続・同じパラメータで実行計画を取ります。取れない SQL (DDL など) は None を返します。"""
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    elif dialect == "postgresql":
+        prefix = "EXPLAIN "
+    else:
+        return None
+    if not statement.lstrip().upper().startswith(("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")):
+        return None
+
+    conn.info["sql_explaining"] = True # EXPLAIN 自体を計測・ログの対象にしない
+    try:
+        rows = conn.exec_driver_sql(prefix + statement, parameters).fetchall()
+    except Exception as e:
+        return [f"(EXPLAIN failed: {e})"]
+    finally:
+        conn.info["sql_explaining"] = False
+    if dialect == "sqlite":
+        # (id, parent, notused, detail)
+        return [str(row[-1]) for row in rows]
+    return [str(row[0]) for row in rows]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("sql_query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["sql_query_started"].pop()
+    if conn.info.get("sql_explaining"):
+        return
+    elapsed = time.perf_counter() - started
+
+    stats = _current.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+
+    if SQL_SLOW_QUERY_MS > 0 and elapsed * 1000 >= SQL_SLOW_QUERY_MS:
+        plan = _explain(conn, statement, parameters) if SQL_EXPLAIN_SLOW_QUERIES and not executemany else None
+        log.warning("sql.slow_query", ms=round(elapsed * 1000, 1), statement=_shorten(statement), plan=plan)
+
+
+def instrument_engine(engine) -> None:
+    """同期エンジン (AsyncEngine の場合は .sync_engine) で実行される SQL を計測対象にします。"""
+    from sqlalchemy import event
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# ==== HTTP ミドルウェア ====
+
+def _report(method: str, route_path: str, stats: QueryStats) -> None:
+    db_queries_per_request.observe(stats.count, route=route_path)
+    for statement, count in stats.repeated_statements():
+        log.warning("sql.n_plus_one", method=method, route=route_path, count=count, statement=_shorten(statement))
+
+
+class QueryStatsMiddleware:
+    """
+    ASGI ミドルウェア。リクエストごとに集計を始め、終わったら N+1 の疑いをログに出します。
+    SQL_DEBUG_HEADERS=true のときは、ヘッダーを送る時点までのクエリ数と DB 時間をヘッダーに付けます
+    (StreamingResponse の本文を作りながら実行する SQL はヘッダーには入りません)。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = _current.set(stats)
+
+        async def send_wrapper(message):
+            if SQL_DEBUG_HEADERS and message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((QUERY_COUNT_HEADER.lower().encode(), str(stats.count).encode()))
+                headers.append((QUERY_TIME_HEADER.lower().encode(), f"{stats.milliseconds:.2f}".encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            route = scope.get("route")
+            _report(scope["method"], getattr(route, "path", None) or metrics.UNMATCHED_ROUTE, stats)
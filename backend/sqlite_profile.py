@@ -0,0 +1,134 @@
+# backend/sqlite_profile.py
+# SQLite の性能プロファイル (接続時の PRAGMA とコネクションプールの大きさ)
+#
+# SQLite の既定値は rollback journal + synchronous=FULL なので、db.commit() のたびに完全な fsync が走り、
+# 書き込み中は読み込みも待たされます。プロファイルを選ぶと、接続ごとに PRAGMA を設定します (connect イベント)。
+#   wal          WAL + synchronous=NORMAL。読み込みは書き込みを待たない。
+#                電源断のときは直近のコミットが失われることがあるが、DBが壊れることはない (デフォルト)
+#   wal-durable  WAL + synchronous=FULL。コミットごとに WAL を fsync する
+#   default      SQLite の既定値のまま (以前の動作)
+# どのプロファイルでも busy_timeout を設定し、書き込みが重なったときはすぐにエラーにせず待ちます。
+#
+# 環境変数:
+#   SQLITE_PROFILE        wal / wal-durable / default (デフォルト: wal)
+#   SQLITE_PRAGMAS        プロファイルの値を上書きする (例: cache_size=-131072,mmap_size=0)
+#   SQLITE_POOL_SIZE      コネクションプールの大きさ (デフォルト: WAL は 10、default は 5)
+#   SQLITE_MAX_OVERFLOW   プールを超えて一時的に開く接続数 (デフォルト: WAL は 10、default は 0)
+#   SQLITE_POOL_TIMEOUT   プールが空くまで待つ秒数 (デフォルト: 30)
+
+import os
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+load_dotenv()
+
+# 共通の設定 (プロファイルの値で上書きされる)
+_BASE_PRAGMAS = {
+    "busy_timeout": 5000, # ミリ秒。ロックが取れないときに database is locked にせず待つ
+    "temp_store": "MEMORY", # ソートや一時テーブルをメモリで行う
+}
+_WAL_PRAGMAS = {
+    "journal_mode": "WAL",
+    "cache_size": -65536, # 負の値は KiB 単位 (64MiB)。既定値は 2MiB
+    "mmap_size": 268435456, # 256MiB までメモリマップで読む
+}
+
+SQLITE_PROFILES: Dict[str, Dict[str, object]] = {
+    "wal": {**_BASE_PRAGMAS, **_WAL_PRAGMAS, "synchronous": "NORMAL"},
+    "wal-durable": {**_BASE_PRAGMAS, **_WAL_PRAGMAS, "synchronous": "FULL"},
+    "default": {"busy_timeout": 5000},
+}
+
+# プロファイルごとのプールの大きさ
+# WAL は読み込み同士・読み込みと書き込みが並行できるので多めに持つ。
+# rollback journal では接続を増やしても書き込み中はファイルのロック待ち (ポーリング) になるだけなので、
+# プールの待ち行列で順番に待たせる
+SQLITE_POOL_DEFAULTS = {
+    "wal": {"pool_size": 10, "max_overflow": 10},
+    "wal-durable": {"pool_size": 10, "max_overflow": 10},
+    "default": {"pool_size": 5, "max_overflow": 0},
+}
+
+# 接続時に設定する順番 (busy_timeout を先に設定しておくと、journal_mode の切り替えがロック待ちで失敗しない)
+PRAGMA_ORDER = ("busy_timeout", "journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store")
+
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "wal")
+
+
+def _parse_overrides(value: str) -> Dict[str, str]:
+    overrides = {}
+    for item in filter(None, (item.strip() for item in value.split(","))):
+        name, _, setting = item.partition("=")
+        overrides[name.strip().lower()] = setting.strip()
+    return overrides
+
+
+def is_sqlite(url) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def is_memory_database(url) -> bool:
+    database = make_url(url).database
+    return not database or database == ":memory:" or database.startswith("file::memory:")
+
+
+def get_pragmas(profile: Optional[str] = None, overrides: Optional[str] = None) -> Dict[str, object]:
+    """プロファイルの PRAGMA を、SQLITE_PRAGMAS の上書きを反映して返します。"""
+    profile = profile or SQLITE_PROFILE
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown SQLITE_PROFILE: {profile} (choose from {', '.join(SQLITE_PROFILES)})")
+    pragmas = dict(SQLITE_PROFILES[profile])
+    pragmas.update(_parse_overrides(os.getenv("SQLITE_PRAGMAS", "") if overrides is None else overrides))
+    order = {name: index for index, name in enumerate(PRAGMA_ORDER)}
+    return dict(sorted(pragmas.items(), key=lambda item: order.get(item[0], len(order))))
+
+
+def engine_options(url, profile: Optional[str] = None) -> dict:
+    """create_engine / create_async_engine に渡す、SQLite 用の引数 (SQLite 以外では空)。"""
+    if not is_sqlite(url):
+        return {}
+    profile = profile or SQLITE_PROFILE
+    options = {}
+    if make_url(url).get_driver_name() != "aiosqlite":
+        options["connect_args"] = {"check_same_thread": False} # 同期エンジンはスレッドプールから使う
+    if not is_memory_database(url):
+        # インメモリの DB は1つの接続を共有するプール (StaticPool など) になるので、大きさは指定しない
+        defaults = SQLITE_POOL_DEFAULTS[profile]
+        options["pool_size"] = int(os.getenv("SQLITE_POOL_SIZE", defaults["pool_size"]))
+        options["max_overflow"] = int(os.getenv("SQLITE_MAX_OVERFLOW", defaults["max_overflow"]))
+        options["pool_timeout"] = float(os.getenv("SQLITE_POOL_TIMEOUT", 30))
+    return options
+
+
+def install(engine, profile: Optional[str] = None) -> Dict[str, object]:
+    """
+    同期エンジン (AsyncEngine の場合は .sync_engine) の接続ごとに、プロファイルの PRAGMA を設定します。
+    設定した PRAGMA を返します (SQLite 以外では何もせず空)。
+    """
+    if engine.dialect.name != "sqlite":
+        return {}
+    pragmas = get_pragmas(profile)
+    if is_memory_database(engine.url):
+        pragmas.pop("journal_mode", None) # インメモリの DB は WAL にできない
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+    return pragmas
+
+
+def describe(connection) -> Dict[str, object]:
+    """接続に実際に設定されている値を返します (起動時の確認用)。"""
+    return {
+        name: connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+        for name in PRAGMA_ORDER
+    }
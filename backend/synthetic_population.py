@@ -0,0 +1,270 @@
+# backend/synthetic_population.py
+# 負荷試験用の合成データ (ユーザー・生理記録・チャット履歴) の一括投入
+#
+# get_periods / get_chat_messages / 予測の計算がどの規模から遅くなるかを調べるために、
+# 本番に近い量とばらつきのデータを作ります。
+#   - ユーザーごとに平均周期・周期のばらつき・平均生理期間を変える (不規則な周期、外れ値、記録漏れを含む)
+#   - 一部のユーザーは最新の生理が進行中 (end_date なし)
+#   - チャット履歴は ChatMode の全モードに分散
+# user_cycle_stats と予測日 (単純平均) も同時に作るので、投入後すぐにアプリから使えます。
+#
+# 数百万行を数秒〜数十秒で作れるように、
+#   - 値は BLOCK_USERS 人ずつ NumPy の配列でまとめて生成する (ブロックごとに (seed, ブロック番号) で乱数を初期化するので、同じ seed なら同じデータ)
+#   - SQLite ではドライバーの executemany に保存形式の文字列を直接渡す (SQLAlchemy の型変換を1値ずつ通さない)
+#   - PostgreSQL では COPY で送る (bulk_load)
+# ようにしています。
+#
+# 使い方: python -m backend.manage populate --users 10000 --seed 0
+
+import time
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+from sqlalchemy import Table, func, select
+from sqlalchemy.engine import Connection, Engine
+
+from . import bulk_load
+from .database import ChatMessage, Period, User, UserCycleStats
+from .prediction_engines import DEFAULT_CYCLE_LENGTH, DEFAULT_PERIOD_LENGTH
+from .schemas import ChatMode
+
+BLOCK_USERS = 1000 # 1回に生成・挿入するユーザー数 (1ブロック = 1トランザクション)
+
+CHAT_QUERIES = [
+    "お腹が痛くてつらい",
+    "今日は何もやる気が出ない",
+    "生理前でイライラしちゃう",
+    "頭痛がひどいんだけどどうしたらいい？",
+    "眠くて仕方ない",
+    "甘いものが食べたい",
+    "明日大事な予定があるのに生理になりそう",
+    "腰がだるい",
+]
+
+_DAY_US = 24 * 3600 * 10 ** 6
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+Columns = Dict[str, np.ndarray]
+
+
+@dataclass
+class PopulationConfig:
+    users: int = 1000
+    seed: int = 0
+    cycles_mean: float = 24 # ユーザーあたりの生理記録の件数の平均
+    cycle_length_mean: float = 29.0 # 平均周期の母平均 (日)
+    cycle_length_spread: float = 2.5 # ユーザーごとの平均周期のばらつき (標準偏差)
+    cycle_sd_min: float = 1.0 # ユーザーの周期の標準偏差の範囲
+    cycle_sd_max: float = 5.0
+    period_length_mean: float = 5.0
+    period_length_sd: float = 1.0
+    outlier_rate: float = 0.03 # 極端に長い/短い周期の割合
+    missed_rate: float = 0.02 # 記録漏れ (1周期分抜ける) の割合
+    ongoing_rate: float = 0.15 # 最新の生理が進行中のユーザーの割合
+    chat_messages_mean: float = 30 # ユーザーあたりのチャット履歴の件数の平均
+    partial_rate: float = 0.01 # 途中で切断された回答の割合
+    email_prefix: str = "synthetic"
+    today: Optional[date] = None
+
+
+@dataclass
+class PopulationResult:
+    users: int = 0
+    periods: int = 0
+    chat_messages: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        rows = self.users + self.periods + self.chat_messages
+        return rows / self.seconds if self.seconds else 0.0
+
+
+# ==== 生成 ====
+
+def _group_starts(counts: np.ndarray) -> np.ndarray:
+    """ユーザーごとの件数から、各ユーザーの先頭行の位置を返します。"""
+    return np.r_[0, np.cumsum(counts)[:-1]]
+
+
+def _to_datetime(days: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """日付 (1970-01-01 からの日数) に 6:00〜24:00 のランダムな時刻を足した datetime64[us] を返します。"""
+    offsets = rng.integers(6 * _DAY_US // 24, _DAY_US, size=len(days))
+    return days.astype("datetime64[D]").astype("datetime64[us]") + offsets.astype("timedelta64[us]")
+
+
+def generate_block(config: PopulationConfig, first_user_id: int, users: int, block_index: int, today: date):
+    """
+    users 人分の (users, periods, user_cycle_stats, chat_messages) の列を NumPy 配列で返します。
+    日付は 1970-01-01 からの日数 (NULL は NaT) の datetime64 で持ちます。
+    """
+    rng = np.random.default_rng([config.seed, block_index])
+    today_days = today.toordinal() - _EPOCH_ORDINAL
+    user_ids = np.arange(first_user_id, first_user_id + users, dtype=np.int64)
+
+    # ユーザーごとの傾向
+    cycle_mean = np.maximum(21.0, rng.normal(config.cycle_length_mean, config.cycle_length_spread, users))
+    cycle_sd = rng.uniform(config.cycle_sd_min, config.cycle_sd_max, users)
+    length_mean = np.clip(rng.normal(config.period_length_mean, config.period_length_sd / 2, users), 2.0, 9.0)
+    counts = np.maximum(1, np.rint(rng.exponential(config.cycles_mean, users))).astype(np.int64) if config.cycles_mean > 0 else np.zeros(users, dtype=np.int64)
+    ongoing = (rng.random(users) < config.ongoing_rate) & (counts > 0)
+
+    # 生理記録 (ユーザーごとに連続して並ぶ)
+    owner = np.repeat(np.arange(users), counts)
+    rows = len(owner)
+    cycles = np.maximum(18, np.rint(rng.normal(cycle_mean[owner], cycle_sd[owner]))).astype(np.int64)
+    outlier = rng.random(rows) < config.outlier_rate
+    cycles = np.where(outlier, np.rint(cycles * rng.uniform(0.6, 1.8, rows)).astype(np.int64), cycles)
+    missed = rng.random(rows) < config.missed_rate
+    cycles = cycles + np.where(missed, np.maximum(18, np.rint(rng.normal(cycle_mean[owner], cycle_sd[owner]))).astype(np.int64), 0)
+    lengths = np.minimum(np.clip(np.rint(rng.normal(length_mean[owner], config.period_length_sd)), 2, 10).astype(np.int64), cycles - 1)
+
+    starts = _group_starts(counts)
+    has_rows = counts > 0
+    before = np.cumsum(cycles) - cycles # 先頭からその行の直前までの周期の合計
+    offset = before - before[starts[owner]] # ユーザーの最初の開始日からの日数
+    last_row = starts + counts - 1
+    span = np.zeros(users, dtype=np.int64) # 最新の開始日までの日数
+    span[has_rows] = offset[last_row[has_rows]]
+    # 最新の生理が今日の近く (進行中なら0〜3日前、それ以外は8〜25日前) になるようにさかのぼって始める
+    lead = np.where(ongoing, rng.integers(0, 4, users), rng.integers(8, 26, users))
+    first_start = today_days - span - lead
+    start_days = first_start[owner] + offset
+    end_days = start_days + lengths - 1
+    completed = np.ones(rows, dtype=bool)
+    completed[last_row[ongoing]] = False
+
+    # user_cycle_stats と予測日 (crud.average_period_data_from_stats と同じ単純平均)
+    period_count = np.bincount(owner, weights=completed, minlength=users).astype(np.int64)
+    length_sum = np.bincount(owner, weights=np.where(completed, lengths, 0), minlength=users).astype(np.int64)
+    first_completed = np.full(users, today_days)
+    np.minimum.at(first_completed, owner[completed], start_days[completed])
+    last_completed = np.full(users, 0)
+    np.maximum.at(last_completed, owner[completed], start_days[completed])
+    avg_period_length = np.where(period_count > 0, np.rint(length_sum / np.maximum(period_count, 1)), DEFAULT_PERIOD_LENGTH).astype(np.int64)
+    avg_cycle_length = np.where(period_count > 1, np.rint((last_completed - first_completed) / np.maximum(period_count - 1, 1)), DEFAULT_CYCLE_LENGTH).astype(np.int64)
+
+    nat = np.datetime64("NaT", "D")
+    start_dates = start_days.astype("datetime64[D]")
+    period_created = _to_datetime(start_days, rng)
+    periods = {
+        "user_id": user_ids[owner],
+        "start_date": start_dates,
+        "end_date": np.where(completed, end_days.astype("datetime64[D]"), nat),
+        "prediction_end_date": (start_days + avg_period_length[owner] - 1).astype("datetime64[D]"),
+        "prediction_next_start_date": np.where(completed, (start_days + avg_cycle_length[owner]).astype("datetime64[D]"), nat),
+        "created_at": period_created,
+        "updated_at": np.where(completed, _to_datetime(end_days, rng), period_created),
+    }
+    stats = {
+        "user_id": user_ids,
+        "period_count": period_count,
+        "period_length_sum": length_sum,
+        "first_start_date": np.where(period_count > 0, first_completed.astype("datetime64[D]"), nat),
+        "last_start_date": np.where(period_count > 0, last_completed.astype("datetime64[D]"), nat),
+    }
+
+    # ユーザー (登録日は最初の記録の日、記録がなければ1年以内)
+    registered_days = np.where(has_rows, first_start, today_days - rng.integers(0, 366, users))
+    created_at = _to_datetime(registered_days, rng)
+    stats["updated_at"] = created_at
+    user_rows = {
+        "id": user_ids,
+        "email": np.array([f"{config.email_prefix}{user_id}@example.com" for user_id in user_ids.tolist()], dtype=object),
+        "auth_provider": np.full(users, "local", dtype=object),
+        "name": np.array([f"{config.email_prefix}{user_id}" for user_id in user_ids.tolist()], dtype=object),
+        "created_at": created_at,
+        "updated_at": created_at,
+    }
+
+    # チャット履歴 (登録日から今日までに散らばり、ユーザーごとに時刻順)
+    chat_counts = np.rint(rng.exponential(config.chat_messages_mean, users)).astype(np.int64) if config.chat_messages_mean > 0 else np.zeros(users, dtype=np.int64)
+    chat_owner = np.repeat(np.arange(users), chat_counts)
+    chat_span = np.maximum(today_days - registered_days, 1)
+    chat_days = registered_days[chat_owner] + (rng.random(len(chat_owner)) * chat_span[chat_owner]).astype(np.int64)
+    timestamps = _to_datetime(chat_days, rng)
+    order = np.lexsort((timestamps, chat_owner))
+    modes = np.array([mode.value for mode in ChatMode], dtype=object)
+    queries = np.array(CHAT_QUERIES, dtype=object)
+    mode_index = rng.integers(0, len(modes), len(chat_owner))
+    query_index = rng.integers(0, len(queries), len(chat_owner))
+    responses = np.array(
+        [[f"[{mode}] 「{query}」、話してくれてありがとう。無理しないで、ゆっくり休んでね。" for query in CHAT_QUERIES] for mode in modes],
+        dtype=object,
+    )
+    chat_messages = {
+        "user_id": user_ids[chat_owner],
+        "query": queries[query_index],
+        "response": responses[mode_index, query_index],
+        "mode": modes[mode_index],
+        "timestamp": timestamps[order],
+        "is_partial": rng.random(len(chat_owner)) < config.partial_rate,
+    }
+    return user_rows, periods, stats, chat_messages
+
+
+def generate_blocks(config: PopulationConfig, first_user_id: int) -> Iterator[tuple]:
+    today = config.today or date.today()
+    for block_index, offset in enumerate(range(0, config.users, BLOCK_USERS)):
+        users = min(BLOCK_USERS, config.users - offset)
+        yield generate_block(config, first_user_id + offset, users, block_index, today)
+
+
+# ==== 挿入 ====
+
+def _sqlite_values(values: np.ndarray) -> list:
+    """SQLAlchemy の SQLite 方言と同じ保存形式 (Date: YYYY-MM-DD / DateTime: YYYY-MM-DD HH:MM:SS.ffffff) の値のリストにします。"""
+    if np.issubdtype(values.dtype, np.datetime64):
+        text = np.char.replace(np.datetime_as_string(values), "T", " ").astype(object)
+        text[np.isnat(values)] = None
+        return text.tolist()
+    if values.dtype == bool:
+        return values.astype(np.int64).tolist()
+    return values.tolist()
+
+
+def _python_values(values: np.ndarray) -> list:
+    """date / datetime / int などの Python の値のリストにします (NaT は None)。"""
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype(object).tolist()
+    return values.tolist()
+
+
+def insert_columns(conn: Connection, table: Table, columns: Columns) -> None:
+    """列ごとの配列をまとめて挿入します。"""
+    names = list(columns)
+    if not len(columns[names[0]]):
+        return
+    if conn.dialect.name == "sqlite":
+        placeholders = ", ".join("?" for _ in names)
+        statement = f"INSERT INTO {table.name} ({', '.join(names)}) VALUES ({placeholders})"
+        conn.exec_driver_sql(statement, list(zip(*(_sqlite_values(columns[name]) for name in names))))
+    else:
+        # PostgreSQL (psycopg2) では COPY、それ以外は executemany
+        bulk_load.copy_rows(conn, table, names, list(zip(*(_python_values(columns[name]) for name in names))))
+
+
+def populate(engine: Engine, config: PopulationConfig) -> PopulationResult:
+    """
+    合成データを投入します。ユーザーIDは既存の最大値の続きから振るので、既存のデータはそのまま残ります。
+    BLOCK_USERS 人ごとに1トランザクションで挿入します。
+    """
+    result = PopulationResult()
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        first_user_id = (conn.scalar(select(func.max(User.id))) or 0) + 1
+    for users, periods, stats, chat_messages in generate_blocks(config, first_user_id):
+        with engine.begin() as conn:
+            insert_columns(conn, User.__table__, users)
+            insert_columns(conn, Period.__table__, periods)
+            insert_columns(conn, UserCycleStats.__table__, stats)
+            insert_columns(conn, ChatMessage.__table__, chat_messages)
+        result.users += len(users["id"])
+        result.periods += len(periods["user_id"])
+        result.chat_messages += len(chat_messages["user_id"])
+    with engine.begin() as conn:
+        bulk_load.reset_sequence(conn, User.__table__) # ユーザーIDを明示して入れたので、PostgreSQL のシーケンスを進めておく
+    result.seconds = time.perf_counter() - started
+    return result
@@ -0,0 +1,74 @@
+# backend/tests/test_chat_cache.py
+# チャット回答のキャッシュ: 同じ会話でも、違うキャラ (プロンプト) の回答は共有しない
+
+import asyncio
+import os
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+
+import pytest
+
+from backend.response_cache import InMemoryResponseCacheBackend, ResponseCache, ResponseCacheBackend
+from backend.routers import chat
+
+
+class EchoLLMClient:
+    """システムプロンプトをそのまま回答として返す (どのキャラで回答を作ったかが分かる)。"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def complete(self, prompt, user_id=None):
+        self.calls += 1
+        return prompt[0]["content"]
+
+
+def _setup(monkeypatch) -> EchoLLMClient:
+    client = EchoLLMClient()
+    cache = ResponseCache(InMemoryResponseCacheBackend(maxsize=100, ttl=60), enabled=True, modes="*", max_messages=1)
+    monkeypatch.setattr(chat, "response_cache", cache)
+    monkeypatch.setattr(chat, "get_llm_client", lambda: client)
+    return client
+
+
+MESSAGES = [{"role": "user", "content": "お腹が痛い"}]
+
+
+def test_resolve_character_matches_prompt_lookup():
+    assert chat.resolve_character("nurse") == "nurse"
+    assert chat.resolve_character("Nurse") == chat.DEFAULT_CHARACTER # プロンプトは完全一致で選ぶ
+    assert chat.resolve_character("unknown") == chat.DEFAULT_CHARACTER
+
+
+def test_modes_with_different_prompts_do_not_share_an_answer(monkeypatch):
+    client = _setup(monkeypatch)
+
+    async def run():
+        return [await chat.get_response(mode, MESSAGES) for mode in ("Nurse", "nurse", "Nurse", "nurse")]
+
+    answers = asyncio.run(run())
+    assert answers[0] == chat.CHARACTER_PROMPTS[chat.DEFAULT_CHARACTER]
+    assert answers[1] == chat.CHARACTER_PROMPTS["nurse"]
+    assert answers[2:] == answers[:2] # 2回目はどちらもキャッシュから
+    assert client.calls == 2
+
+
+def test_modes_with_the_same_prompt_share_an_answer(monkeypatch):
+    client = _setup(monkeypatch)
+
+    async def run():
+        return [await chat.get_response(mode, MESSAGES) for mode in ("Nurse", "mother")]
+
+    answers = asyncio.run(run())
+    assert answers == [chat.CHARACTER_PROMPTS["mother"]] * 2
+    assert client.calls == 1
+
+
+def test_partial_backend_fails_on_creation():
+    class GetOnlyBackend(ResponseCacheBackend):
+        async def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnlyBackend()
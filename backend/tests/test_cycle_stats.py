@@ -0,0 +1,76 @@
+# backend/tests/test_cycle_stats.py
+# 周期統計の行がない既存ユーザー: upsert のある方言とない方言 (ロックしてから作る) のどちらでも periods から構築されるか
+
+import asyncio
+import os
+from datetime import date, datetime, timezone
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session
+
+from backend import async_crud, crud
+from backend.database import Base, Period, User, UserCycleStats
+
+PERIODS = [(date(2024, 1, 1), date(2024, 1, 5)), (date(2024, 1, 29), date(2024, 2, 2)), (date(2024, 2, 26), date(2024, 3, 1))]
+
+
+@pytest.fixture(params=["upsert", "lock-then-insert"])
+def dialect_inserts(request, monkeypatch):
+    if request.param == "lock-then-insert":
+        monkeypatch.setattr(crud, "_DIALECT_INSERTS", {})
+        monkeypatch.setattr(async_crud, "_DIALECT_INSERTS", {})
+    return request.param
+
+
+def _seed(session: Session) -> int:
+    now = datetime.now(timezone.utc)
+    user = User(email="stats@example.com", auth_provider="local", created_at=now, updated_at=now)
+    session.add(user)
+    session.flush()
+    session.add_all(Period(user_id=user.id, start_date=start, end_date=end, created_at=now, updated_at=now) for start, end in PERIODS)
+    session.commit()
+    return user.id
+
+
+def _assert_rebuilt(stats: UserCycleStats) -> None:
+    assert (stats.period_count, stats.period_length_sum) == (3, 15)
+    assert (stats.first_start_date, stats.last_start_date) == (PERIODS[0][0], PERIODS[-1][0])
+
+
+def test_missing_stats_are_built_from_periods(tmp_path, dialect_inserts):
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    Base.metadata.create_all(bind=engine)
+    with Session(engine, autoflush=False) as session:
+        user_id = _seed(session)
+        _assert_rebuilt(crud.get_user_cycle_stats(session, user_id, for_update=True))
+        session.commit()
+        _assert_rebuilt(crud.get_user_cycle_stats(session, user_id, for_update=True))
+        session.commit()
+        assert session.scalar(select(func.count()).select_from(UserCycleStats)) == 1
+
+
+def test_missing_stats_are_built_from_periods_async(tmp_path, dialect_inserts):
+    path = tmp_path / "app.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as session:
+        user_id = _seed(session)
+
+    async def run():
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        try:
+            async with AsyncSession(async_engine, autoflush=False, expire_on_commit=False) as session:
+                _assert_rebuilt(await async_crud.get_user_cycle_stats(session, user_id, for_update=True))
+                await session.commit()
+                _assert_rebuilt(await async_crud.get_user_cycle_stats(session, user_id, for_update=True))
+                await session.commit()
+                assert await session.scalar(select(func.count()).select_from(UserCycleStats)) == 1
+        finally:
+            await async_engine.dispose()
+
+    asyncio.run(run())
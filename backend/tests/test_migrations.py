@@ -0,0 +1,43 @@
+# backend/tests/test_migrations.py
+# 新しいデータベースにマイグレーションを全て適用した結果が、ORMモデル (database.py) と一致するか
+
+import os
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+
+from sqlalchemy import create_engine, inspect
+
+from backend.database import Base
+from backend.migrations import LATEST_VERSION, get_current_version, run_migrations, verify_schema
+
+
+def _schema(engine) -> dict:
+    inspector = inspect(engine)
+    return {
+        table_name: {
+            "columns": {column["name"]: (str(column["type"]), column["nullable"]) for column in inspector.get_columns(table_name)},
+            "indexes": {index["name"]: (tuple(index["column_names"]), bool(index["unique"])) for index in inspector.get_indexes(table_name)},
+        }
+        for table_name in inspector.get_table_names()
+        if table_name != "schema_migrations"
+    }
+
+
+def test_fresh_migrations_match_models(tmp_path):
+    migrated = create_engine(f"sqlite:///{tmp_path / 'migrated.db'}")
+    run_migrations(migrated)
+    verify_schema(migrated)
+    with migrated.connect() as conn:
+        assert get_current_version(conn) == LATEST_VERSION
+
+    # マイグレーションを追加せずにモデルだけ変更すると、ここで差分が出る
+    from_models = create_engine(f"sqlite:///{tmp_path / 'models.db'}")
+    Base.metadata.create_all(bind=from_models)
+    assert _schema(migrated) == _schema(from_models)
+
+
+def test_migrations_are_idempotent(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    assert len(run_migrations(engine)) == LATEST_VERSION
+    assert run_migrations(engine) == []